@@ -6,5 +6,6 @@ from .base import AuthError, SystemUser
 from .database_auth import DatabaseAuth
 from .ldap_auth import LdapAuth
 from .model import AbstractAuthDbManager, AuthDbManagerError
-from .perm import extract
+from .perm import extract, compact_perms, PermIndex
+from .password_verifier import PasswordVerifier
 from .identity import IdentityMgr, identity_mgr_factory
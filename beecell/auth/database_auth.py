@@ -7,7 +7,7 @@ from .base import AuthError, AbstractAuth
 
 
 class DatabaseAuth(AbstractAuth):
-    def __init__(self, auth_manager, conn_manager, user_class):
+    def __init__(self, auth_manager, conn_manager, user_class, verifier=None):
         """Database authentication manager
 
         :param auth_manager: authentication manager. A class that extend beecell.auth.model.AuthManager and implement at
@@ -15,11 +15,14 @@ class DatabaseAuth(AbstractAuth):
         :param conn_manager: database connection manager. Instance of a class that extend
             'beecell.db.manager.ConnectionManager' and implement at least two method 'get_session' and 'release_session'
         :param user_class: flask_login user class
+        :param verifier: password verifier (beecell.auth.PasswordVerifier). Used when authentication manager implements
+            'get_password_check' [optional]
         """
         super(DatabaseAuth, self).__init__(user_class)
 
         self.auth_manager_class = auth_manager
         self.conn_manager = conn_manager
+        self.verifier = verifier
 
     def __str__(self):
         return "<DatabaseAuth provider:'%s', manager:'%s', user_class='%s'>" % (
@@ -65,7 +68,22 @@ class DatabaseAuth(AbstractAuth):
 
         # authenticate user
         try:
-            res = auth_manager.verify_user_password(db_user, password)
+            check = NotImplemented
+            if self.verifier is not None:
+                check = auth_manager.get_password_check(db_user)
+            if check is not NotImplemented:
+                func, hashed = check
+                res = self.verifier.verify(func, password, hashed, user=username)
+            else:
+                res = auth_manager.verify_user_password(db_user, password)
+        except AuthError as ex:
+            self.logger.error(ex)
+            # release database session
+            self.conn_manager.release_session(session)
+            if check is NotImplemented:
+                raise AuthError("", "Invalid credentials", code=1)
+            # password verifier errors, like a full queue, are returned as they are
+            raise
         except Exception as ex:
             self.logger.error(ex)
             # release database session
@@ -1,15 +1,246 @@
 from __future__ import annotations
-import binascii
-import zlib
-import json
 import pickle
+from threading import Lock
+from time import time
 from typing import List
+from beecell.cache.local import LocalCache, RedisInvalidator
 from beecell.db.manager import RedisManager
 from .base import AuthError
+from .identity_codec import decode_identity, decode_perms, encode_identity, encode_perms, to_legacy_identity
+from .perm import PermIndex, compact_perms
+
+try:
+    from redis.exceptions import NoScriptError
+except ImportError:
+    NoScriptError = Exception
 
 PREFIX = "identity:"
+# legacy user index, a list of tokens
 PREFIX_INDEX = "identity:index:"
+# user index, a sorted set of tokens scored by expire timestamp
+PREFIX_TOKENS = "identity:tokens:"
+CHANNEL = "identity:invalidate"
 EXPIRE = 3600
+INDEX_MAXSIZE = 1000
+
+# Add or update a token in the user tokens index, prune expired tokens, cap index size removing the tokens that expire
+# first and align index expire time to the longest living token.
+# KEYS[1]: index key. ARGV: token, expire timestamp or inf, now, index max size, XX to update only existing tokens
+INDEX_SCRIPT = """
+if ARGV[5] == 'XX' then
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+local size = redis.call('ZCARD', KEYS[1])
+local maxsize = tonumber(ARGV[4])
+if size > maxsize then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, size - maxsize - 1)
+end
+local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if last[2] == nil then
+    return 0
+elseif last[2] == 'inf' then
+    redis.call('PERSIST', KEYS[1])
+else
+    redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(last[2])))
+end
+return size
+"""
+
+
+class IdentityStats(object):
+    """
+    Process local statistics of identity operations.
+    For every operation are recorded the number of calls, the redis commands sent, the redis round trips and the
+    elapsed time
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._data: dict = {}
+
+    def record(self, op: str, elapsed: float, commands: int = 1, round_trips: int = 1):
+        """Record an operation
+
+        :param op: operation name
+        :param elapsed: operation elapsed time in seconds
+        :param commands: redis commands sent by the operation [default=1]
+        :param round_trips: redis round trips of the operation [default=1]
+        """
+        with self._lock:
+            item = self._data.get(op)
+            if item is None:
+                item = self._data[op] = {"calls": 0, "commands": 0, "round_trips": 0, "elapsed": 0.0, "max": 0.0}
+            item["calls"] += 1
+            item["commands"] += commands
+            item["round_trips"] += round_trips
+            item["elapsed"] += elapsed
+            if elapsed > item["max"]:
+                item["max"] = elapsed
+
+    def get(self) -> dict:
+        """Get statistics
+
+        :return: {<op>: {'calls':.., 'commands':.., 'round_trips':.., 'elapsed':.., 'max':.., 'avg':..}}
+        """
+        with self._lock:
+            res = {}
+            for op, item in self._data.items():
+                res[op] = dict(item)
+                res[op]["avg"] = item["elapsed"] / item["calls"] if item["calls"] > 0 else 0.0
+            return res
+
+    def reset(self):
+        """Reset statistics"""
+        with self._lock:
+            self._data = {}
+
+
+stats = IdentityStats()
+
+
+class IdentityCache(object):
+    """
+    Process local cache of decoded identities, permissions and permissions index.
+    Items are dropped when an identity is stored or removed by any process, through redis pub/sub channel
+    identity:invalidate. The channel is listened by a daemon thread, with uwsgi enable threads in workers.
+    While the channel is not subscribed the cache is bypassed. An identity read from redis is cached only if it was
+    not invalidated while it was read.
+
+    :param redismanager: redis manager used to listen invalidation messages
+    :param maxsize: max number of cached identities [default=1000]
+    :param ttl: max cached identity time to live in seconds [default=30]
+    """
+
+    def __init__(self, redismanager: RedisManager, maxsize: int = 1000, ttl: int = 30) -> None:
+        self.cache = LocalCache(maxsize=maxsize, ttl=ttl)
+        self.invalidator = RedisInvalidator(redismanager, CHANNEL, self._invalidate)
+        # invalidation counters: identity is cached only if it was not invalidated while it was read
+        self.generation = 0
+        self._global_generation = 0
+        self._key_generations = {}
+        self._lock = Lock()
+        self.bypass = 0
+
+    def _invalidate(self, uuid: str):
+        """Drop cached identities. Message is the identity id, None or '*' drops all the identities."""
+        with self._lock:
+            self.generation += 1
+            if uuid is None or uuid == "*":
+                self._global_generation = self.generation
+                self.cache.clear()
+            else:
+                if len(self._key_generations) >= self.cache.maxsize:
+                    # bound memory, reads in progress are not cached
+                    self._key_generations.clear()
+                    self._global_generation = self.generation
+                else:
+                    self._key_generations[uuid] = self.generation
+                self.cache.delete(uuid)
+
+    def get(self, uuid: str) -> dict:
+        """Get cached identity
+
+        :param uuid: identity id
+        :return: cached identity or None
+        """
+        self.invalidator.start()
+        if self.invalidator.connected is False:
+            self.bypass += 1
+            return None
+        return self.cache.get(uuid)
+
+    def set(self, uuid: str, entry: dict, ttl: int, generation: int):
+        """Cache identity if no invalidation message was received after generation was read
+
+        :param uuid: identity id
+        :param entry: cached identity
+        :param ttl: cached identity time to live in seconds
+        :param generation: value of generation read before identity was loaded from redis
+        """
+        with self._lock:
+            if (
+                self.invalidator.connected is True
+                and self._global_generation <= generation
+                and self._key_generations.get(uuid, 0) <= generation
+            ):
+                self.cache.set(uuid, entry, ttl)
+
+    def delete(self, uuid: str):
+        """Delete cached identity. Reads of the identity in progress are not cached.
+
+        :param uuid: identity id
+        """
+        self._invalidate(uuid)
+
+    def publish(self, uuid: str, pipe=None):
+        """Notify identity change to the caches of the other processes
+
+        :param uuid: identity id
+        :param pipe: redis pipeline used to publish the message with other commands [optional]
+        """
+        self.invalidator.publish(uuid, pipe=pipe)
+
+    def get_stats(self) -> dict:
+        """Get cache statistics
+
+        :return: {'size':.., 'hits':.., 'misses':.., 'hit_ratio':.., 'bypass':.., 'connected':.., ..}
+        """
+        res = self.cache.get_stats()
+        res["bypass"] = self.bypass
+        res["connected"] = self.invalidator.connected
+        return res
+
+
+class TtlRefreshPolicy(object):
+    """
+    Coalesced sliding expiration of identities.
+    Identity ttl is extended only when its remaining lifetime, estimated from the last refresh made by this process,
+    falls below fraction of the identity expire time. Steady traffic on an identity sends at most one refresh every
+    (1 - fraction) * expire seconds per process.
+
+    :param fraction: fraction of expire time below which ttl is extended [default=0.5]
+    :param maxsize: max number of tracked identities [default=10000]
+    """
+
+    def __init__(self, fraction: float = 0.5, maxsize: int = 10000) -> None:
+        if fraction <= 0 or fraction > 1:
+            raise AuthError(info="refresh fraction must be in (0, 1]", desc="", code=AuthError.UNDEFINED)
+        self.fraction = fraction
+        self._refreshed = LocalCache(maxsize=maxsize, ttl=float("inf"))
+
+    def should_refresh(self, uuid: str) -> bool:
+        """Check if identity ttl must be extended
+
+        :param uuid: identity id
+        :return: True if identity ttl must be extended
+        """
+        return self._refreshed.get(uuid) is None
+
+    def refreshed(self, uuid: str, expire: int):
+        """Track identity ttl refresh
+
+        :param uuid: identity id
+        :param expire: identity expire time in seconds
+        """
+        self._refreshed.set(uuid, True, expire * (1 - self.fraction))
+
+    def forget(self, uuid: str):
+        """Stop tracking identity
+
+        :param uuid: identity id
+        """
+        self._refreshed.delete(uuid)
+
+    def get_stats(self) -> dict:
+        """Get refresh statistics
+
+        :return: {'tracked':.., 'skipped':.., 'refreshed':..}
+        """
+        res = self._refreshed.get_stats()
+        return {"tracked": res["size"], "skipped": res["hits"], "refreshed": res["misses"]}
 
 
 class IdentityMgr(object):
@@ -18,9 +249,24 @@ class IdentityMgr(object):
     this class manage  the operation on identity as stored on redis
     the identity is created using the user permission in filed user.perms
     When the user restirct his current permissions the full list of permission are stred in field  fullperms
+    When the process local cache is enabled with :meth:`enable_cache` identities are decoded once per process
+    When the refresh policy is enabled with :meth:`enable_refresh_policy` identity ttl is not extended on every request
+    Identities are read in both pickled and :mod:`beecell.auth.identity_codec` binary format. They are stored pickled
+    until :attr:`legacy_format` is set to False, when every process reads the binary format, and the permissions of
+    binary identities are decoded on first use
 
     """
 
+    cache: IdentityCache = None
+    refresh_policy: TtlRefreshPolicy = None
+    # if True identities are stored as pickled dict, readable by releases without identity codec. Set to False
+    # to store the binary format only after all the processes sharing the identities were upgraded
+    legacy_format: bool = True
+    # if True redundant permissions are removed when identity is created, see :func:`compact_perms`
+    reduce_perms: bool = True
+    # user tokens index script registered on first use
+    index_script = None
+
     def __init__(self) -> None:
         self._user: str = None
         self._expire = EXPIRE
@@ -32,17 +278,10 @@ class IdentityMgr(object):
         self._modified: bool = False
         self._perms: List[List] = None
         self._fullperms: List[List] = None
+        self._perm_index: PermIndex = None
+        self._cache_entry: dict = None
         pass
 
-    @property
-    def ttl(self) -> int:
-        return self._mgr.conn.ttl(PREFIX + self._uuid)
-
-    @ttl.setter
-    def ttl(self, expire: int) -> int:
-        self._mgr.conn.expire(PREFIX + self._uuid, expire)
-        self._mgr.conn.expire(PREFIX_INDEX + self.user, expire)
-
     @property
     def expire(self) -> int:
         return self._expire
@@ -50,31 +289,145 @@ class IdentityMgr(object):
     def set_expire(self, value):
         self._expire = value if type(value) == int else EXPIRE
 
+    def _execute(self, op: str, pipe) -> list:
+        """Execute a redis pipeline in a single round trip and record its latency
+
+        :param op: operation name
+        :param pipe: redis pipeline
+        :return: pipeline commands results
+        """
+        commands = len(pipe)
+        stack = list(pipe.command_stack)
+        start = time()
+        try:
+            res = pipe.execute()
+        except NoScriptError:
+            # index script is not loaded yet or was flushed. Load it and send again the commands, they are idempotent
+            self._mgr.conn.script_load(INDEX_SCRIPT)
+            pipe = self._mgr.conn.pipeline(transaction=pipe.transaction)
+            for args, options in stack:
+                pipe.pipeline_execute_command(*args, **options)
+            res = pipe.execute()
+        stats.record(op, time() - start, commands=commands)
+        return res
+
+    def _cache_put(self, name: str, value):
+        """Save decoded data in the process local cache item the identity was loaded from"""
+        if self._cache_entry is not None:
+            self._cache_entry[name] = value
+
+    def _get_cached(self) -> bool:
+        """Get identity from process local cache and reset its ttl
+
+        :return: False if identity is not cached
+        :raises AuthError: raise :class:`AuthError`
+        """
+        entry = IdentityMgr.cache.get(self._uuid)
+        if entry is None:
+            return False
+        identity = dict(entry["identity"])
+        identity["user"] = dict(identity.get("user", {}))
+        self._identity = identity
+        self._user = None
+        if not self.touch():
+            # identity expired in redis
+            IdentityMgr.cache.delete(self._uuid)
+            self._identity = None
+            return False
+        self._compressed_perms = entry["compressed_perms"]
+        self._fullcompressed_perms = entry["fullcompressed_perms"]
+        self._perms = entry.get("perms")
+        self._fullperms = entry.get("fullperms")
+        self._perm_index = entry.get("perm_index")
+        self._cache_entry = entry
+        return True
+
+    def _set_cached(self, generation: int):
+        """Save identity in process local cache
+
+        :param generation: cache generation read before identity was loaded from redis
+        """
+        identity = dict(self._identity)
+        identity["user"] = dict(identity.get("user", {}))
+        entry = {
+            "identity": identity,
+            "compressed_perms": self._compressed_perms,
+            "fullcompressed_perms": self._fullcompressed_perms,
+        }
+        IdentityMgr.cache.set(self._uuid, entry, self._expire, generation)
+        self._cache_entry = entry
+
+    def _index(self, pipe, user: str, never_expire: bool = False, update: bool = False):
+        """Queue user tokens index update on pipeline. Index update costs O(log n) plus the expired tokens pruned.
+
+        :param pipe: redis pipeline
+        :param user: identity user
+        :param never_expire: if True token never expires [default=False]
+        :param update: if True update only a token already in the index [default=False]
+        """
+        now = time()
+        score = "inf" if never_expire else "%.3f" % (now + self._expire)
+        flag = "XX" if update else ""
+        if IdentityMgr.index_script is None:
+            IdentityMgr.index_script = self._mgr.conn.register_script(INDEX_SCRIPT)
+        # EVALSHA queued directly, a script called with a pipeline checks it is loaded with one more round trip
+        sha = IdentityMgr.index_script.sha
+        pipe.evalsha(sha, 1, PREFIX_TOKENS + user, self._uuid, score, "%.3f" % now, INDEX_MAXSIZE, flag)
+
+    def _publish(self, pipe):
+        """Add identity change notification to pipeline
+
+        :param pipe: redis pipeline
+        """
+        if IdentityMgr.cache is not None:
+            # tagged with the sender, this process drops its cached identity without waiting for the echo
+            IdentityMgr.cache.publish(self._uuid, pipe=pipe)
+        else:
+            pipe.publish(CHANNEL, self._uuid)
+
     def _store(self, never_expire=False):
         """Set beehive identity
 
         :param never_expire: if True identity key never expires
         """
-        key_value = pickle.dumps(self._identity)
+        if IdentityMgr.legacy_format is True:
+            key_value = pickle.dumps(to_legacy_identity(self._identity))
+        else:
+            key_value = encode_identity(self._identity)
         user = self._identity.get("user", {}).get("id")
-        self._mgr.conn.setex(PREFIX + self._uuid, self._expire, key_value)
-        # add identity to identity user index
-        self._mgr.conn.lpush(PREFIX_INDEX + user, self._uuid)
-        # set index expire time
+        pipe = self._mgr.conn.pipeline(transaction=True)
+        pipe.setex(PREFIX + self._uuid, self._expire, key_value)
         if never_expire:
-            self._mgr.conn.persist(PREFIX + self._uuid)
-            self._mgr.conn.persist(PREFIX_INDEX + user)
-        else:
-            self._mgr.conn.expire(PREFIX_INDEX + user, self.expire)
+            pipe.persist(PREFIX + self._uuid)
+        # add identity to identity user index
+        self._index(pipe, user, never_expire=never_expire)
+        # notify identity change to process local caches
+        self._publish(pipe)
+        self._execute("store", pipe)
+        if IdentityMgr.cache is not None:
+            IdentityMgr.cache.delete(self._uuid)
+        if IdentityMgr.refresh_policy is not None:
+            if never_expire:
+                IdentityMgr.refresh_policy.forget(self._uuid)
+            else:
+                IdentityMgr.refresh_policy.refreshed(self._uuid, self._expire)
 
     def _remove(self):
         """Remove beehive identity with token uid"""
         try:
             user = self.user
-            self._mgr.conn.delete(PREFIX + self._uuid)
+            pipe = self._mgr.conn.pipeline(transaction=True)
+            pipe.delete(PREFIX + self._uuid)
 
             # delete identity from identity user index
-            self._mgr.conn.lrem(PREFIX_INDEX + user, 1, self._uuid)
+            pipe.zrem(PREFIX_TOKENS + user, self._uuid)
+            # notify identity change to process local caches
+            self._publish(pipe)
+            self._execute("remove", pipe)
+            if IdentityMgr.cache is not None:
+                IdentityMgr.cache.delete(self._uuid)
+            if IdentityMgr.refresh_policy is not None:
+                IdentityMgr.refresh_policy.forget(self._uuid)
 
         except Exception as ex:
             ##dbgprint(ex)
@@ -86,16 +439,21 @@ class IdentityMgr(object):
         :raises AuthError: raise :class:`AuthError`
         """
         try:
+            start = time()
             key_value = self._mgr.conn.get(PREFIX + self._uuid)
+            stats.record("get", time() - start)
             if key_value is not None:
-                self._identity = pickle.loads(key_value)
+                self._identity = decode_identity(key_value)
                 if "fullperms" not in self._identity:
                     self._identity["fullperms"] = self._identity.get("user", {}).get("perms")
                 self._compressed_perms = self._identity.get("user", {}).get("perms")
                 self._fullcompressed_perms = self._identity["fullperms"]
+                self._perms = None
+                self._fullperms = None
+                self._perm_index = None
 
                 if update_ttl:
-                    self.reset_ttl()
+                    self.touch()
             else:
                 raise AuthError(
                     info="Identity %s does not exist or is expired" % self._uuid, desc="", code=AuthError.TOKENEXPIRED
@@ -104,35 +462,58 @@ class IdentityMgr(object):
             ##dbgprint(ex)
             raise AuthError(info=str(ex), desc="", code=AuthError.UNDEFINED)
 
-    def reset_ttl(self, never_expire=False):
+    def reset_ttl(self, never_expire=False) -> bool:
         """reset  identity ttl
 
+        :return: False if identity key does not exist anymore
         :raises AuthError: raise :class:`AuthError`
         """
 
         ##dbgprint(never_expire=never_expire, uuid=self._uuid)
         try:
+            user = self.user
+            pipe = self._mgr.conn.pipeline(transaction=True)
             if never_expire:
-                self._mgr.conn.persist(PREFIX + self._uuid)
-                self._mgr.conn.persist(PREFIX_INDEX + self.user)
+                pipe.persist(PREFIX + self._uuid)
             else:
-                ttl = self._expire if type(self._expire) == int else EXPIRE
-                self._mgr.conn.expire(PREFIX + self._uuid, ttl)
-                self._mgr.conn.expire(PREFIX_INDEX + self.user, ttl)
+                pipe.expire(PREFIX + self._uuid, self._expire if type(self._expire) == int else EXPIRE)
+            self._index(pipe, user, never_expire=never_expire, update=True)
+            res = self._execute("reset_ttl", pipe)
+            return never_expire is True or bool(res[0])
         # set index expire time
 
         except Exception as ex:
             ##dbgprint(ex)
             raise AuthError(info=str(ex), desc="", code=AuthError.CONNECTIONERROR)
 
+    def touch(self) -> bool:
+        """Extend identity ttl according to the refresh policy. Without a refresh policy ttl is always extended.
+
+        :return: False if identity key does not exist anymore
+        :raises AuthError: raise :class:`AuthError`
+        """
+        policy = IdentityMgr.refresh_policy
+        if policy is None:
+            return self.reset_ttl()
+        if not policy.should_refresh(self._uuid):
+            return True
+        res = self.reset_ttl()
+        if res:
+            policy.refreshed(self._uuid, self._expire if type(self._expire) == int else EXPIRE)
+        return res
+
     def save(self, never_expire=False):
         """
         Save identity if not modified only reset ttl
         """
         if self._modified:
             self._store(never_expire)
-        else:
+        elif never_expire:
+            if IdentityMgr.refresh_policy is not None:
+                IdentityMgr.refresh_policy.forget(self._uuid)
             self.reset_ttl(never_expire)
+        else:
+            self.touch()
 
     @property
     def ttl(self) -> int:
@@ -149,14 +530,14 @@ class IdentityMgr(object):
     @property
     def identity(self) -> dict:
         """
-        Get identity dictionary
+        Get identity dictionary. Permissions are returned as base64 encoded zlib compressed json
 
         :raises AuthError: raise :class:`AuthError`
         """
         try:
             if self._identity is None:
                 self._get()
-            return self._identity
+            return to_legacy_identity(self._identity)
         except AuthError as ex:
             raise ex
         except Exception as ex:
@@ -193,13 +574,27 @@ class IdentityMgr(object):
         """
         try:
             if self._fullperms is None:
-                self._fullperms = json.loads(zlib.decompress(binascii.a2b_base64(self._fullcompressed_perms)))
+                self._fullperms = decode_perms(self._fullcompressed_perms)
+                self._cache_put("fullperms", self._fullperms)
             return self._fullperms
 
         except Exception as ex:
             ##dbgprint(ex)
             raise AuthError(info=str(ex), desc="", code=AuthError.UNDEFINED)
 
+    @property
+    def perm_index(self) -> PermIndex:
+        """
+        Get compiled index of identity full list of permissions. Index is built once per identity.
+
+        :returns PermIndex
+        :raises AuthError: raise :class:`AuthError`
+        """
+        if self._perm_index is None:
+            self._perm_index = PermIndex(self.full_perms)
+            self._cache_put("perm_index", self._perm_index)
+        return self._perm_index
+
     @property
     def perms(self) -> List[List]:
         """
@@ -210,7 +605,8 @@ class IdentityMgr(object):
         """
         try:
             if self._perms is None:
-                self._perms = json.loads(zlib.decompress(binascii.a2b_base64(self._compressed_perms)))
+                self._perms = decode_perms(self._compressed_perms)
+                self._cache_put("perms", self._perms)
             return self._perms
         except Exception as ex:
             ##dbgprint(ex)
@@ -225,10 +621,10 @@ class IdentityMgr(object):
         :raises AuthError: raise :class:`AuthError`
         """
         try:
+            self._cache_entry = None
             self._perms = newperms
-            self._compressed_perms = binascii.b2a_base64(zlib.compress(json.dumps(self._perms).encode("utf-8")))
+            self._compressed_perms = encode_perms(self._perms)
             self._identity["user"]["perms"] = self._compressed_perms
-            self._key_value = pickle.dumps(self._identity)
             self._modified = True
 
         except Exception as ex:
@@ -236,14 +632,17 @@ class IdentityMgr(object):
             raise AuthError(info=str(ex), desc="", code=AuthError.UNDEFINED)
 
     def restore_full_perms(self):
+        self._cache_entry = None
         self._identity["user"]["perms"] = self._fullcompressed_perms
         self._compressed_perms = self._fullcompressed_perms
-        self._perms = json.loads(zlib.decompress(binascii.a2b_base64(self._compressed_perms)))
+        self._perms = decode_perms(self._compressed_perms)
         self._modified = True
 
     def can(self, action: str = None, objtype: str = None, objid: str = None, objdef: str = None):
         """
         Verify if identity can execute an action over a certain object type.
+        The check uses the compiled index of the full permissions, see :class:`PermIndex`. Every segment of objid
+        must match the permission objid segment or a '*' wildcard.
         usate solo 2-type 3-definition 4-objid 6-action
         |0-pid  |1-oid |2-type     |3-definition                         | 4-objid       | 5-aid|6-action
         |3554420|444305|'resource' |'Zabbix.Template'                    |'*//*'         |1     |'*'    |
@@ -261,28 +660,33 @@ class IdentityMgr(object):
         :return: bool
         :raises AuthError: raise :class:`AuthError`
         """
-        action = action.lower()
-        objtype = objtype.lower()
-        objid = objid.lower()
-        objdef = objdef.lower()
-        objids = objid.split("//")
         try:
-            res = {}
-            for perm in self.full_perms:
-                perm_objtype = perm[2].lower()
-                perm_objdef = perm[3].lower()
-                perm_objid = perm[4].lower()
-                perm_action = perm[6].lower()
-
-                if objtype == perm_objtype:
-                    if objdef == perm_objdef:
-                        if perm_action == "*" or perm_action == action:
-                            perm_objids = perm_objid.split("//")
-                            if len(objids) == len(perm_objids):
-                                for i in range(0, len(perm_objids)):
-                                    if perm_objids[i] == "*" or perm_objids[i] == objids[i]:
-                                        return True
-            return False
+            return self.perm_index.can(action, objtype, objid, objdef)
+        except AuthError as ex:
+            raise ex
+        except Exception as ex:
+            ##dbgprint(ex)
+            raise AuthError(info=str(ex), desc="", code=10)
+
+    def can_many(self, action: str, objtype: str, objids: List[str], objdef: str, mask: bool = False) -> List:
+        """
+        Verify if identity can execute the same action over a list of objects with the same type and definition.
+        The permissions of objtype and objdef are resolved once for all the objects.
+
+        :param action: str es * view use write,
+        :param objtype: str service, ssh, resource ,
+        :param objids: list of structured object ids
+        :param objdef: str object definition
+        :param mask: if True return a list of bool, one for every objid, otherwise the list of allowed objids
+        :return: list of allowed objids or list of bool
+        :raises AuthError: raise :class:`AuthError`
+        """
+        try:
+            if mask is True:
+                return self.perm_index.mask(action, objtype, objdef, objids)
+            return self.perm_index.filter(action, objtype, objdef, objids)
+        except AuthError as ex:
+            raise ex
         except Exception as ex:
             ##dbgprint(ex)
             raise AuthError(info=str(ex), desc="", code=10)
@@ -291,16 +695,26 @@ class IdentityMgr(object):
         """
         check if identity has permissions for new perms
         if identity new perms are copatible with perms then new perms are set ti identity
+        new perms are checked in batch grouped by action, objtype and objdef
         """
-        for check_per in newperms:
-            check_objtype = check_per[2]
-            check_objdef = check_per[3]
-            check_objid = check_per[4]
-            check_action = check_per[6]
-            if not self.can(action=check_action, objtype=check_objtype, objid=check_objid, objdef=check_objdef):
+        groups = {}
+        for pos, check_per in enumerate(newperms):
+            key = (check_per[6], check_per[2], check_per[3])
+            groups.setdefault(key, []).append(pos)
+
+        allowed = [False] * len(newperms)
+        for (check_action, check_objtype, check_objdef), positions in groups.items():
+            check_objids = [newperms[pos][4] for pos in positions]
+            for pos, res in zip(
+                positions, self.can_many(check_action, check_objtype, check_objids, check_objdef, True)
+            ):
+                allowed[pos] = res
+
+        for check_per, res in zip(newperms, allowed):
+            if not res:
                 raise AuthError(
                     info="action %s, on %s %s %s cannot be perfomed by user"
-                    % (check_action, check_objtype, check_objdef, check_objid),
+                    % (check_per[6], check_per[2], check_per[3], check_per[4]),
                     desc="",
                     code=AuthError.FORBIDDEN,
                 )
@@ -325,8 +739,11 @@ class IdentityMgr(object):
         idmgr._mgr = redismanager
 
         idmgr._modified = True
+        if IdentityMgr.reduce_perms is True:
+            identity = IdentityMgr._reduce_identity_perms(identity)
         idmgr._identity = identity
         idmgr._compressed_perms = idmgr._identity.get("user", {}).get("perms")
+        idmgr._fullcompressed_perms = idmgr._identity.get("fullperms", idmgr._compressed_perms)
         idmgr._store(never_expire=not expire)
         return idmgr
 
@@ -346,6 +763,42 @@ class IdentityMgr(object):
 
         # self.logger.info("Set identity %s in redis" % uid)
 
+    @staticmethod
+    def _compact_block(block):
+        """Remove redundant permissions from a perms block
+
+        :param block: perms block or legacy perms string
+        :return: perms block, unchanged if there are no redundant permissions or if it can not be decoded
+        """
+        try:
+            perms = decode_perms(block)
+        except Exception:
+            return block
+        reduced = compact_perms(perms)
+        if len(reduced) == len(perms):
+            return block
+        return encode_perms(reduced)
+
+    @staticmethod
+    def _reduce_identity_perms(identity: dict) -> dict:
+        """Get a copy of identity without redundant permissions in user.perms and fullperms
+
+        :param identity: dictionary with login identity
+        :return: dictionary with login identity
+        """
+        user = identity.get("user")
+        if not isinstance(user, dict) or user.get("perms") is None:
+            return identity
+        identity = dict(identity)
+        perms = user["perms"]
+        identity["user"] = dict(user, perms=IdentityMgr._compact_block(perms))
+        fullperms = identity.get("fullperms")
+        if fullperms is perms or fullperms == perms:
+            identity["fullperms"] = identity["user"]["perms"]
+        elif fullperms is not None:
+            identity["fullperms"] = IdentityMgr._compact_block(fullperms)
+        return identity
+
     @staticmethod
     def get_identity(uuid, redismanager: RedisManager, update_ttl: bool = False) -> dict:
         """Get identity
@@ -358,7 +811,7 @@ class IdentityMgr(object):
         imgr._uuid = uuid
         imgr._mgr = redismanager
         imgr._get(update_ttl=update_ttl)
-        data = imgr._identity
+        data = to_legacy_identity(imgr._identity)
         if update_ttl:
             data["ttl"] = imgr._expire
         else:
@@ -368,27 +821,174 @@ class IdentityMgr(object):
         return data
 
     @staticmethod
-    def get_identities(redismanager: RedisManager):
-        """Get identities
+    def _fetch_identities(redismanager: RedisManager, keys: list) -> list:
+        """Get identities raw values and ttl in a single round trip
 
-        :return: [{'uid':..., 'user':..., timestamp':..., 'pubkey':..., 'seckey':...}, ..]
+        :param redismanager: redis manager
+        :param keys: identity keys
+        :return: [(raw value, ttl), ..] of the identities that still exist
+        """
+        if len(keys) == 0:
+            return []
+        start = time()
+        pipe = redismanager.conn.pipeline(transaction=False)
+        pipe.mget(keys)
+        for key in keys:
+            pipe.ttl(key)
+        res = pipe.execute()
+        stats.record("fetch", time() - start, commands=len(keys) + 1)
+        return [(value, ttl) for value, ttl in zip(res[0], res[1:]) if value is not None]
+
+    @staticmethod
+    def _scan_identities(redismanager: RedisManager, cursor: int = 0, count: int = 500, user: str = None):
+        """Get a page of identities raw values
+
+        :param redismanager: redis manager
+        :param cursor: page cursor, 0 for the first page [default=0]
+        :param count: page size hint [default=500]
+        :param user: get only the identities of user [optional]
+        :return: (next cursor, [(raw value, ttl), ..]). Next cursor is 0 after the last page
+        """
+        if user is None:
+            cursor, keys = redismanager.scan(PREFIX + "*", cursor=cursor, count=count)
+            # skip user index keys
+            index_prefixes = (PREFIX_INDEX.encode("utf-8"), PREFIX_TOKENS.encode("utf-8"))
+            keys = [
+                key
+                for key in keys
+                if not (key if isinstance(key, bytes) else key.encode("utf-8")).startswith(index_prefixes)
+            ]
+        else:
+            uuids = IdentityMgr.get_user_tokens(redismanager, user, start=cursor, num=count)
+            keys = [PREFIX + uuid for uuid in uuids]
+            cursor = cursor + count if len(uuids) == count else 0
+        return cursor, IdentityMgr._fetch_identities(redismanager, keys)
+
+    @staticmethod
+    def get_user_tokens(redismanager: RedisManager, user: str, start: int = None, num: int = None) -> List[str]:
+        """Get the tokens of user that are not expired, ordered by expire time. Cost is O(log n) plus the tokens
+        returned.
+
+        :param redismanager: redis manager
+        :param user: identity user
+        :param start: index of the first token returned [optional]
+        :param num: max number of tokens returned [optional]
+        :return: list of tokens
+        """
+        uuids = redismanager.conn.zrangebyscore(PREFIX_TOKENS + user, "(%.3f" % time(), "+inf", start=start, num=num)
+        return [uuid.decode("utf-8") if isinstance(uuid, bytes) else uuid for uuid in uuids]
+
+    @staticmethod
+    def _load_identity(value, ttl: int) -> dict:
+        """Decode an identity raw value"""
+        data = to_legacy_identity(decode_identity(value))
+        data["ttl"] = ttl
+        return data
+
+    @staticmethod
+    def scan_identities(redismanager: RedisManager, cursor: int = 0, count: int = 500, user: str = None):
+        """Get a page of identities. Keys are walked with SCAN and values are fetched with a single round trip per page.
+        Use the returned cursor to get the next page.
+
+        :param redismanager: redis manager
+        :param cursor: page cursor, 0 for the first page [default=0]
+        :param count: page size hint [default=500]
+        :param user: get only the identities of user [optional]
+        :return: (next cursor, [{'uid':..., 'user':..., timestamp':..., 'pubkey':..., 'seckey':..., 'ttl':...}, ..]).
+            Next cursor is 0 after the last page
         """
         try:
-            res = []
-            for key in redismanager.conn.keys(PREFIX + "*"):
-                try:
-                    identity = redismanager.conn.get(key)
-                except Exception as ex:
-                    ##dbgprint(ex)
-                    continue
-                data = pickle.loads(identity)
-                data["ttl"] = redismanager.conn.ttl(key)
-                res.append(data)
-            return res
+            cursor, items = IdentityMgr._scan_identities(redismanager, cursor=cursor, count=count, user=user)
+            return cursor, [IdentityMgr._load_identity(value, ttl) for value, ttl in items]
+        except Exception as ex:
+            ##dbgprint(ex)
+            raise AuthError(info=str(ex), desc="No identities found", code=AuthError.UNDEFINED)
+
+    @staticmethod
+    def iter_identities(redismanager: RedisManager, count: int = 500, user: str = None):
+        """Iterate over identities. Keys are walked with SCAN, values are fetched in batches and every identity is
+        decoded only when it is yielded.
+
+        :param redismanager: redis manager
+        :param count: batch size hint [default=500]
+        :param user: get only the identities of user [optional]
+        :return: generator of {'uid':..., 'user':..., timestamp':..., 'pubkey':..., 'seckey':..., 'ttl':...}
+        """
+        try:
+            cursor = 0
+            while True:
+                cursor, items = IdentityMgr._scan_identities(redismanager, cursor=cursor, count=count, user=user)
+                for value, ttl in items:
+                    yield IdentityMgr._load_identity(value, ttl)
+                if cursor == 0:
+                    break
         except Exception as ex:
             ##dbgprint(ex)
             raise AuthError(info=str(ex), desc="No identities found", code=AuthError.UNDEFINED)
 
+    @staticmethod
+    def get_identities(redismanager: RedisManager, user: str = None):
+        """Get identities
+
+        :param user: get only the identities of user [optional]
+        :return: [{'uid':..., 'user':..., timestamp':..., 'pubkey':..., 'seckey':...}, ..]
+        """
+        return list(IdentityMgr.iter_identities(redismanager, user=user))
+
+    @staticmethod
+    def get_stats() -> dict:
+        """Get process local statistics of identity operations. When process local cache or refresh policy are
+        enabled keys cache and refresh contain their statistics.
+
+        :return: {<op>: {'calls':.., 'commands':.., 'round_trips':.., 'elapsed':.., 'max':.., 'avg':..},
+                  'cache': {'size':.., 'hits':.., 'misses':.., 'hit_ratio':.., ..},
+                  'refresh': {'tracked':.., 'skipped':.., 'refreshed':..}}
+        """
+        res = stats.get()
+        if IdentityMgr.cache is not None:
+            res["cache"] = IdentityMgr.cache.get_stats()
+        if IdentityMgr.refresh_policy is not None:
+            res["refresh"] = IdentityMgr.refresh_policy.get_stats()
+        return res
+
+    @staticmethod
+    def enable_refresh_policy(fraction: float = 0.5, maxsize: int = 10000) -> TtlRefreshPolicy:
+        """Enable coalesced sliding expiration. Identity ttl is extended only when its remaining lifetime falls below
+        fraction of expire time.
+
+        :param fraction: fraction of expire time below which ttl is extended [default=0.5]
+        :param maxsize: max number of tracked identities [default=10000]
+        :return: TtlRefreshPolicy
+        """
+        IdentityMgr.refresh_policy = TtlRefreshPolicy(fraction=fraction, maxsize=maxsize)
+        return IdentityMgr.refresh_policy
+
+    @staticmethod
+    def disable_refresh_policy():
+        """Disable coalesced sliding expiration"""
+        IdentityMgr.refresh_policy = None
+
+    @staticmethod
+    def enable_cache(redismanager: RedisManager, maxsize: int = 1000, ttl: int = 30) -> IdentityCache:
+        """Enable process local cache of identities used by :meth:`factory`
+
+        :param redismanager: redis manager used to listen invalidation messages
+        :param maxsize: max number of cached identities [default=1000]
+        :param ttl: max cached identity time to live in seconds [default=30]
+        :return: IdentityCache
+        """
+        if IdentityMgr.cache is not None:
+            IdentityMgr.cache.invalidator.stop()
+        IdentityMgr.cache = IdentityCache(redismanager, maxsize=maxsize, ttl=ttl)
+        return IdentityMgr.cache
+
+    @staticmethod
+    def disable_cache():
+        """Disable process local cache of identities"""
+        if IdentityMgr.cache is not None:
+            IdentityMgr.cache.invalidator.stop()
+        IdentityMgr.cache = None
+
     @staticmethod
     def factory(
         uuid: str, controller=None, module=None, apimanager=None, redismanager: RedisManager = None
@@ -414,12 +1014,17 @@ class IdentityMgr(object):
                 raise AuthError(info="cannot find a redis connection", desc="", code=AuthError.CONNECTIONERROR)
 
             ##dbgprint( idmgr=ret),
-            ret._get()
+            if IdentityMgr.cache is None:
+                ret._get()
+            elif not ret._get_cached():
+                generation = IdentityMgr.cache.generation
+                ret._get()
+                ret._set_cached(generation)
             ##dbgprint( idmgr=ret),
             return ret
         except Exception as ex:
             ##dbgprint(ex)
-            raise AuthError(info=ex, desc="", code=AuthError.PASSWORDEXPIRED)
+            raise AuthError(info=str(ex), desc="", code=AuthError.PASSWORDEXPIRED)
 
 
 def identity_mgr_factory(
@@ -0,0 +1,259 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+"""Binary serialization of identities.
+
+Identity layout, version 1::
+
+    MAGIC | version (1 byte) | flags (1 byte) | meta length, perms length, fullperms length (3 x uint32) |
+    meta | perms block | fullperms block
+
+meta is the pickled identity without user.perms and fullperms. Permissions are stored in blocks that are decoded only
+when they are used. Perms block layout, version 1::
+
+    PERMS_MAGIC | version (1 byte) | zlib(rows, cols (2 x uint32) | column 1 | column 2 | ..)
+
+Every column starts with a type byte: 'q' int64 array, 's' string table plus uint16/uint32 index array, 'j' json list.
+
+Identities stored as pickled dict, with permissions as base64 encoded zlib compressed json, are still decoded.
+"""
+
+import binascii
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+from typing import List, Union
+import ujson as json
+
+MAGIC = b"\x00BID"
+PERMS_MAGIC = b"\x00BPB"
+VERSION = 1
+
+# identity flags
+FULLPERMS_SAME = 1
+NO_PERMS = 2
+NO_FULLPERMS = 4
+
+HEADER = struct.Struct(">4sBBIII")
+PERMS_HEADER = struct.Struct(">II")
+LENGTH = struct.Struct(">I")
+
+
+class IdentityCodecError(Exception):
+    pass
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _encode_column(column: list) -> bytes:
+    if all(type(value) is int for value in column):
+        try:
+            data = _to_little_endian(array("q", column))
+            return b"q" + LENGTH.pack(len(data)) + data
+        except OverflowError:
+            pass
+    elif all(type(value) is str for value in column):
+        table = {}
+        indexes = [table.setdefault(value, len(table)) for value in column]
+        values = json.dumps(list(table.keys()), ensure_ascii=False).encode("utf-8")
+        typecode = "H" if len(table) < 65536 else "I"
+        data = _to_little_endian(array(typecode, indexes))
+        return b"s" + LENGTH.pack(len(values)) + values + typecode.encode("ascii") + LENGTH.pack(len(data)) + data
+    data = json.dumps(column, ensure_ascii=False).encode("utf-8")
+    return b"j" + LENGTH.pack(len(data)) + data
+
+
+def _decode_column(data: bytes, pos: int):
+    kind = data[pos : pos + 1]
+    (size,) = LENGTH.unpack_from(data, pos + 1)
+    pos += 5
+    if kind == b"q":
+        return _from_little_endian("q", data[pos : pos + size]).tolist(), pos + size
+    if kind == b"s":
+        table = json.loads(data[pos : pos + size].decode("utf-8"))
+        pos += size
+        typecode = data[pos : pos + 1].decode("ascii")
+        (size,) = LENGTH.unpack_from(data, pos + 1)
+        pos += 5
+        indexes = _from_little_endian(typecode, data[pos : pos + size])
+        return [table[index] for index in indexes], pos + size
+    if kind == b"j":
+        return json.loads(data[pos : pos + size].decode("utf-8")), pos + size
+    raise IdentityCodecError("unknown perms column type %s" % kind)
+
+
+def is_perms_block(block) -> bool:
+    """Check if block is a binary perms block
+
+    :param block: perms block
+    :return: True if block is a binary perms block, False if it is a legacy perms string
+    """
+    return isinstance(block, bytes) and block[:4] == PERMS_MAGIC
+
+
+def encode_perms(perms: List[List], level: int = 6) -> bytes:
+    """Encode a list of permissions in a columnar compressed block
+
+    :param perms: list of permissions like [pid, oid, objtype, objdef, objid, aid, action]
+    :param level: zlib compression level [default=6]
+    :return: perms block
+    """
+    cols = len(perms[0]) if len(perms) > 0 else 0
+    if any(len(perm) != cols for perm in perms):
+        # rows of different size are stored as a single json column
+        payload = PERMS_HEADER.pack(len(perms), 0) + _encode_column([list(perm) for perm in perms])
+    else:
+        payload = PERMS_HEADER.pack(len(perms), cols)
+        payload += b"".join(_encode_column(list(column)) for column in zip(*perms))
+    return PERMS_MAGIC + bytes([VERSION]) + zlib.compress(payload, level)
+
+
+def decode_perms(block: Union[bytes, str]) -> List[List]:
+    """Decode a perms block. Legacy base64 encoded zlib compressed json permissions are decoded too.
+
+    :param block: perms block
+    :return: list of permissions like [pid, oid, objtype, objdef, objid, aid, action]
+    """
+    if not is_perms_block(block):
+        return json.loads(zlib.decompress(binascii.a2b_base64(block)))
+    if block[4] != VERSION:
+        raise IdentityCodecError("unsupported perms block version %s" % block[4])
+    data = zlib.decompress(block[5:])
+    rows, cols = PERMS_HEADER.unpack_from(data, 0)
+    pos = PERMS_HEADER.size
+    if cols == 0:
+        return _decode_column(data, pos)[0] if rows > 0 else []
+    columns = []
+    for i in range(cols):
+        column, pos = _decode_column(data, pos)
+        columns.append(column)
+    return [list(row) for row in zip(*columns)]
+
+
+def to_perms_block(block: Union[bytes, str]) -> bytes:
+    """Convert a legacy perms string in a perms block
+
+    :param block: legacy perms string or perms block
+    :return: perms block
+    """
+    if block is None or is_perms_block(block):
+        return block
+    return encode_perms(decode_perms(block))
+
+
+def to_legacy_perms(block: Union[bytes, str]) -> bytes:
+    """Convert a perms block in a legacy base64 encoded zlib compressed json permissions string
+
+    :param block: legacy perms string or perms block
+    :return: legacy perms string
+    """
+    if not is_perms_block(block):
+        return block
+    return binascii.b2a_base64(zlib.compress(json.dumps(decode_perms(block)).encode("utf-8")))
+
+
+def is_identity(data: bytes) -> bool:
+    """Check if data is a binary identity
+
+    :param data: serialized identity
+    :return: True if data is a binary identity, False if it is a legacy pickled identity
+    """
+    return data[:4] == MAGIC
+
+
+def _to_stored_block(block: Union[bytes, str]) -> bytes:
+    """Get the block stored in a binary identity. Perms that can not be decoded are stored as they are."""
+    try:
+        return to_perms_block(block)
+    except Exception:
+        return block.encode("utf-8") if isinstance(block, str) else block
+
+
+def encode_identity(identity: dict) -> bytes:
+    """Encode identity. Legacy perms strings are converted in perms blocks.
+
+    :param identity: identity dict
+    :return: serialized identity
+    """
+    meta = dict(identity)
+    user = dict(meta.get("user") or {})
+    flags = 0
+    perms = _to_stored_block(user.pop("perms", None))
+    if perms is None:
+        perms = b""
+        flags |= NO_PERMS
+    fullperms = meta.pop("fullperms", None)
+    if fullperms is None:
+        fullperms = b""
+        flags |= NO_FULLPERMS
+    elif fullperms is identity.get("user", {}).get("perms") or fullperms == identity.get("user", {}).get("perms"):
+        fullperms = b""
+        flags |= FULLPERMS_SAME
+    else:
+        fullperms = _to_stored_block(fullperms)
+    meta["user"] = user
+    meta = pickle.dumps(meta, protocol=4)
+    header = HEADER.pack(MAGIC, VERSION, flags, len(meta), len(perms), len(fullperms))
+    return b"".join((header, meta, perms, fullperms))
+
+
+def decode_identity(data: bytes) -> dict:
+    """Decode identity. Legacy pickled identities are decoded too. Permissions are left in their blocks, use
+    :func:`decode_perms` to decode them.
+
+    :param data: serialized identity
+    :return: identity dict
+    """
+    if not is_identity(data):
+        return pickle.loads(data)
+    magic, version, flags, meta_len, perms_len, fullperms_len = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise IdentityCodecError("unsupported identity version %s" % version)
+    pos = HEADER.size
+    identity = pickle.loads(data[pos : pos + meta_len])
+    pos += meta_len
+    perms = data[pos : pos + perms_len]
+    pos += perms_len
+    if not flags & NO_PERMS:
+        identity.setdefault("user", {})["perms"] = perms
+    if flags & FULLPERMS_SAME:
+        identity["fullperms"] = perms
+    elif not flags & NO_FULLPERMS:
+        identity["fullperms"] = data[pos : pos + fullperms_len]
+    return identity
+
+
+def to_legacy_identity(identity: dict) -> dict:
+    """Convert identity perms blocks in legacy perms strings. Input identity is not changed, perms blocks are converted
+    in a shallow copy.
+
+    :param identity: identity dict
+    :return: identity dict
+    """
+    identity = dict(identity)
+    user = identity.get("user")
+    if isinstance(user, dict) and is_perms_block(user.get("perms")):
+        same = identity.get("fullperms") is user["perms"]
+        user = identity["user"] = dict(user)
+        user["perms"] = to_legacy_perms(user["perms"])
+        if same:
+            identity["fullperms"] = user["perms"]
+    if is_perms_block(identity.get("fullperms")):
+        identity["fullperms"] = to_legacy_perms(identity["fullperms"])
+    return identity
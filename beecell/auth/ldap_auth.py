@@ -4,8 +4,12 @@
 
 from six import ensure_str
 import ldap
+from ldap.controls import SimplePagedResultsControl
+from beecell.cache.local import LocalCache
 from beecell.simple import truncate
 from .base import AuthError, AbstractAuth
+from .ldap_pool import LdapConnectionPool
+from .ldap_servers import LdapServerSet
 
 
 class LdapAuth(AbstractAuth):
@@ -21,10 +25,21 @@ class LdapAuth(AbstractAuth):
         search_id="uid",
         bind_user=None,
         bind_pwd=None,
+        pool_size=None,
+        pool_max_lifetime=600,
+        pool_idle_check=30,
+        pool_timeout=10,
+        cache_ttl=None,
+        cache_negative_ttl=30,
+        cache_size=1000,
+        page_size=500,
+        server_stagger=0.25,
+        server_down_time=30,
     ):
         """Ldap auhtentication provider
 
-        :param host: Ldap hostname
+        :param host: Ldap hostname, or list of equivalent Ldap hostnames like the domain controllers of a domain. A
+            list can be passed also as comma separated string. Every host can contain the port like host:port
         :param port: Ldap port number. Default=389 - ldap, 636 - ldaps
         :param user_class: extension of class base.SystemUser
         :param bool ssl: if True enable ldaps protocol
@@ -34,10 +49,26 @@ class LdapAuth(AbstractAuth):
         :param search_id: user search id [default=uid]
         :param bind_user: bind user name
         :param bind_pwd: bind user password
+        :param pool_size: if set searches and user binds use two pools of persistent connections of this size
+            [optional]
+        :param pool_max_lifetime: seconds after which a pooled connection is replaced [default=600]
+        :param pool_idle_check: seconds of inactivity after which a pooled connection is checked [default=30]
+        :param pool_timeout: max seconds to wait for a free pooled connection [default=10]
+        :param cache_ttl: if set user records found by search_user are cached for this number of seconds [optional]
+        :param cache_negative_ttl: seconds a user not found is cached [default=30]
+        :param cache_size: max number of cached user records [default=1000]
+        :param page_size: number of entries requested for every page by paged searches [default=500]
+        :param server_stagger: with more hosts, seconds to wait for a host before trying the next one [default=0.25]
+        :param server_down_time: with more hosts, seconds a failed host is tried after the healthy ones [default=30]
         """
         super(LdapAuth, self).__init__(user_class)
 
-        self.host = host
+        if host is None:
+            host = [None]
+        elif isinstance(host, str):
+            host = [h.strip() for h in host.split(",") if h.strip() != ""]
+        self.hosts = list(host)
+        self.host = self.hosts[0]
         self.port = port
         self.dn = dn
         self.conn = None
@@ -48,6 +79,34 @@ class LdapAuth(AbstractAuth):
         self.bind_user = bind_user
         self.bind_pwd = bind_pwd
 
+        # with more hosts connections are opened racing the hosts, from the fastest healthy one
+        self.servers = None
+        if len(self.hosts) > 1:
+            self.servers = LdapServerSet(self.hosts, stagger=server_stagger, down_time=server_down_time)
+
+        # service pool bound with bind user, used for searches, and user pool used to verify user credentials
+        self.pool = None
+        self.user_pool = None
+        if pool_size is not None:
+            params = {
+                "maxsize": pool_size,
+                "max_lifetime": pool_max_lifetime,
+                "idle_check": pool_idle_check,
+                "wait_timeout": pool_timeout,
+            }
+            self.pool = LdapConnectionPool(
+                self._open, bind_dn=bind_user, bind_pwd=bind_pwd, name="%s-service" % self.host, **params
+            )
+            self.user_pool = LdapConnectionPool(self._open, name="%s-user" % self.host, **params)
+
+        # user records cache, users not found are cached with value None
+        self.page_size = page_size
+        self.cache_negative_ttl = cache_negative_ttl
+        self.user_cache = None
+        if cache_ttl is not None:
+            self.user_cache = LocalCache(maxsize=cache_size, ttl=max(cache_ttl, cache_negative_ttl))
+            self.cache_ttl = cache_ttl
+
     def __str__(self):
         return "<LdapAuth host:%s, port:%s, ssl:%s, dn:%s>" % (
             self.host,
@@ -58,37 +117,74 @@ class LdapAuth(AbstractAuth):
 
     def connect(self):
         """Open connection to Ldap."""
+        self.conn = self._open()
+        return self.conn
+
+    def _open(self):
+        """Open a new connection to Ldap. With more hosts the connection is opened racing the hosts."""
+        if self.servers is not None:
+            server, conn = self.servers.connect(self._open_established, self.timeout)
+            return conn
+        return self._initialize(self.host)
+
+    def _initialize(self, host):
+        """Create a connection to Ldap host. Connection is established by the first operation."""
         if self.ssl:
-            self._connect_ssl()
+            conn = self._connect_ssl(host)
         else:
-            self._connect()
+            conn = self._connect(host)
 
-        self.conn.timeout = self.timeout
-        self.conn.network_timeout = self.timeout
-        return self.conn
+        conn.timeout = self.timeout
+        conn.network_timeout = self.timeout
+        return conn
 
-    def _connect(self):
+    def _open_established(self, host):
+        """Open a connection to Ldap host and wait until it is established."""
+        conn = self._initialize(host)
+        try:
+            conn.whoami_s()
+        except Exception:
+            try:
+                conn.unbind_s()
+            except Exception:
+                pass
+            raise
+        return conn
+
+    def _get_uri(self, scheme, host):
+        if host is not None and host.count(":") == 1:
+            return "%s://%s" % (scheme, host)
+        return "%s://%s:%s" % (scheme, host, self.port)
+
+    def _server_failed(self, ex):
+        """Record the failure of the current connection host."""
+        if self.servers is not None and self.conn is not None:
+            self.servers.failed_connection(self.conn, ex)
+
+    def _connect(self, host=None):
         """Open connection to Ldap."""
         if self.port is None:
             self.port = 389
 
-        conn_uri = "ldap://%s:%s" % (self.host, self.port)
-        self.conn = ldap.initialize(conn_uri)
+        conn_uri = self._get_uri("ldap", host or self.host)
+        conn = ldap.initialize(conn_uri)
         self.logger.debug("Open non-secure connection to %s" % conn_uri)
+        return conn
 
-    def _connect_ssl(self):
+    def _connect_ssl(self, host=None):
         """Open connection to ldaps portal2."""
         if self.port is None:
             self.port = 636
 
-        conn_uri = "ldaps://%s:%s" % (self.host, self.port)
+        conn_uri = self._get_uri("ldaps", host or self.host)
         ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-        self.conn = ldap.initialize(conn_uri)
-        self.conn.set_option(ldap.OPT_REFERRALS, 0)
-        self.conn.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
-        self.conn.set_option(ldap.OPT_X_TLS, ldap.OPT_X_TLS_DEMAND)
-        self.conn.set_option(ldap.OPT_X_TLS_DEMAND, True)
+        conn = ldap.initialize(conn_uri)
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
+        conn.set_option(ldap.OPT_X_TLS, ldap.OPT_X_TLS_DEMAND)
+        conn.set_option(ldap.OPT_X_TLS_DEMAND, True)
         self.logger.debug("Open secure connection to %s" % conn_uri)
+        return conn
 
     def close(self):
         """Close connection to Ldap."""
@@ -97,6 +193,30 @@ class LdapAuth(AbstractAuth):
             self.logger.debug("Close connection to %s" % self.conn)
             self.conn = None
 
+    def close_pool(self):
+        """Close pooled connections."""
+        for pool in (self.pool, self.user_pool):
+            if pool is not None:
+                pool.clear()
+
+    def get_server_stats(self):
+        """Get hosts health and latency statistics
+
+        :return: list of host statistics or None if a single host is configured
+        """
+        if self.servers is None:
+            return None
+        return self.servers.get_stats()
+
+    def get_pool_stats(self):
+        """Get connection pools statistics
+
+        :return: {'service':.., 'user':..} or None if connection pools are not enabled
+        """
+        if self.pool is None:
+            return None
+        return {"service": self.pool.get_stats(), "user": self.user_pool.get_stats()}
+
     def query(self, query, fields=None):
         """Make a query on the Ldap.
 
@@ -104,6 +224,9 @@ class LdapAuth(AbstractAuth):
         :param fields: query fields
         :return: query response
         """
+        if self.pool is not None:
+            return self._query_pooled(query, fields=fields)
+
         if self.conn:
             try:
                 # make query
@@ -124,6 +247,90 @@ class LdapAuth(AbstractAuth):
         else:
             raise AuthError("", "No connection to server", code=0)
 
+    def _query_pooled(self, query, fields=None):
+        """Make a query on the Ldap using a connection of the service pool.
+
+        :param query: query string
+        :param fields: query fields
+        :return: query response
+        """
+        try:
+            with self.pool.connection() as conn:
+                records = conn.search_s(self.dn, ldap.SCOPE_SUBTREE, query, fields)
+            self.logger.debug("Query Ldap: %s" % query)
+        except ldap.LDAPError as ex:
+            self.logger.error("Ldap error: %s" % ex)
+            raise AuthError("", "Ldap error: %s" % ex, code=9)
+        return records
+
+    def _iter_pages(self, conn, query, fields=None, page_size=None, abandon=False):
+        """Run a search with the paged results control and yield the entries of every page. The control is not
+        critical, a server that does not support it returns all the entries in one page.
+
+        :param abandon: if True and the generator is closed before the last page, ask the server to release the
+            search [default=False]
+        """
+        control = SimplePagedResultsControl(False, size=page_size or self.page_size, cookie="")
+        cookie = None
+        try:
+            while True:
+                msgid = conn.search_ext(self.dn, ldap.SCOPE_SUBTREE, query, fields, serverctrls=[control])
+                rtype, rdata, rmsgid, serverctrls = conn.result3(msgid)
+                cookie = None
+                for ctrl in serverctrls:
+                    if ctrl.controlType == SimplePagedResultsControl.controlType:
+                        cookie = ctrl.cookie
+                for dn, attrs in rdata:
+                    # skip search references
+                    if dn is not None:
+                        yield dn, attrs
+                if not cookie:
+                    break
+                control.cookie = cookie
+        except GeneratorExit:
+            if abandon is True and cookie:
+                # a page request with size 0 releases the search on the server
+                try:
+                    control.size = 0
+                    control.cookie = cookie
+                    msgid = conn.search_ext(self.dn, ldap.SCOPE_SUBTREE, query, fields, serverctrls=[control])
+                    conn.result3(msgid)
+                except ldap.LDAPError as ex:
+                    self.logger.warning("Ldap paged query abandon error: %s" % ex)
+            raise
+
+    def iter_search(self, query, fields=None, page_size=None):
+        """Make a paged query on the Ldap. Entries are requested one page at a time, so a search is not limited by
+        server size limit and only one page is kept in memory. If the generator is closed before the last page the
+        search is abandoned, a pooled connection is closed.
+
+        :param query: query string
+        :param fields: query fields
+        :param page_size: number of entries requested for every page [default=page_size]
+        :return: generator of (dn, attributes)
+        :raises AuthError: raise :class:`AuthError`
+        """
+        try:
+            if self.pool is not None:
+                pconn = self.pool.acquire()
+                done = False
+                try:
+                    for entry in self._iter_pages(pconn.conn, query, fields=fields, page_size=page_size):
+                        yield entry
+                    done = True
+                finally:
+                    # a connection with a search still open is not given back to the pool
+                    self.pool.release(pconn, discard=not done)
+            elif self.conn:
+                for entry in self._iter_pages(self.conn, query, fields=fields, page_size=page_size, abandon=True):
+                    yield entry
+            else:
+                raise AuthError("", "No connection to server", code=0)
+            self.logger.debug("Paged query Ldap: %s" % query)
+        except ldap.LDAPError as ex:
+            self.logger.error("Ldap error: %s" % ex)
+            raise AuthError("", "Ldap error: %s" % ex, code=9)
+
     def login1(self, username, password):
         """Login a user
 
@@ -204,29 +411,37 @@ class LdapAuth(AbstractAuth):
         """
         self.logger.debug("Authenticate user: %s" % username)
 
-        # open connect if it doesn't already exist
-        if self.conn is None:
-            self.connect()
+        if self.user_pool is not None:
+            return self._authenticate_pooled(username, password, max_retry=max_retry, cur_retry=cur_retry)
 
         try:
+            # open connect if it doesn't already exist
+            if self.conn is None:
+                self.connect()
+
             self.conn.simple_bind_s(username, ensure_str(password))
-        except (ldap.TIMEOUT, ldap.TIMELIMIT_EXCEEDED):
+        except (ldap.TIMEOUT, ldap.TIMELIMIT_EXCEEDED) as ex:
             self.logger.error("Ldap connection timeout")
+            self._server_failed(ex)
             self.close()
             self.conn = None
             raise AuthError("", "Connection error. Timeout limit was exceeded", code=7)
-        except ldap.CONNECT_ERROR:
+        except ldap.CONNECT_ERROR as ex:
             self.logger.error("Ldap connection error")
+            self._server_failed(ex)
             self.close()
             self.conn = None
             raise AuthError("", "Connection error", code=7)
         except ldap.LDAPError as ex:
             self.logger.error("Ldap authentication error: %s" % ex)
+            if isinstance(ex, ldap.SERVER_DOWN):
+                self._server_failed(ex)
             self.close()
             self.conn = None
 
             # {'desc': "Can't contact LDAP server", 'errno': 104, 'info': 'Connection reset by peer'}
-            if str(ex).find("104") > 0:
+            # with more hosts retry on another host
+            if str(ex).find("104") > 0 or (self.servers is not None and isinstance(ex, ldap.SERVER_DOWN)):
                 # check retry
                 if cur_retry < max_retry:
                     cur_retry += 1
@@ -238,6 +453,34 @@ class LdapAuth(AbstractAuth):
                 raise AuthError("", "Ldap authentication error: %s" % ex, code=7)
         return True
 
+    def _authenticate_pooled(self, username, password, max_retry=3, cur_retry=0):
+        """Authenticate a user binding a connection of the user pool. Connection is reused by the next
+        authentication, that binds it again.
+
+        :param username: user name
+        :param password: user password
+        :return: True
+        """
+        try:
+            with self.user_pool.connection() as conn:
+                conn.simple_bind_s(username, ensure_str(password))
+        except (ldap.TIMEOUT, ldap.TIMELIMIT_EXCEEDED):
+            self.logger.error("Ldap connection timeout")
+            raise AuthError("", "Connection error. Timeout limit was exceeded", code=7)
+        except ldap.CONNECT_ERROR:
+            self.logger.error("Ldap connection error")
+            raise AuthError("", "Connection error", code=7)
+        except ldap.LDAPError as ex:
+            self.logger.error("Ldap authentication error: %s" % ex)
+
+            # pooled connection closed by server, retry with a new connection
+            if isinstance(ex, ldap.SERVER_DOWN) or str(ex).find("104") > 0:
+                if cur_retry < max_retry:
+                    cur_retry += 1
+                    return self._authenticate_pooled(username, password, max_retry=max_retry, cur_retry=cur_retry)
+            raise AuthError("", "Ldap authentication error: %s" % ex, code=7)
+        return True
+
     def search_user(self, username, search_filter):
         """Search a user
 
@@ -246,31 +489,66 @@ class LdapAuth(AbstractAuth):
         :return: instance of user_class
         """
         query = search_filter.format(**username)
-        res = self.query(query)
+        if self.user_cache is not None:
+            user = self.user_cache.get(query, False)
+            if user is False:
+                user = self._search_user(query)
+                if user is None:
+                    self.user_cache.set(query, None, ttl=self.cache_negative_ttl)
+                else:
+                    self.user_cache.set(query, user, ttl=self.cache_ttl)
+        else:
+            user = self._search_user(query)
 
-        if len(res) == 0 or res[0][0] is None:
+        if user is None:
             raise AuthError(
                 "",
                 "Ldap error - User %s was not found" % username.get("username"),
                 code=5,
             )
-        user = list(res[0])
+        user = list(user)
 
         self.logger.debug("Get user record: %s" % truncate(user))
 
         return user
 
-    def search_users(self, search_filter, fields=["cn", "mail"]):
-        """Search users
+    def _search_user(self, query):
+        """Search a user record in the Ldap
+
+        :param query: query string
+        :return: user record [dn, attributes] or None if user was not found
+        """
+        # bind service user before every search, connection can be still bound as the last authenticated user
+        if self.pool is None and self.user_cache is not None:
+            self.authenticate(self.bind_user, self.bind_pwd)
+        res = self.query(query)
+        if len(res) == 0 or res[0][0] is None:
+            return None
+        return tuple(res[0])
+
+    def clear_cache(self):
+        """Remove cached user records."""
+        if self.user_cache is not None:
+            self.user_cache.clear()
+
+    def get_cache_stats(self):
+        """Get user records cache statistics
+
+        :return: cache statistics or None if cache is not enabled
+        """
+        if self.user_cache is None:
+            return None
+        return self.user_cache.get_stats()
+
+    def iter_users(self, search_filter, fields=["cn", "mail"], page_size=None):
+        """Search users with a paged query
 
         :param search_filter: filter used to search users
         :param fields: fields to search
-        :return: instance of user_class
+        :param page_size: number of entries requested for every page [default=page_size]
+        :return: generator of dict with fields
         """
-        resp = []
-        res = self.query(search_filter, fields=fields)
-        for item in res:
-            item = item[1]
+        for dn, item in self.iter_search(search_filter, fields=fields, page_size=page_size):
             user = {}
             for field in fields:
                 try:
@@ -280,9 +558,18 @@ class LdapAuth(AbstractAuth):
                 except:
                     value = ""
                 user[ensure_str(field)] = ensure_str(value)
-            resp.append(user)
+            yield user
+
+    def search_users(self, search_filter, fields=["cn", "mail"]):
+        """Search users
+
+        :param search_filter: filter used to search users
+        :param fields: fields to search
+        :return: instance of user_class
+        """
+        resp = list(self.iter_users(search_filter, fields=fields))
 
-        self.logger.debug("Get users: %s" % truncate(res))
+        self.logger.debug("Get users: %s" % truncate(resp))
 
         return resp
 
@@ -352,7 +639,10 @@ class LdapAuth(AbstractAuth):
         :param password: user password
         :return: instance of user_class
         """
-        self.authenticate(self.bind_user, self.bind_pwd)
+        # pooled service connections are bound when they are opened, with user cache connection is bound only when
+        # user record is not cached
+        if self.pool is None and self.user_cache is None:
+            self.authenticate(self.bind_user, self.bind_pwd)
         user = self.verify_user(username, password)
 
         return user
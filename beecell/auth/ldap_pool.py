@@ -0,0 +1,279 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import logging
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import Callable
+import ldap
+from .base import AuthError
+
+# errors after which a connection can not be reused
+BROKEN_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+
+class PooledConnection(object):
+    """Ldap connection managed by :class:`LdapConnectionPool`
+
+    :param conn: ldap connection
+    :param generation: pool generation when connection was opened
+    """
+
+    def __init__(self, conn, generation: int):
+        self.conn = conn
+        self.generation = generation
+        self.created = monotonic()
+        self.last_used = self.created
+        self.acquired = None
+
+    @property
+    def age(self) -> float:
+        return monotonic() - self.created
+
+    @property
+    def idle(self) -> float:
+        return monotonic() - self.last_used
+
+
+class LdapConnectionPool(object):
+    """Thread safe pool of persistent ldap connections.
+
+    Connections are opened on demand up to maxsize. When a bind dn is set every connection is bound once when it is
+    opened, and can be used for searches. Without a bind dn connections are returned unbound and can be used to verify
+    user credentials with simple_bind_s.
+    A connection idle for more than idle_check seconds is checked with a whoami request before it is returned, a
+    connection older than max_lifetime seconds is closed and replaced. A connection that raised a network error is
+    closed when it is released.
+
+    :param factory: function that returns a new ldap connection
+    :param bind_dn: dn used to bind connections [optional]
+    :param bind_pwd: password used to bind connections [optional]
+    :param maxsize: max number of open connections [default=10]
+    :param max_lifetime: seconds after which a connection is closed and replaced [default=600]
+    :param idle_check: seconds of inactivity after which a connection is checked before it is used [default=30]
+    :param wait_timeout: max seconds to wait for a free connection [default=10]
+    :param name: pool name used in logs and errors [default=ldap]
+    """
+
+    def __init__(
+        self,
+        factory: Callable,
+        bind_dn: str = None,
+        bind_pwd: str = None,
+        maxsize: int = 10,
+        max_lifetime: float = 600,
+        idle_check: float = 30,
+        wait_timeout: float = 10,
+        name: str = "ldap",
+    ):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        self.factory = factory
+        self.bind_dn = bind_dn
+        self.bind_pwd = bind_pwd
+        self.maxsize = maxsize
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        self.wait_timeout = wait_timeout
+        self.name = name
+
+        self._cond = Condition()
+        self._idle = deque()
+        self._size = 0
+        self._generation = 0
+
+        self._stats = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "timeouts": 0,
+            "use_time": 0.0,
+            "peak_in_use": 0,
+            "opened": 0,
+            "closed": 0,
+            "recycled": 0,
+            "health_failures": 0,
+            "errors": 0,
+        }
+
+    def __str__(self):
+        return "<LdapConnectionPool name:%s, size:%s, maxsize:%s>" % (self.name, self._size, self.maxsize)
+
+    def _count(self, name: str, value=1):
+        with self._cond:
+            self._stats[name] += value
+
+    def _open(self) -> PooledConnection:
+        """Open a new connection and bind it with pool bind dn"""
+        conn = self.factory()
+        try:
+            if self.bind_dn is not None:
+                conn.simple_bind_s(self.bind_dn, self.bind_pwd)
+        except Exception:
+            self._close_conn(conn)
+            raise
+        self._count("opened")
+        self.logger.debug("Open pool %s connection %s" % (self.name, conn))
+        return PooledConnection(conn, self._generation)
+
+    def _close_conn(self, conn):
+        try:
+            conn.unbind_s()
+        except Exception:
+            pass
+
+    def _close(self, pconn: PooledConnection):
+        self._close_conn(pconn.conn)
+        self._count("closed")
+        self.logger.debug("Close pool %s connection %s" % (self.name, pconn.conn))
+
+    def _check(self, pconn: PooledConnection) -> bool:
+        """Check an idle connection before it is used
+
+        :return: False if connection was closed
+        """
+        if pconn.generation != self._generation or pconn.age > self.max_lifetime:
+            self._close(pconn)
+            self._count("recycled")
+            return False
+        if pconn.idle > self.idle_check:
+            try:
+                pconn.conn.whoami_s()
+            except Exception as ex:
+                self.logger.warning("Pool %s connection %s health check failed: %s" % (self.name, pconn.conn, ex))
+                self._close(pconn)
+                self._count("health_failures")
+                return False
+        return True
+
+    def acquire(self, timeout: float = None) -> PooledConnection:
+        """Get a connection from the pool. Wait until a connection is free when the pool is full.
+
+        :param timeout: max seconds to wait for a free connection [default=pool wait_timeout]
+        :return: pooled connection
+        :raises AuthError: raise :class:`AuthError`
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        start = monotonic()
+        deadline = start + timeout
+        waited = False
+        with self._cond:
+            while True:
+                if len(self._idle) > 0:
+                    pconn = self._idle.pop()
+                    break
+                if self._size < self.maxsize:
+                    pconn = None
+                    self._size += 1
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    elapsed = monotonic() - start
+                    self._stats["timeouts"] += 1
+                    self._stats["waits"] += 1
+                    self._stats["wait_time"] += elapsed
+                    self._stats["max_wait_time"] = max(self._stats["max_wait_time"], elapsed)
+                    raise AuthError("", "Ldap connection pool %s exhausted" % self.name, code=7)
+                waited = True
+                self._cond.wait(remaining)
+            elapsed = monotonic() - start
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += elapsed
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], elapsed)
+            in_use = self._size - len(self._idle)
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], in_use)
+
+        try:
+            if pconn is not None and not self._check(pconn):
+                pconn = None
+            if pconn is None:
+                pconn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        pconn.acquired = monotonic()
+        return pconn
+
+    def release(self, pconn: PooledConnection, discard: bool = False):
+        """Return a connection to the pool
+
+        :param pconn: pooled connection
+        :param discard: if True close the connection [default=False]
+        """
+        now = monotonic()
+        pconn.last_used = now
+        expired = pconn.generation != self._generation or pconn.age > self.max_lifetime
+        discard = discard or expired
+        with self._cond:
+            self._stats["use_time"] += now - pconn.acquired
+            if expired:
+                self._stats["recycled"] += 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(pconn)
+            self._cond.notify()
+        if discard:
+            self._close(pconn)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager that acquires a connection and releases it on exit. Connection is closed if a network
+        error is raised.
+
+        :param timeout: max seconds to wait for a free connection [default=pool wait_timeout]
+        :return: ldap connection
+        :raises AuthError: raise :class:`AuthError`
+        """
+        pconn = self.acquire(timeout=timeout)
+        discard = False
+        try:
+            yield pconn.conn
+        except BROKEN_ERRORS:
+            discard = True
+            self._count("errors")
+            raise
+        except ldap.LDAPError:
+            raise
+        except Exception:
+            discard = True
+            self._count("errors")
+            raise
+        finally:
+            self.release(pconn, discard=discard)
+
+    def clear(self):
+        """Close idle connections. Connections in use are closed when they are released."""
+        with self._cond:
+            self._generation += 1
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pconn in idle:
+            self._close(pconn)
+
+    def get_stats(self) -> dict:
+        """Get pool statistics
+
+        :return: {'size':.., 'idle':.., 'in_use':.., 'acquired':.., 'waits':.., 'avg_wait_time':.., ..}
+        """
+        with self._cond:
+            res = dict(self._stats)
+            res["size"] = self._size
+            res["maxsize"] = self.maxsize
+            res["idle"] = len(self._idle)
+            res["in_use"] = self._size - len(self._idle)
+        acquired = res["acquired"]
+        res["avg_wait_time"] = res["wait_time"] / res["waits"] if res["waits"] > 0 else 0.0
+        res["avg_use_time"] = res["use_time"] / acquired if acquired > 0 else 0.0
+        return res
@@ -0,0 +1,208 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import logging
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, List
+from weakref import WeakKeyDictionary
+import ldap
+
+
+class LdapServer(object):
+    """Ldap server health and latency score
+
+    :param host: server host, with optional port like host:port
+    :param position: server position in configuration
+    """
+
+    def __init__(self, host: str, position: int = 0):
+        self.host = host
+        self.position = position
+        self.latency = None
+        self.down_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def __str__(self):
+        return "<LdapServer host:%s, latency:%s, healthy:%s>" % (self.host, self.latency, self.healthy)
+
+    @property
+    def healthy(self) -> bool:
+        return self.down_until <= monotonic()
+
+    def get_stats(self) -> dict:
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "latency": round(self.latency, 6) if self.latency is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class LdapServerSet(object):
+    """Set of equivalent ldap servers, like the domain controllers of an active directory domain.
+
+    Connections are opened racing the servers: the first server is tried, if it does not answer within stagger seconds
+    the next server is tried too, and so on. The first connection established is used and the others are closed.
+    Servers are tried from the lowest connect latency, measured as exponentially weighted moving average. A server
+    that fails is tried only after the healthy ones for down_time seconds.
+
+    :param hosts: list of server hosts, with optional port like host:port
+    :param stagger: seconds to wait before trying the next server [default=0.25]
+    :param down_time: seconds a failed server is tried after the healthy ones [default=30]
+    :param alpha: weight of the last sample in latency moving average [default=0.3]
+    """
+
+    def __init__(self, hosts: List[str], stagger: float = 0.25, down_time: float = 30, alpha: float = 0.3):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        self.servers = [LdapServer(host, position=i) for i, host in enumerate(hosts)]
+        self.stagger = stagger
+        self.down_time = down_time
+        self.alpha = alpha
+        self._lock = Lock()
+        self._owners = WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self.servers)
+
+    def ordered(self) -> List[LdapServer]:
+        """Get servers in the order they are tried: healthy servers by latency, then failed servers
+
+        :return: list of servers
+        """
+        with self._lock:
+            return sorted(
+                self.servers,
+                key=lambda s: (not s.healthy, s.latency is None, s.latency or 0.0, s.position),
+            )
+
+    def succeeded(self, server: LdapServer, latency: float):
+        """Record a connection established with server
+
+        :param server: ldap server
+        :param latency: seconds to open the connection
+        """
+        with self._lock:
+            if server.latency is None:
+                server.latency = latency
+            else:
+                server.latency = self.alpha * latency + (1 - self.alpha) * server.latency
+            server.successes += 1
+            server.down_until = 0.0
+
+    def failed(self, server: LdapServer, error):
+        """Record a server failure. Server is tried after the healthy ones for down_time seconds.
+
+        :param server: ldap server
+        :param error: error raised
+        """
+        with self._lock:
+            server.failures += 1
+            server.last_error = str(error)
+            server.down_until = monotonic() + self.down_time
+        self.logger.warning("Ldap server %s failed: %s" % (server.host, error))
+
+    def failed_connection(self, conn, error):
+        """Record the failure of a connection opened by :meth:`connect`
+
+        :param conn: ldap connection
+        :param error: error raised
+        """
+        server = self._owners.get(conn)
+        if server is not None:
+            self.failed(server, error)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind_s()
+        except Exception:
+            pass
+
+    def connect(self, opener: Callable, timeout: float):
+        """Open a connection racing the servers
+
+        :param opener: function that receives a server host and returns an established connection
+        :param timeout: max seconds to wait for a connection
+        :return: (server, connection)
+        :raises ldap.LDAPError: last error raised when no server can be connected or ldap.TIMEOUT
+        """
+        servers = self.ordered()
+        results = Queue()
+        state = {"done": False}
+        lock = Lock()
+
+        def attempt(server):
+            start = monotonic()
+            try:
+                conn = opener(server.host)
+            except Exception as ex:
+                self.failed(server, ex)
+                results.put((server, None, ex))
+                return
+            self.succeeded(server, monotonic() - start)
+            with lock:
+                if not state["done"]:
+                    state["done"] = True
+                    results.put((server, conn, None))
+                    return
+            # another server won the race
+            self._close(conn)
+
+        deadline = monotonic() + timeout
+        started = 0
+        pending = 0
+        waited = False
+        error = None
+        try:
+            while True:
+                if started < len(servers) and (pending == 0 or waited):
+                    Thread(target=attempt, args=(servers[started],), daemon=True).start()
+                    started += 1
+                    pending += 1
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(self.stagger, remaining) if started < len(servers) else remaining
+                try:
+                    server, conn, ex = results.get(timeout=wait)
+                    waited = False
+                except Empty:
+                    waited = True
+                    continue
+                pending -= 1
+                if conn is not None:
+                    self._owners[conn] = server
+                    self.logger.debug("Connect ldap server %s" % server.host)
+                    return server, conn
+                error = ex
+                if pending == 0 and started >= len(servers):
+                    raise error
+                # try the next server without waiting
+                waited = True
+        finally:
+            with lock:
+                state["done"] = True
+        # close connection established after timeout
+        while not results.empty():
+            server, conn, ex = results.get_nowait()
+            if conn is not None:
+                self._close(conn)
+        if error is not None:
+            raise error
+        raise ldap.TIMEOUT({"desc": "No ldap server answered in %ss" % timeout})
+
+    def get_stats(self) -> List[dict]:
+        """Get servers statistics
+
+        :return: list of {'host':.., 'healthy':.., 'latency':.., 'successes':.., 'failures':.., 'last_error':..}
+        """
+        with self._lock:
+            return [server.get_stats() for server in self.servers]
@@ -28,3 +28,12 @@ class AbstractAuthDbManager(object):
         :param password: Password to verify
         """
         return NotImplemented
+
+    def get_password_check(self, user):
+        """Get the function and the stored hash used to verify user password. Used by DatabaseAuth when a password
+        verifier is configured. Function must be defined at module level and is called as func(password, hashed).
+
+        :param user: Orm User istance
+        :return: (func, hashed)
+        """
+        return NotImplemented
@@ -0,0 +1,194 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import struct
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Callable, Union
+from six import ensure_binary
+from beecell.cache.local import LocalCache
+from .base import AuthError
+
+
+class PasswordVerifier(object):
+    """Verify passwords in a bounded pool of worker processes, so that hashing does not hold the GIL of the calling
+    process.
+
+    Verifications are queued up to max_pending: when the queue is full or a verification takes more than timeout
+    seconds an :class:`AuthError` with code CONNECTIONERROR is raised.
+    Successful verifications are cached for cache_ttl seconds. Cache key is the HMAC of user, password and stored hash
+    with a random key generated by every process, so passwords are never stored and a password change invalidates the
+    cached verification.
+    Worker processes are started on first use, also in a forked process.
+
+    :param workers: number of worker processes. If 0 passwords are verified in the calling thread [default=2]
+    :param max_pending: max number of verifications queued or running [default=8 x workers]
+    :param timeout: max seconds to wait for a verification [default=5]
+    :param cache_ttl: seconds a successful verification is cached. If 0 cache is disabled [default=60]
+    :param cache_size: max number of cached verifications [default=10000]
+    :param context: multiprocessing start method like fork or spawn [default=platform default]
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = None,
+        timeout: float = 5,
+        cache_ttl: float = 60,
+        cache_size: int = 10000,
+        context: str = None,
+    ):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else max(workers, 1) * 8
+        self.timeout = timeout
+        self.context = context
+        self.cache = None
+        if cache_ttl > 0:
+            self.cache = LocalCache(maxsize=cache_size, ttl=cache_ttl)
+
+        self._key = secrets.token_bytes(32)
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._stats = {"verified": 0, "failed": 0, "cache_hits": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+
+    def __str__(self):
+        return "<PasswordVerifier workers:%s, max_pending:%s, timeout:%s>" % (
+            self.workers,
+            self.max_pending,
+            self.timeout,
+        )
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _cache_key(self, user: str, password: Union[str, bytes], hashed: Union[str, bytes]) -> str:
+        """Get the HMAC of user, password and stored hash. Every value is prefixed by its length."""
+        mac = hmac.new(self._key, digestmod=hashlib.sha256)
+        for value in (user or "", password, hashed):
+            value = ensure_binary(value)
+            mac.update(struct.pack(">I", len(value)))
+            mac.update(value)
+        return mac.hexdigest()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Get the worker processes pool of the current process"""
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.context) if self.context is not None else None
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+                self.logger.debug("Start %s password verification workers" % self.workers)
+            return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, func: Callable, password, hashed, timeout: float):
+        """Run func in a worker process"""
+        with self._lock:
+            if self._pid is not None and self._pid != os.getpid():
+                # forked process, workers and pending verifications belong to the parent
+                self._executor = None
+                self._pid = None
+                self._pending = 0
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise AuthError("", "Password verification queue is full", code=AuthError.CONNECTIONERROR)
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(func, password, hashed)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._count("timeouts")
+            raise AuthError("", "Password verification timeout", code=AuthError.CONNECTIONERROR)
+        except BrokenProcessPool as ex:
+            with self._lock:
+                self._executor = None
+            self._count("errors")
+            raise AuthError("", "Password verification error: %s" % ex, code=AuthError.CONNECTIONERROR)
+
+    def verify(self, func: Callable, password: Union[str, bytes], hashed: Union[str, bytes], user: str = None) -> bool:
+        """Verify a password
+
+        :param func: function called as func(password, hashed) that returns True if password matches the stored hash,
+            like :func:`beecell.crypto_util.sha512_crypto.password_ok`. Function must be defined at module level
+        :param password: password to verify
+        :param hashed: stored password hash
+        :param user: user name, part of the cache key [optional]
+        :return: True if password is verified
+        :raises AuthError: raise :class:`AuthError`
+        """
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(user, password, hashed)
+            if self.cache.get(key) is True:
+                self._count("cache_hits")
+                return True
+
+        if self.workers > 0:
+            res = bool(self._run(func, password, hashed, self.timeout))
+        else:
+            res = bool(func(password, hashed))
+
+        if res:
+            self._count("verified")
+            if key is not None:
+                self.cache.set(key, True)
+        else:
+            self._count("failed")
+        return res
+
+    def forget(self, user: str, password: Union[str, bytes], hashed: Union[str, bytes]):
+        """Remove a cached verification
+
+        :param user: user name
+        :param password: password
+        :param hashed: stored password hash
+        """
+        if self.cache is not None:
+            self.cache.delete(self._cache_key(user, password, hashed))
+
+    def shutdown(self, wait: bool = True):
+        """Stop worker processes and clear cache
+
+        :param wait: if True wait for running verifications [default=True]
+        """
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def get_stats(self) -> dict:
+        """Get verification statistics
+
+        :return: {'verified':.., 'failed':.., 'cache_hits':.., 'rejected':.., 'timeouts':.., 'errors':..,
+            'pending':.., 'cache':..}
+        """
+        with self._lock:
+            res = dict(self._stats)
+            res["pending"] = self._pending
+        res["cache"] = self.cache.get_stats() if self.cache is not None else None
+        return res
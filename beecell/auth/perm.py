@@ -2,9 +2,75 @@
 #
 # (C) Copyright 2018-2024 CSI-Piemonte
 
+import warnings
+
+# trie key used to mark the end of a permission object id
+LEAF = None
+
+
+def _insert(trie, segments):
+    """Add an object id, split in segments, to a segment trie"""
+    node = trie
+    for segment in segments:
+        node = node.setdefault(segment, {})
+    node[LEAF] = True
+
+
+def _contains(trie, segments):
+    """Check if an object id, split in segments, is stored in a segment trie"""
+    node = trie
+    for segment in segments:
+        node = node.get(segment)
+        if node is None:
+            return False
+    return LEAF in node
+
+
+def _prune(covering, trie):
+    """Remove from trie the object ids matched by an object id of the covering trie. A covering segment '*' matches
+    every segment, only object ids with the same number of segments match."""
+    stack = [(covering, trie)]
+    while stack:
+        cnode, node = stack.pop()
+        if LEAF in cnode:
+            node.pop(LEAF, None)
+        wildcard = cnode.get("*")
+        for segment, child in node.items():
+            if segment is LEAF:
+                continue
+            if wildcard is not None:
+                stack.append((wildcard, child))
+            if segment != "*":
+                cchild = cnode.get(segment)
+                if cchild is not None:
+                    stack.append((cchild, child))
+
+
+def _reduce(trie):
+    """Remove from trie the object ids covered by an object id with a '*' segment at the same level"""
+    stack = [trie]
+    while stack:
+        node = stack.pop()
+        wildcard = node.get("*")
+        for segment, child in node.items():
+            if segment is LEAF:
+                continue
+            if wildcard is not None and segment != "*":
+                _prune(wildcard, child)
+            stack.append(child)
+
 
 def group(rows, pos, maxpos):
-    """ """
+    """Group split object ids by segment in nested dicts.
+
+    .. deprecated:: 1.17.1
+        Use :func:`extract` or :func:`compact_perms`
+    """
+    warnings.warn("group is deprecated, use extract or compact_perms", DeprecationWarning, stacklevel=2)
+    return _group(rows, pos, maxpos)
+
+
+def _group(rows, pos, maxpos):
     vals = {}
     if pos < maxpos:
         for row in rows:
@@ -13,7 +79,7 @@ def group(rows, pos, maxpos):
             except:
                 vals[row[pos]] = [row]
         for key, item in vals.items():
-            vals[key] = group(item, pos + 1, maxpos)
+            vals[key] = _group(item, pos + 1, maxpos)
 
         return vals
     else:
@@ -21,40 +87,201 @@ def group(rows, pos, maxpos):
 
 
 def compact(vals):
-    """ """
+    """Get the object ids of nested dicts made by :func:`group` not covered by a '*' segment.
+
+    .. deprecated:: 1.17.1
+        Use :func:`extract` or :func:`compact_perms`
+    """
+    warnings.warn("compact is deprecated, use extract or compact_perms", DeprecationWarning, stacklevel=2)
+    return _compact(vals)
+
+
+def _compact(vals):
     if "*" in vals.keys():
-        return explore(vals["*"])
+        return _explore(vals["*"])
     elif type(list(vals.values())[0]) in [str, bytes]:
         return list(vals.values())
     else:
         res = []
         for key, item in vals.items():
-            data = compact(item)
+            data = _compact(item)
             if type(data) is not list:
                 res.append(data)
             else:
                 res.extend(data)
-
         return res
 
 
 def explore(data):
+    """Follow the '*' segments of nested dicts made by :func:`group`.
+
+    .. deprecated:: 1.17.1
+        Use :func:`extract` or :func:`compact_perms`
+    """
+    warnings.warn("explore is deprecated, use extract or compact_perms", DeprecationWarning, stacklevel=2)
+    return _explore(data)
+
+
+def _explore(data):
     if type(data) is dict:
-        return explore(data["*"])
+        return _explore(data["*"])
     else:
         return data
 
 
 def extract(perms):
-    """Reduce the permissions to a non redundant list.
+    """Reduce the permissions to a non redundant list. An object id is redundant when another object id with the same
+    number of segments matches it, where a '*' segment matches every segment. Object ids are kept in input order.
 
-    :param perms list: List like ['a1.b1.c4.*', 'a1.b1.c1.*', 'a1.b1.c2.*', 'a1.b2.*.*', 'a2.b3.*.*', 'a2.b4.c3.d1',
-                                  'a2.*.*.*']
-    :return: list like ['a1.b1.c2.*', 'a1.b1.c1.*', 'a1.b1.c4.*', 'a1.b2.*.*', 'a2.*.*.*']
+    :param perms list: List like ['a1//b1//c4//*', 'a1//b1//c1//*', 'a1//b2//*//*', 'a2//b3//*//*', 'a2//b4//c3//d1',
+                                  'a2//*//*//*']
+    :return: list like ['a1//b1//c4//*', 'a1//b1//c1//*', 'a1//b2//*//*', 'a2//*//*//*']
     """
-    rows = [r.split("//") for r in perms]
-    vals = group(rows, 0, len(perms[0].split("//")))
-    res = compact(vals)
-    if type(res) is str or type(res) is bytes:
-        res = [res]
+    trie = {}
+    for perm in perms:
+        _insert(trie, perm.split("//"))
+    _reduce(trie)
+    return [perm for perm in dict.fromkeys(perms) if _contains(trie, perm.split("//"))]
+
+
+def compact_perms(perms):
+    """Reduce a list of permissions to a non redundant list. A permission is redundant when another permission with the
+    same objtype and objdef, and the same action or action '*', grants it over an objid that matches its objid. Checks
+    made with :class:`PermIndex` give the same result over the full and the reduced list. Permissions are kept in input
+    order.
+
+    :param perms: list of permissions like [pid, oid, objtype, objdef, objid, aid, action]
+    :return: list of permissions
+    """
+    groups = {}
+    for perm in perms:
+        tries = groups.setdefault((perm[2].lower(), perm[3].lower()), {})
+        _insert(tries.setdefault(perm[6].lower(), {}), perm[4].lower().split("//"))
+    for tries in groups.values():
+        wildcard = tries.get("*")
+        for action, trie in tries.items():
+            if wildcard is not None and action != "*":
+                _prune(wildcard, trie)
+            _reduce(trie)
+    res = []
+    seen = set()
+    for perm in perms:
+        key = (perm[2].lower(), perm[3].lower(), perm[6].lower(), perm[4].lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        if _contains(groups[key[:2]][key[2]], key[3].split("//")):
+            res.append(perm)
     return res
+
+
+class PermIndex(object):
+    """Compiled index of a list of permissions.
+
+    Permissions are grouped by (objtype, objdef) and by action. For every group the object ids are stored in a
+    segment trie where every level is a '//' separated segment of the objid and '*' is a wildcard segment. A check
+    costs a couple of dict lookups plus one trie walk as deep as the objid, whatever the number of permissions.
+
+    :param perms: list of permissions like [pid, oid, objtype, objdef, objid, aid, action]
+    """
+
+    def __init__(self, perms=None):
+        self._index = {}
+        self.size = 0
+        if perms is not None:
+            for perm in perms:
+                self.add(perm)
+
+    def add(self, perm):
+        """Add a permission to the index
+
+        :param perm: permission like [pid, oid, objtype, objdef, objid, aid, action]
+        """
+        tries = self._index.setdefault((perm[2].lower(), perm[3].lower()), {})
+        _insert(tries.setdefault(perm[6].lower(), {}), perm[4].lower().split("//"))
+        self.size += 1
+
+    def _get_tries(self, action, objtype, objdef):
+        """Get the tries of the permissions that grant action over objtype and objdef"""
+        tries = self._index.get((objtype.lower(), objdef.lower()))
+        if tries is None:
+            return []
+        action = action.lower()
+        res = []
+        for key in ("*", action) if action != "*" else ("*",):
+            trie = tries.get(key)
+            if trie is not None:
+                res.append(trie)
+        return res
+
+    @staticmethod
+    def _match(trie, segments):
+        """Walk the trie using the objid segments. A trie segment '*' matches every objid segment."""
+        nodes = [trie]
+        for segment in segments:
+            children = []
+            for node in nodes:
+                child = node.get("*")
+                if child is not None:
+                    children.append(child)
+                if segment != "*":
+                    child = node.get(segment)
+                    if child is not None:
+                        children.append(child)
+            if not children:
+                return False
+            nodes = children
+        for node in nodes:
+            if LEAF in node:
+                return True
+        return False
+
+    def can(self, action, objtype, objid, objdef):
+        """Verify if permissions grant action over object objid with type objtype and definition objdef.
+
+        :param action: str es * view use write
+        :param objtype: str service, ssh, resource
+        :param objid: str, structured object id like 'a1//b1//*'
+        :param objdef: str object definition
+        :return: bool
+        """
+        segments = objid.lower().split("//")
+        for trie in self._get_tries(action, objtype, objdef):
+            if self._match(trie, segments):
+                return True
+        return False
+
+    def mask(self, action, objtype, objdef, objids):
+        """Verify the same action over a list of objects with type objtype and definition objdef.
+
+        :param action: str es * view use write
+        :param objtype: str service, ssh, resource
+        :param objdef: str object definition
+        :param objids: iterable of structured object ids
+        :return: list of bool, one for every objid
+        """
+        tries = self._get_tries(action, objtype, objdef)
+        if not tries:
+            return [False for objid in objids]
+        res = []
+        for objid in objids:
+            segments = objid.lower().split("//")
+            allowed = False
+            for trie in tries:
+                if self._match(trie, segments):
+                    allowed = True
+                    break
+            res.append(allowed)
+        return res
+
+    def filter(self, action, objtype, objdef, objids):
+        """Filter the objects over which action is granted.
+
+        :param action: str es * view use write
+        :param objtype: str service, ssh, resource
+        :param objdef: str object definition
+        :param objids: list of structured object ids
+        :return: list of allowed objids
+        """
+        objids = list(objids)
+        return [objid for objid, allowed in zip(objids, self.mask(action, objtype, objdef, objids)) if allowed]
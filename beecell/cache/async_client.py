@@ -0,0 +1,406 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import asyncio
+import inspect
+import logging
+import secrets
+from math import log
+from random import random
+from time import monotonic
+from typing import Any, Callable
+from beecell.db.async_manager import AsyncRedisManager
+from beecell.db.manager import RedisManagerError
+from beecell.simple import truncate
+from . import envelope
+from .client import CacheClient, LOCK_PREFIX, RELEASE_LOCK, TAG_KEY, tag_name
+
+try:
+    from redis.exceptions import ResponseError
+except ImportError:
+    ResponseError = Exception
+
+
+class AsyncCacheClient(object):
+    """Asyncio cache client. Keys, envelopes, locks and tags are the same of :class:`CacheClient`, so the two clients
+    can share the same items. Local cache and redis cluster are not supported.
+
+    :param redis_manager: redis manager reference (AsyncRedisManager)
+    :param prefix: chache key prefix
+    :param chunk_size: max number of keys sent to redis in a single command or pipeline by bulk methods [default=500]
+    :param compress_threshold: values encoded in more than this number of bytes are zlib compressed. If None values are
+        never compressed [default=1024]
+    :param legacy_envelope: if True write values in the json envelope read by older versions. Set to False to write
+        the binary envelope only after all the processes sharing the cache were upgraded [default=True]
+    :raises RedisManagerError: raise :class:`RedisManagerError` if redis manager is connected to a redis cluster
+    """
+
+    def __init__(
+        self,
+        redis_manager: AsyncRedisManager,
+        prefix="cache.",
+        chunk_size=500,
+        compress_threshold=envelope.COMPRESS_THRESHOLD,
+        legacy_envelope=True,
+    ):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        if getattr(redis_manager, "is_cluster", False) is True:
+            raise RedisManagerError("redis cluster is not supported by AsyncCacheClient, use CacheClient")
+
+        self.redis_manager = redis_manager
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.compress_threshold = compress_threshold
+        self.legacy_envelope = legacy_envelope
+
+        self._scripts = {}
+        self._load_stats = {
+            "hits": 0,
+            "misses": 0,
+            "loads": 0,
+            "early_refreshes": 0,
+            "stale": 0,
+            "waits": 0,
+            "lock_timeouts": 0,
+        }
+
+    # encoding is shared with the synchronous client
+    _encode = CacheClient._encode
+    _chunks = CacheClient._chunks
+
+    @staticmethod
+    def _decode(value) -> Any:
+        return envelope.decode(value)
+
+    def _script(self, source: str):
+        """Get a registered lua script"""
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self.redis_manager.conn.register_script(source)
+        return script
+
+    async def ping(self):
+        return await self.redis_manager.ping()
+
+    async def set(self, key: str, value, ttl=600, pickling=False, tags=None):
+        """Set a cache item
+
+        :param key: cache item key
+        :param value: cache item value
+        :param ttl: item time to live [default=600s]
+        :param pickling: if true marshal value using pickle otherways use json [default=False]
+        :param tags: list of tags used to delete the item with :meth:`invalidate_tags` [optional]
+        :return: True
+        """
+        cachevalue = self._encode(value, pickling=pickling)
+        await self._store(key, cachevalue, ttl, tags=tags)
+        self.logger.debug("Set cache item %s:%s [%ss]" % (key, truncate(cachevalue), ttl))
+        return True
+
+    async def _store(self, key: str, cachevalue, ttl, tags=None):
+        """Write an encoded cache item and add it to tag sets"""
+        conn = self.redis_manager.conn
+        if not tags:
+            await conn.setex(self.prefix + key, ttl, cachevalue)
+            return
+        async with conn.pipeline(transaction=False) as pipe:
+            pipe.setex(self.prefix + key, ttl, cachevalue)
+            await self._tag_key(key, tags, ttl, pipe)
+            await pipe.execute()
+
+    async def _tag_key(self, key: str, tags: list, ttl, pipe):
+        """Queue on pipeline the addition of key to tag sets"""
+        for tag in tags:
+            await self._script(TAG_KEY)(keys=[tag_name(self.prefix, tag)], args=[self.prefix + key, ttl], client=pipe)
+
+    async def get(self, key: str) -> Any:
+        """Get a cache item
+
+        :param key: cache item key
+        :return: value
+        """
+        value = self._decode(await self.redis_manager.conn.get(self.prefix + key))
+        self.logger.debug("Get cache item %s:%s" % (key, truncate(value)))
+        return value
+
+    async def expire(self, key, ttl=600) -> bool:
+        """Set key expire time
+
+        :param key: cache item key
+        :param ttl: item time to live [default=600s]
+        :return: True
+        """
+        return await self.redis_manager.expire(self.prefix + key, ttl)
+
+    async def extend_ttl(self, key, ttl=600) -> bool:
+        """Extend a cache item ttl
+
+        :param key: cache item key
+        :return: True
+        """
+        return await self.redis_manager.expire(self.prefix + key, ttl)
+
+    async def delete(self, key):
+        """Delete a cache item
+
+        :param key: cache item key
+        :return: True
+        """
+        await self.redis_manager.delete_key(self.prefix + key)
+        self.logger.debug("Delete cache item %s" % key)
+        return True
+
+    async def get_many(self, keys: list, chunk_size: int = None) -> dict:
+        """Get many cache items with a MGET for every chunk of keys. Chunks are read concurrently.
+
+        :param keys: list of cache item keys
+        :param chunk_size: max number of keys read with a single MGET [default=client chunk_size]
+        :return: dict {key: value} with the items found. Missing keys are not in the dict
+        """
+        keys = list(dict.fromkeys(keys))
+        chunks = list(self._chunks(keys, chunk_size))
+        conn = self.redis_manager.conn
+        values = await asyncio.gather(*[conn.mget([self.prefix + key for key in chunk]) for chunk in chunks])
+        res = {}
+        for chunk, chunk_values in zip(chunks, values):
+            for key, raw in zip(chunk, chunk_values):
+                if raw is not None:
+                    res[key] = self._decode(raw)
+        self.logger.debug("Get %s cache items - found: %s" % (len(keys), len(res)))
+        return res
+
+    async def set_many(self, items: dict, ttl=600, pickling=False, chunk_size: int = None, tags=None) -> bool:
+        """Set many cache items with a pipeline of SETEX for every chunk of items
+
+        :param items: dict {key: value}
+        :param ttl: items time to live [default=600s]
+        :param pickling: if true marshal values using pickle otherways use json [default=False]
+        :param chunk_size: max number of items sent with a single pipeline [default=client chunk_size]
+        :param tags: list of tags of all the items [optional]
+        :return: True
+        """
+        conn = self.redis_manager.conn
+        for chunk in self._chunks(list(items.items()), chunk_size):
+            async with conn.pipeline(transaction=False) as pipe:
+                for key, value in chunk:
+                    pipe.setex(self.prefix + key, ttl, self._encode(value, pickling=pickling))
+                    if tags:
+                        await self._tag_key(key, tags, ttl, pipe)
+                await pipe.execute()
+        self.logger.debug("Set %s cache items [%ss]" % (len(items), ttl))
+        return True
+
+    async def delete_many(self, keys: list, chunk_size: int = None) -> int:
+        """Delete many cache items with a UNLINK for every chunk of keys
+
+        :param keys: list of cache item keys
+        :param chunk_size: max number of keys deleted with a single UNLINK [default=client chunk_size]
+        :return: number of items deleted
+        """
+        res = 0
+        conn = self.redis_manager.conn
+        for chunk in self._chunks(list(keys), chunk_size):
+            res += await conn.unlink(*[self.prefix + key for key in chunk])
+        return res
+
+    def _count_load(self, name: str):
+        self._load_stats[name] += 1
+
+    async def _lock(self, key: str, lock_ttl: float):
+        """Acquire the load lock of a cache item
+
+        :return: lock token or None if lock is owned by another caller
+        """
+        token = secrets.token_hex(8)
+        if await self.redis_manager.conn.set(LOCK_PREFIX + self.prefix + key, token, nx=True, px=int(lock_ttl * 1000)):
+            return token
+        return None
+
+    async def _load(self, key: str, loader: Callable, ttl, pickling: bool, stale_ttl, token: str, tags=None) -> Any:
+        """Load a cache item with loader, store it and release the load lock"""
+        try:
+            start = monotonic()
+            value = loader()
+            if inspect.isawaitable(value):
+                value = await value
+            delta = monotonic() - start
+            await self._store(key, self._encode(value, pickling=pickling, delta=delta), ttl + stale_ttl, tags=tags)
+            self._count_load("loads")
+            return value
+        finally:
+            if token is not None:
+                await self._script(RELEASE_LOCK)(
+                    keys=[LOCK_PREFIX + self.prefix + key], args=[token], client=self.redis_manager.conn
+                )
+
+    async def get_or_set(
+        self,
+        key: str,
+        loader: Callable,
+        ttl=600,
+        pickling=False,
+        stale_ttl=0,
+        lock_ttl=10,
+        wait=5,
+        beta=1.0,
+        tags=None,
+    ) -> Any:
+        """Get a cache item or load it with loader and set it. See :meth:`CacheClient.get_or_set`
+
+        :param key: cache item key
+        :param loader: function or coroutine function without arguments that returns the item value
+        :param ttl: item time to live [default=600s]
+        :param pickling: if true marshal value using pickle otherways use json [default=False]
+        :param stale_ttl: seconds a stale item is kept and returned while it is loaded [default=0]
+        :param lock_ttl: max seconds the load lock is held [default=10]
+        :param wait: max seconds to wait for another caller loading the item [default=5]
+        :param beta: early expiration factor, greater than 1 favours early loads, 0 disables them [default=1.0]
+        :param tags: list of tags of the loaded item [optional]
+        :return: value
+        """
+        name = self.prefix + key
+        conn = self.redis_manager.conn
+        deadline = monotonic() + wait
+        poll = 0.01
+        waited = False
+        while True:
+            async with conn.pipeline(transaction=False) as pipe:
+                pipe.get(name)
+                pipe.pttl(name)
+                raw, pttl = await pipe.execute()
+
+            if raw is not None:
+                value, delta = envelope.decode_with_delta(raw)
+                remaining = pttl / 1000.0 - stale_ttl if pttl >= 0 else None
+                if remaining is None or remaining > 0:
+                    if (
+                        remaining is not None
+                        and delta
+                        and beta > 0
+                        and delta * beta * -log(1.0 - random()) >= remaining
+                    ):
+                        token = await self._lock(key, lock_ttl)
+                        if token is not None:
+                            self._count_load("early_refreshes")
+                            return await self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+                    self._count_load("hits")
+                    return value
+
+                token = await self._lock(key, lock_ttl)
+                if token is not None:
+                    self._count_load("misses")
+                    return await self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+                self._count_load("stale")
+                return value
+
+            token = await self._lock(key, lock_ttl)
+            if token is not None:
+                self._count_load("misses")
+                return await self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+
+            # another caller is loading the item
+            if not waited:
+                waited = True
+                self._count_load("waits")
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                self._count_load("lock_timeouts")
+                self.logger.warning("Wait for cache item %s load timed out" % key)
+                return await self._load(key, loader, ttl, pickling, stale_ttl, None, tags=tags)
+            await asyncio.sleep(min(poll, remaining))
+            poll = min(poll * 2, 0.2)
+
+    def get_load_stats(self) -> dict:
+        """Get get_or_set statistics
+
+        :return: {'hits':.., 'misses':.., 'loads':.., 'early_refreshes':.., 'stale':.., 'waits':.., 'lock_timeouts':..}
+        """
+        return dict(self._load_stats)
+
+    async def invalidate_tags(self, tags: list, chunk_size: int = None) -> int:
+        """Delete the items with any of the tags. See :meth:`CacheClient.invalidate_tags`
+
+        :param tags: list of tags
+        :param chunk_size: max number of keys deleted with a single UNLINK [default=client chunk_size]
+        :return: number of items deleted
+        """
+        chunk_size = chunk_size or self.chunk_size
+        conn = self.redis_manager.conn
+        res = 0
+        for tag in tags:
+            name = tag_name(self.prefix, tag)
+            pending = "%s:%s" % (name, secrets.token_hex(8))
+            try:
+                await conn.rename(name, pending)
+            except ResponseError:
+                # tag set does not exist
+                continue
+            try:
+                batch = []
+                async for key in conn.sscan_iter(pending, count=chunk_size):
+                    batch.append(key)
+                    if len(batch) >= chunk_size:
+                        res += await conn.unlink(*batch)
+                        batch = []
+                if len(batch) > 0:
+                    res += await conn.unlink(*batch)
+            finally:
+                await conn.unlink(pending)
+        self.logger.debug("Invalidate cache tags %s - deleted: %s" % (tags, res))
+        return res
+
+    def iter_keys_by_pattern(self, pattern, count=None, pause=None):
+        """Iterate over keys by pattern with SCAN
+
+        :param pattern: key search pattern
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: async generator of redis keys
+        """
+        return self.redis_manager.iter_keys(self.prefix + pattern, count=count, pause=pause)
+
+    async def iter_by_pattern(self, pattern, count=None, pause=None):
+        """Iterate over items by pattern with SCAN and a MGET for every batch
+
+        :param pattern: key search pattern
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: async generator of {'key':.., 'value':..} with redis key and raw redis value
+        """
+        conn = self.redis_manager.conn
+        async for keys in self.redis_manager.iter_key_batches(self.prefix + pattern, count=count, pause=pause):
+            for chunk in self._chunks(keys):
+                for key, value in zip(chunk, await conn.mget(chunk)):
+                    if value is not None:
+                        yield {"key": key, "value": value}
+
+    async def get_by_pattern(self, pattern):
+        """Get items by pattern
+
+        :param pattern: key search pattern
+        :return: list of items
+        """
+        return list({item["key"]: item async for item in self.iter_by_pattern(pattern)}.values())
+
+    async def get_keys_by_pattern(self, pattern):
+        """Get keys by pattern
+
+        :param pattern: key search pattern
+        :return: list of keys
+        """
+        return list(dict.fromkeys([key async for key in self.iter_keys_by_pattern(pattern)]))
+
+    async def delete_by_pattern(self, pattern, count=None, pause=None):
+        """Delete keys by pattern with SCAN and an UNLINK for every batch
+
+        :param pattern: key search pattern
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: number of keys deleted or None if no key was found
+        """
+        res = await self.redis_manager.unlink_by_pattern(self.prefix + pattern, count=count, pause=pause)
+        if res > 0:
+            return res
+        return None
@@ -3,68 +3,483 @@
 # (C) Copyright 2018-2024 CSI-Piemonte
 
 import logging
-import ujson as json
 import pickle
 import codecs
-from typing import Any
+import secrets
+from math import log
+from random import random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable
 from beecell.db.manager import RedisManager
 from beecell.simple import truncate, jsonDumps
+from . import envelope
+from .local import LocalCache, RedisInvalidator
+
+try:
+    from redis.exceptions import NoScriptError, ResponseError
+except ImportError:
+    ResponseError = NoScriptError = Exception
+
+# channel used to broadcast changed keys to the local caches
+CHANNEL = "cache:invalidate"
+# marker of a missing local cache item
+MISSING = object()
+# prefix of the locks used by get_or_set to load an item once
+LOCK_PREFIX = "cache-lock:"
+# delete lock only if it is still owned by the caller
+RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# prefix of the sets of keys of every tag
+TAG_PREFIX = "cache-tag:"
+# add a key to the tag sets and extend their expire time to the key ttl
+TAG_KEY = """
+local ttl = tonumber(ARGV[2])
+for i, tag in ipairs(KEYS) do
+    redis.call("sadd", tag, ARGV[1])
+    if redis.call("ttl", tag) < ttl then
+        redis.call("expire", tag, ttl)
+    end
+end
+return #KEYS
+"""
+
+
+def tag_name(prefix: str, tag: str) -> str:
+    """Get the name of the set of keys of a tag. Name is a redis cluster hash tag, so the set and the copy renamed by
+    invalidation are in the same hash slot
+
+    :param prefix: cache client prefix
+    :param tag: tag
+    :return: redis key
+    """
+    return "%s{%s%s}" % (TAG_PREFIX, prefix, tag)
 
 
 class CacheClient(object):
     """ """
 
-    def __init__(self, redis_manager: RedisManager, prefix="cache."):
+    def __init__(
+        self,
+        redis_manager: RedisManager,
+        prefix="cache.",
+        local_cache=False,
+        local_maxsize=1000,
+        local_ttl=5,
+        stats_separator=".",
+        chunk_size=500,
+        compress_threshold=envelope.COMPRESS_THRESHOLD,
+        legacy_envelope=True,
+    ):
         """Initialize cache client
 
+        When local cache is enabled items read from redis are kept in an in process LRU cache, for at most local_ttl
+        seconds and never longer than redis ttl. Keys changed by set, delete, delete_by_pattern and expire in any process
+        are dropped from local caches through redis pub/sub channel cache:invalidate, listened by a daemon thread. While
+        the channel is not subscribed the local cache is bypassed. Values returned by the local cache are shared and
+        must not be modified.
+
         :param redis: redis manager reference (RedisManager)
         :param prefix: chache key prefix
+        :param local_cache: if True enable in process local cache [default=False]
+        :param local_maxsize: max number of items in local cache [default=1000]
+        :param local_ttl: max time to live of local cache items in seconds [default=5]
+        :param stats_separator: local cache hits are counted by key prefix up to this separator [default=.]
+        :param chunk_size: max number of keys sent to redis in a single command or pipeline by bulk methods
+            [default=500]
+        :param compress_threshold: values encoded in more than this number of bytes are zlib compressed. If None
+            values are never compressed [default=1024]
+        :param legacy_envelope: if True write values in the json envelope read by older versions. Values are read in
+            both binary and json envelope. Set to False to write the binary envelope only after all the processes
+            sharing the cache were upgraded [default=True]
         """
         self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
 
         self.redis_manager = redis_manager
         self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.compress_threshold = compress_threshold
+        self.legacy_envelope = legacy_envelope
+
+        self.local = None
+        self.invalidator = None
+        self.stats_separator = stats_separator
+        # invalidation counters: local cache is filled only if the item was not invalidated while it was read
+        self._generation = 0
+        self._global_generation = 0
+        self._key_generations = {}
+        self._generation_lock = Lock()
+        self._stats_lock = Lock()
+        self._prefix_stats = {}
+        self._bypass = 0
+        self._scripts = {}
+        self._load_stats = {
+            "hits": 0,
+            "misses": 0,
+            "loads": 0,
+            "early_refreshes": 0,
+            "stale": 0,
+            "waits": 0,
+            "lock_timeouts": 0,
+        }
+        if local_cache is True:
+            self.local = LocalCache(maxsize=local_maxsize, ttl=local_ttl)
+            self.invalidator = RedisInvalidator(redis_manager, CHANNEL, self._invalidate)
+
+    def _invalidate(self, message: str):
+        """Drop local cache items. Message is 'k:<key>' or 'p:<pattern>', None drops all the items."""
+        with self._generation_lock:
+            self._generation += 1
+            if message is not None and message.startswith("k:"):
+                if len(self._key_generations) >= self.local.maxsize:
+                    # bound memory, reads in progress are not cached
+                    self._key_generations.clear()
+                    self._global_generation = self._generation
+                else:
+                    self._key_generations[message[2:]] = self._generation
+                self.local.delete(message[2:])
+            else:
+                self._global_generation = self._generation
+                if message is None:
+                    self.local.clear()
+                elif message.startswith("p:"):
+                    self.local.delete_by_pattern(message[2:])
+
+    def _fill(self, name: str, value, ttl, generation: int):
+        """Set a local cache item read from redis, if it was not invalidated after generation was taken
+
+        :param name: redis key
+        :param value: item value
+        :param ttl: local time to live in seconds or None
+        :param generation: value of _generation before the item was read
+        """
+        with self._generation_lock:
+            if self._global_generation <= generation and self._key_generations.get(name, 0) <= generation:
+                self.local.set(name, value, ttl=ttl)
+
+    def _publish(self, message: str):
+        """Broadcast invalidation message and drop local item"""
+        if self.local is not None:
+            self.invalidator.publish(message)
+            self._invalidate(message)
+
+    def _local_enabled(self) -> bool:
+        """Check local cache can be used"""
+        if self.local is None:
+            return False
+        self.invalidator.start()
+        if self.invalidator.connected is False:
+            self._bypass += 1
+            return False
+        return True
+
+    def _count(self, key: str, hit: bool):
+        """Count local cache hit or miss by key prefix"""
+        name = key.split(self.stats_separator, 1)[0]
+        with self._stats_lock:
+            stats = self._prefix_stats.get(name)
+            if stats is None:
+                stats = self._prefix_stats[name] = [0, 0]
+            stats[0 if hit else 1] += 1
+
+    def _encode(self, value, pickling=False, delta=None):
+        """Encode cache item envelope
+
+        :param value: item value
+        :param pickling: if true marshal value using pickle otherways use json, bytes are stored as they are
+            [default=False]
+        :param delta: seconds spent to compute the value [optional]
+        :return: redis value
+        """
+        if self.legacy_envelope is True:
+            if pickling:
+                envelop = {"pickled": codecs.encode(pickle.dumps(value), "base64").decode()}
+            else:
+                envelop = {"data": value}
+            if delta is not None:
+                envelop["delta"] = delta
+            return jsonDumps(envelop)
+        codec = envelope.PICKLE if pickling else None
+        return envelope.encode(value, codec=codec, compress_threshold=self.compress_threshold, delta=delta)
+
+    @staticmethod
+    def _decode(value) -> Any:
+        """Decode cache item envelope, binary or legacy json
+
+        :param value: redis value
+        :return: item value
+        """
+        return envelope.decode(value)
+
+    def get_stats(self) -> dict:
+        """Get local cache statistics
+
+        :return: {'local':.., 'bypass':.., 'connected':.., 'prefixes': {<key prefix>: {'hits':.., 'misses':..,
+            'hit_ratio':..}}} or None if local cache is not enabled
+        """
+        if self.local is None:
+            return None
+        with self._stats_lock:
+            prefixes = {
+                name: {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 4)}
+                for name, (hits, misses) in self._prefix_stats.items()
+            }
+        return {
+            "local": self.local.get_stats(),
+            "bypass": self._bypass,
+            "connected": self.invalidator.connected,
+            "prefixes": prefixes,
+        }
 
     def ping(self):
         self.redis_manager.ping()
 
-    def set(self, key: str, value, ttl=600, pickling=False):
+    def set(self, key: str, value, ttl=600, pickling=False, tags=None):
         """Set a cache item
 
         :param key: cache item key
         :param value: cache item value
         :param ttl: item time to live [default=600s]
         :param picling: if true marshal value using pickle otherways use json [default=False]
+        :param tags: list of tags used to delete the item with :meth:`invalidate_tags` [optional]
         :return: True
         """
-        if pickling:
-            pickled = codecs.encode(pickle.dumps(value), "base64").decode()
-            cachevalue = jsonDumps({"pickled": pickled})
-        else:
-            cachevalue = jsonDumps({"data": value})
-        self.redis_manager.setex(self.prefix + key, ttl, cachevalue)
+        cachevalue = self._encode(value, pickling=pickling)
+        self._store(key, cachevalue, ttl, tags=tags)
         self.logger.debug("Set cache item %s:%s [%ss]" % (key, truncate(cachevalue), ttl))
         return True
 
+    def _script(self, source: str):
+        """Get a registered lua script"""
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self.redis_manager.conn.register_script(source)
+        return script
+
+    def _execute(self, build: Callable) -> list:
+        """Execute a pipeline of commands queued by build(pipe). Redis cluster pipelines send EVALSHA without loading
+        the scripts, so when a node does not know a script all the scripts are loaded on every primary node and the
+        pipeline is sent again. Queued commands must be idempotent.
+
+        :param build: function that queues commands on the pipeline
+        :return: pipeline results
+        """
+        conn = self.redis_manager.conn
+        pipe = conn.pipeline(transaction=False)
+        build(pipe)
+        if self.redis_manager.is_cluster is False:
+            return pipe.execute()
+        try:
+            return pipe.execute()
+        except NoScriptError as ex:
+            self.logger.warning("Load cache scripts on redis cluster nodes: %s" % ex)
+            for script in list(self._scripts.values()):
+                conn.script_load(script.script)
+            pipe = conn.pipeline(transaction=False)
+            build(pipe)
+            return pipe.execute()
+
+    def _tag_key(self, key: str, tags: list, ttl, pipe):
+        """Queue on pipeline the addition of key to tag sets"""
+        # a call for every tag, tag sets can be in different redis cluster hash slots
+        for tag in tags:
+            self._script(TAG_KEY)(keys=[tag_name(self.prefix, tag)], args=[self.prefix + key, ttl], client=pipe)
+
+    def _store(self, key: str, cachevalue, ttl, tags=None):
+        """Write an encoded cache item, add it to tag sets and broadcast the invalidation"""
+        if self.local is not None or tags:
+
+            def build(pipe):
+                pipe.setex(self.prefix + key, ttl, cachevalue)
+                if tags:
+                    self._tag_key(key, tags, ttl, pipe)
+                if self.local is not None:
+                    self.invalidator.publish("k:" + self.prefix + key, pipe=pipe)
+
+            self._execute(build)
+            if self.local is not None:
+                self._invalidate("k:" + self.prefix + key)
+        else:
+            self.redis_manager.setex(self.prefix + key, ttl, cachevalue)
+
     def get(self, key: str) -> Any:
         """Get a cache item
 
         :param key: cache item key
         :return: value
         """
-        value = self.redis_manager.get(self.prefix + key)
-        if value is not None:
-            # if found the cached data foe key
-            # get envelop we axpect data for json-marshaled or pickeled for pickled
-            envelop: dict = json.loads(value)
-            value = envelop.get("data", None)
-            if value is None:
-                pickled = envelop.get("pickled", None)
-                if pickled is not None:
-                    value = pickle.loads(codecs.decode(pickled.encode(), "base64"))
+        if self._local_enabled():
+            return self._get_local(key)
+        value = self._decode(self.redis_manager.get(self.prefix + key))
+        self.logger.debug("Get cache item %s:%s" % (key, truncate(value)))
+        return value
+
+    def _get_local(self, key: str) -> Any:
+        """Get a cache item from local cache or from redis. Item read from redis is kept in local cache for its
+        remaining redis ttl, at most for local cache ttl.
+
+        :param key: cache item key
+        :return: value
+        """
+        name = self.prefix + key
+        value = self.local.get(name, MISSING)
+        if value is not MISSING:
+            self._count(key, True)
+            return value
+        self._count(key, False)
+
+        generation = self._generation
+        pipe = self.redis_manager.conn.pipeline(transaction=False)
+        pipe.get(name)
+        pipe.pttl(name)
+        raw, pttl = pipe.execute()
+        value = self._decode(raw)
+        if raw is not None:
+            # pttl is -1 for keys without expire time
+            self._fill(name, value, pttl / 1000.0 if pttl >= 0 else None, generation)
         self.logger.debug("Get cache item %s:%s" % (key, truncate(value)))
         return value
 
+    def _count_load(self, name: str):
+        with self._stats_lock:
+            self._load_stats[name] += 1
+
+    def _lock(self, key: str, lock_ttl: float):
+        """Acquire the load lock of a cache item
+
+        :return: lock token or None if lock is owned by another caller
+        """
+        token = secrets.token_hex(8)
+        if self.redis_manager.conn.set(LOCK_PREFIX + self.prefix + key, token, nx=True, px=int(lock_ttl * 1000)):
+            return token
+        return None
+
+    def _unlock(self, key: str, token: str):
+        """Release the load lock of a cache item if it is still owned"""
+        self._script(RELEASE_LOCK)(keys=[LOCK_PREFIX + self.prefix + key], args=[token], client=self.redis_manager.conn)
+
+    def _load(self, key: str, loader: Callable, ttl, pickling: bool, stale_ttl, token: str, tags=None) -> Any:
+        """Load a cache item with loader, store it and release the load lock"""
+        try:
+            start = monotonic()
+            value = loader()
+            delta = monotonic() - start
+            self._store(key, self._encode(value, pickling=pickling, delta=delta), ttl + stale_ttl, tags=tags)
+            self._count_load("loads")
+            self.logger.debug("Load cache item %s in %.3fs [%ss]" % (key, delta, ttl))
+            return value
+        finally:
+            if token is not None:
+                self._unlock(key, token)
+
+    def get_or_set(
+        self,
+        key: str,
+        loader: Callable,
+        ttl=600,
+        pickling=False,
+        stale_ttl=0,
+        lock_ttl=10,
+        wait=5,
+        beta=1.0,
+        tags=None,
+    ) -> Any:
+        """Get a cache item or load it with loader and set it. Only one caller at a time loads a missing item, using
+        a redis lock (SET NX PX): the others wait until the item is set, for at most wait seconds, and then call loader
+        themselves.
+        When stale_ttl > 0 the item is kept in redis stale_ttl seconds more than ttl: during this time the caller that
+        acquires the lock loads the item and the others get the stale value without waiting.
+        Hot items are loaded before they expire with probabilistic early expiration (XFetch): the seconds spent by
+        loader are stored with the item, and an item is loaded early when delta * beta * -log(random()) exceeds its
+        remaining time to live.
+
+        :param key: cache item key
+        :param loader: function without arguments that returns the item value
+        :param ttl: item time to live [default=600s]
+        :param pickling: if true marshal value using pickle otherways use json [default=False]
+        :param stale_ttl: seconds a stale item is kept and returned while it is loaded [default=0]
+        :param lock_ttl: max seconds the load lock is held [default=10]
+        :param wait: max seconds to wait for another caller loading the item [default=5]
+        :param beta: early expiration factor, greater than 1 favours early loads, 0 disables them [default=1.0]
+        :param tags: list of tags of the loaded item [optional]
+        :return: value
+        """
+        name = self.prefix + key
+        local = self._local_enabled()
+        if local:
+            value = self.local.get(name, MISSING)
+            self._count(key, value is not MISSING)
+            if value is not MISSING:
+                self._count_load("hits")
+                return value
+
+        conn = self.redis_manager.conn
+        deadline = monotonic() + wait
+        poll = 0.01
+        waited = False
+        while True:
+            generation = self._generation
+            pipe = conn.pipeline(transaction=False)
+            pipe.get(name)
+            pipe.pttl(name)
+            raw, pttl = pipe.execute()
+
+            if raw is not None:
+                value, delta = envelope.decode_with_delta(raw)
+                # remaining time to live, negative when item is stale. None when item does not expire
+                remaining = pttl / 1000.0 - stale_ttl if pttl >= 0 else None
+                if remaining is None or remaining > 0:
+                    if (
+                        remaining is not None
+                        and delta
+                        and beta > 0
+                        and delta * beta * -log(1.0 - random()) >= remaining
+                    ):
+                        token = self._lock(key, lock_ttl)
+                        if token is not None:
+                            self._count_load("early_refreshes")
+                            return self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+                    if local:
+                        self._fill(name, value, remaining, generation)
+                    self._count_load("hits")
+                    return value
+
+                token = self._lock(key, lock_ttl)
+                if token is not None:
+                    self._count_load("misses")
+                    return self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+                self._count_load("stale")
+                return value
+
+            token = self._lock(key, lock_ttl)
+            if token is not None:
+                self._count_load("misses")
+                return self._load(key, loader, ttl, pickling, stale_ttl, token, tags=tags)
+
+            # another caller is loading the item
+            if not waited:
+                waited = True
+                self._count_load("waits")
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                self._count_load("lock_timeouts")
+                self.logger.warning("Wait for cache item %s load timed out" % key)
+                return self._load(key, loader, ttl, pickling, stale_ttl, None, tags=tags)
+            sleep(min(poll, remaining))
+            poll = min(poll * 2, 0.2)
+
+    def get_load_stats(self) -> dict:
+        """Get get_or_set statistics
+
+        :return: {'hits':.., 'misses':.., 'loads':.., 'early_refreshes':.., 'stale':.., 'waits':.., 'lock_timeouts':..}
+        """
+        with self._stats_lock:
+            return dict(self._load_stats)
+
     def expire(self, key, ttl=600) -> bool:
         """Set key expire time
 
@@ -73,6 +488,7 @@ class CacheClient(object):
         :return: True
         """
         ret = self.redis_manager.expire(self.prefix + key, ttl)
+        self._publish("k:" + self.prefix + key)
         self.logger.debug("Set cache item %s expire to %s - ret: %s" % (key, ttl, ret))
         return ret
 
@@ -82,24 +498,184 @@ class CacheClient(object):
         :param key: cache item key
         :return: True
         """
-        self.redis_manager.delete(self.prefix + key)
+        self.redis_manager.delete_key(self.prefix + key)
+        self._publish("k:" + self.prefix + key)
         self.logger.debug("Delete cache item %s" % key)
         return True
 
+    def _chunks(self, keys: list, chunk_size: int = None):
+        chunk_size = chunk_size or self.chunk_size
+        for i in range(0, len(keys), chunk_size):
+            yield keys[i : i + chunk_size]
+
+    def get_many(self, keys: list, chunk_size: int = None) -> dict:
+        """Get many cache items with a MGET for every chunk of keys
+
+        :param keys: list of cache item keys
+        :param chunk_size: max number of keys read with a single MGET [default=client chunk_size]
+        :return: dict {key: value} with the items found. Missing keys are not in the dict
+        """
+        keys = list(dict.fromkeys(keys))
+        total = len(keys)
+        res = {}
+        local = self._local_enabled()
+        if local:
+            misses = []
+            for key in keys:
+                value = self.local.get(self.prefix + key, MISSING)
+                self._count(key, value is not MISSING)
+                if value is not MISSING:
+                    res[key] = value
+                else:
+                    misses.append(key)
+            keys = misses
+
+        conn = self.redis_manager.conn
+        for chunk in self._chunks(keys, chunk_size):
+            names = [self.prefix + key for key in chunk]
+            generation = self._generation
+            if local:
+                # read remaining ttl in the same round trip. Single key commands work also with redis cluster
+                pipe = conn.pipeline(transaction=False)
+                for name in names:
+                    pipe.get(name)
+                for name in names:
+                    pipe.pttl(name)
+                values = pipe.execute()
+                values, pttls = values[: len(names)], values[len(names) :]
+            else:
+                values = self.redis_manager.gets(names)
+            for i, raw in enumerate(values):
+                if raw is None:
+                    continue
+                value = res[chunk[i]] = self._decode(raw)
+                if local:
+                    self._fill(names[i], value, pttls[i] / 1000.0 if pttls[i] >= 0 else None, generation)
+        self.logger.debug("Get %s cache items - found: %s" % (total, len(res)))
+        return res
+
+    def set_many(self, items: dict, ttl=600, pickling=False, chunk_size: int = None, tags=None) -> bool:
+        """Set many cache items with a pipeline of SETEX for every chunk of items
+
+        :param items: dict {key: value}
+        :param ttl: items time to live [default=600s]
+        :param pickling: if true marshal values using pickle otherways use json [default=False]
+        :param chunk_size: max number of items sent with a single pipeline [default=client chunk_size]
+        :param tags: list of tags of all the items [optional]
+        :return: True
+        """
+        for chunk in self._chunks(list(items.items()), chunk_size):
+            values = [(key, self._encode(value, pickling=pickling)) for key, value in chunk]
+
+            def build(pipe):
+                for key, value in values:
+                    pipe.setex(self.prefix + key, ttl, value)
+                    if tags:
+                        self._tag_key(key, tags, ttl, pipe)
+                    if self.local is not None:
+                        self.invalidator.publish("k:" + self.prefix + key, pipe=pipe)
+
+            self._execute(build)
+            if self.local is not None:
+                for key, value in chunk:
+                    self._invalidate("k:" + self.prefix + key)
+        self.logger.debug("Set %s cache items [%ss]" % (len(items), ttl))
+        return True
+
+    def delete_many(self, keys: list, chunk_size: int = None) -> int:
+        """Delete many cache items with a UNLINK for every chunk of keys. Memory is reclaimed by redis in background.
+
+        :param keys: list of cache item keys
+        :param chunk_size: max number of keys deleted with a single UNLINK [default=client chunk_size]
+        :return: number of items deleted
+        """
+        res = 0
+        conn = self.redis_manager.conn
+        for chunk in self._chunks(list(keys), chunk_size):
+            res += self._unlink_keys(conn, [self.prefix + key for key in chunk])
+        self.logger.debug("Delete %s cache items - deleted: %s" % (len(keys), res))
+        return res
+
+    def invalidate_tags(self, tags: list, chunk_size: int = None) -> int:
+        """Delete the items with any of the tags. Every tag set is renamed, so items tagged during the invalidation are
+        not lost, then its keys are read with SSCAN and deleted with an UNLINK for every chunk.
+
+        :param tags: list of tags
+        :param chunk_size: max number of keys deleted with a single UNLINK [default=client chunk_size]
+        :return: number of items deleted
+        """
+        chunk_size = chunk_size or self.chunk_size
+        conn = self.redis_manager.conn
+        res = 0
+        for tag in tags:
+            name = tag_name(self.prefix, tag)
+            pending = "%s:%s" % (name, secrets.token_hex(8))
+            try:
+                conn.rename(name, pending)
+            except ResponseError:
+                # tag set does not exist
+                continue
+            try:
+                batch = []
+                for key in conn.sscan_iter(pending, count=chunk_size):
+                    batch.append(key)
+                    if len(batch) >= chunk_size:
+                        res += self._unlink_keys(conn, batch)
+                        batch = []
+                if len(batch) > 0:
+                    res += self._unlink_keys(conn, batch)
+            finally:
+                conn.unlink(pending)
+        self.logger.debug("Invalidate cache tags %s - deleted: %s" % (tags, res))
+        return res
+
+    def _unlink_keys(self, conn, names: list) -> int:
+        """Delete redis keys with a UNLINK and broadcast the invalidation"""
+        if self.local is None:
+            return self.redis_manager.unlink_keys(names)
+        pipe = conn.pipeline(transaction=False)
+        for name in names:
+            pipe.unlink(name)
+        messages = ["k:" + (name.decode("utf-8") if isinstance(name, bytes) else name) for name in names]
+        for message in messages:
+            self.invalidator.publish(message, pipe=pipe)
+        res = sum(pipe.execute()[: len(names)])
+        for message in messages:
+            self._invalidate(message)
+        return res
+
+    def iter_keys_by_pattern(self, pattern, count=None, pause=None):
+        """Iterate over keys by pattern with SCAN
+
+        :param pattern: key search pattern
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: generator of redis keys
+        """
+        return self.redis_manager.iter_keys(self.prefix + pattern, count=count, pause=pause)
+
+    def iter_by_pattern(self, pattern, count=None, pause=None):
+        """Iterate over items by pattern. Keys are found with SCAN and values are read with a MGET for every batch of
+        at most chunk_size keys. Items expired during the iteration are skipped.
+
+        :param pattern: key search pattern
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: generator of {'key':.., 'value':..} with redis key and raw redis value
+        """
+        for keys in self.redis_manager.iter_key_batches(self.prefix + pattern, count=count, pause=pause):
+            for chunk in self._chunks(keys):
+                for key, value in zip(chunk, self.redis_manager.gets(chunk)):
+                    if value is not None:
+                        yield {"key": key, "value": value}
+
     def get_by_pattern(self, pattern):
         """Get keys by pattern
 
         :param pattern: key search pattern
         :return: list of items
         """
-        # print("+++++ CacheClient - get_by_pattern - pattern: %s" % pattern)
-        keys = self.redis_manager.keys(self.prefix + pattern)
-        # print("+++++ CacheClient - get_by_pattern - keys: %s" % keys)
-        res = []
-        if keys is not None:
-            for key in keys:
-                res.append({"key": key, "value": self.redis_manager.get(key)})
-        return res
+        return list({item["key"]: item for item in self.iter_by_pattern(pattern)}.values())
 
     def get_keys_by_pattern(self, pattern):
         """Get keys by pattern
@@ -107,20 +683,21 @@ class CacheClient(object):
         :param pattern: key search pattern
         :return: list of items
         """
-        # print("+++++ CacheClient - get_by_pattern - pattern: %s" % pattern)
-        keys = self.redis_manager.keys(self.prefix + pattern)
-        # print("+++++ CacheClient - get_by_pattern - keys: %s" % keys)
-        return keys
+        return list(dict.fromkeys(self.iter_keys_by_pattern(pattern)))
 
-    def delete_by_pattern(self, pattern):
-        """Delete keys by pattern
+    def delete_by_pattern(self, pattern, count=None, pause=None):
+        """Delete keys by pattern. Keys are found with SCAN and deleted with an UNLINK for every batch.
 
         :param pattern: key search pattern
-        :return: True
+        :param count: keys examined by every SCAN [default=redis manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=redis manager scan_pause]
+        :return: number of keys deleted or None if no key was found
         """
-        # print("+++++ CacheClient - delete_by_pattern - pattern: %s" % pattern)
-        res = self.redis_manager.delete(self.prefix + pattern)
-        return res
+        res = self.redis_manager.unlink_by_pattern(self.prefix + pattern, count=count, pause=pause)
+        self._publish("p:" + self.prefix + pattern)
+        if res > 0:
+            return res
+        return None
 
     def extend_ttl(self, key, ttl=600) -> bool:
         """Extend a cache item ttl
@@ -129,5 +706,6 @@ class CacheClient(object):
         :return: True
         """
         ret = self.redis_manager.expire(self.prefix + key, ttl)
+        self._publish("k:" + self.prefix + key)
         self.logger.debug("Extend cache item %s ttl to %s - ret: %s" % (key, ttl, ret))
         return ret
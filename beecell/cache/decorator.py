@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import inspect
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from enum import Enum
+from functools import wraps
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Union
+from uuid import UUID
+import ujson as json
+from .client import CacheClient
+
+# ujson 2.x does not accept reject_bytes, see beecell.simple.jsonDumps
+_JSON_PARAMS = {"reject_bytes": True} if int(json.__version__.split(".")[0]) >= 3 else {}
+
+# statistics of decorated functions by name
+_stats = {}
+_stats_lock = Lock()
+
+
+def _canonical(value: Any, out: list):
+    """Append to out a canonical representation of value. Dict items and sets are sorted so that equal values always
+    have the same representation."""
+    if value is None or isinstance(value, bool):
+        out.append(str(value))
+    elif isinstance(value, int):
+        out.append("i%d" % value)
+    elif isinstance(value, float):
+        out.append("f" + repr(value))
+    elif isinstance(value, str):
+        out.append(json.dumps(value, ensure_ascii=False))
+    elif isinstance(value, bytes):
+        out.append("b" + value.hex())
+    elif isinstance(value, (list, tuple)):
+        out.append("[" if isinstance(value, list) else "(")
+        for item in value:
+            _canonical(item, out)
+            out.append(",")
+        out.append("]")
+    elif isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            item = []
+            _canonical(k, item)
+            item.append(":")
+            _canonical(v, item)
+            items.append("".join(item))
+        out.append("{" + ",".join(sorted(items)) + "}")
+    elif isinstance(value, (set, frozenset)):
+        items = []
+        for item in value:
+            part = []
+            _canonical(item, part)
+            items.append("".join(part))
+        out.append("s{" + ",".join(sorted(items)) + "}")
+    elif isinstance(value, Enum):
+        out.append("e%s.%s" % (value.__class__.__qualname__, value.name))
+    elif isinstance(value, (datetime, date, dtime)):
+        out.append("t" + value.isoformat())
+    elif isinstance(value, (UUID, Decimal)):
+        out.append("u" + str(value))
+    else:
+        raise TypeError("Value of type %s can not be used in cache key, use cached key" % type(value).__name__)
+
+
+def _json_typed(value: Any) -> bool:
+    """Check json keeps the type of value. Tuples are encoded like lists and dict keys that are not str like str."""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if not isinstance(k, str) or not _json_typed(v):
+                return False
+        return True
+    if isinstance(value, list):
+        for item in value:
+            if not _json_typed(item):
+                return False
+        return True
+    return not isinstance(value, tuple)
+
+
+def make_key(arguments: dict) -> str:
+    """Get a stable hash of function arguments
+
+    :param arguments: dict {argument name: value}
+    :return: blake2b hex digest
+    """
+    try:
+        # fast path for json serializable arguments
+        if not _json_typed(arguments):
+            raise TypeError("Value type is lost in json")
+        data = json.dumps(arguments, sort_keys=True, ensure_ascii=False, **_JSON_PARAMS)
+        data = "j" + data
+    except (TypeError, OverflowError):
+        out = ["c"]
+        _canonical(arguments, out)
+        data = "".join(out)
+    return blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_stats() -> dict:
+    """Get statistics of all the decorated functions
+
+    :return: {function name: {'hits':.., 'misses':.., 'loads':.., 'load_time':.., 'avg_load_time':.., 'bypass':..,
+        'refresh':..}}
+    """
+    with _stats_lock:
+        names = list(_stats.keys())
+    return {name: _get_stats(name) for name in names}
+
+
+def _get_stats(name: str) -> dict:
+    with _stats_lock:
+        res = dict(_stats[name])
+    res["avg_load_time"] = res["load_time"] / res["loads"] if res["loads"] > 0 else 0.0
+    return res
+
+
+def _count(name: str, counter: str, value=1):
+    with _stats_lock:
+        _stats[name][counter] += value
+
+
+def cached(
+    client: CacheClient,
+    ttl=600,
+    key: Union[str, Callable] = None,
+    name: str = None,
+    pickling=False,
+    stampede=False,
+    tags=None,
+    ignore=("self", "cls"),
+    **options,
+):
+    """Decorator that caches function results with a :class:`CacheClient`.
+
+    Cache key is <name>.<hash>, where hash is the blake2b digest of a canonical representation of function arguments,
+    with positional and keyword arguments and defaults bound to their names. Arguments must be json serializable or
+    sets, enums, dates, uuids and decimals, otherwise use key.
+    Decorated function accepts two more keyword arguments: cache_bypass=True calls the function without reading or
+    writing the cache, cache_refresh=True calls the function and overwrites the cached result.
+    Decorated function has methods cache_key(*args, **kwargs) that returns the cache key, invalidate(*args, **kwargs)
+    that deletes the cached result and cache_stats() that returns its statistics.
+
+    Example::
+
+        @cached(client, ttl=300, tags=["orgs"])
+        def get_org(org_id, details=False):
+            ...
+
+    :param client: cache client
+    :param ttl: result time to live [default=600s]
+    :param key: key used in place of the hash. Str is formatted with the arguments by name, like 'org.{org_id}',
+        callable is called with the function arguments [optional]
+    :param name: key prefix [default=<function module>.<function qualified name>]
+    :param pickling: if true marshal result using pickle otherways use json [default=False]
+    :param stampede: if True load missing results with :meth:`CacheClient.get_or_set` [default=False]
+    :param tags: list of tags of cached results [optional]
+    :param ignore: names of the arguments not used in the cache key [default=('self', 'cls')]
+    :param options: other get_or_set params like stale_ttl, lock_ttl, wait, beta
+    :return: decorator
+    """
+
+    def wrapper(func):
+        prefix = name or "%s.%s" % (func.__module__, func.__qualname__)
+        signature = inspect.signature(func)
+        with _stats_lock:
+            _stats.setdefault(prefix, {"hits": 0, "misses": 0, "loads": 0, "load_time": 0.0, "bypass": 0, "refresh": 0})
+
+        def cache_key(*args, **kwargs) -> str:
+            if callable(key):
+                return "%s.%s" % (prefix, key(*args, **kwargs))
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {k: v for k, v in bound.arguments.items() if k not in ignore}
+            if key is not None:
+                return "%s.%s" % (prefix, key.format(**arguments))
+            return "%s.%s" % (prefix, make_key(arguments))
+
+        def load(args, kwargs):
+            start = monotonic()
+            res = func(*args, **kwargs)
+            with _stats_lock:
+                stats = _stats[prefix]
+                stats["loads"] += 1
+                stats["load_time"] += monotonic() - start
+            return res
+
+        @wraps(func)
+        def decorated(*args, cache_bypass=False, cache_refresh=False, **kwargs):
+            if cache_bypass is True:
+                _count(prefix, "bypass")
+                return func(*args, **kwargs)
+
+            item_key = cache_key(*args, **kwargs)
+            if cache_refresh is True:
+                _count(prefix, "refresh")
+                res = load(args, kwargs)
+                client.set(item_key, res, ttl=ttl, pickling=pickling, tags=tags)
+                return res
+
+            if stampede is True:
+                loaded = []
+
+                def loader():
+                    loaded.append(True)
+                    return load(args, kwargs)
+
+                res = client.get_or_set(item_key, loader, ttl=ttl, pickling=pickling, tags=tags, **options)
+                _count(prefix, "misses" if loaded else "hits")
+                return res
+
+            found = client.get_many([item_key])
+            if item_key in found:
+                _count(prefix, "hits")
+                return found[item_key]
+            _count(prefix, "misses")
+            res = load(args, kwargs)
+            client.set(item_key, res, ttl=ttl, pickling=pickling, tags=tags)
+            return res
+
+        def invalidate(*args, **kwargs) -> bool:
+            return client.delete(cache_key(*args, **kwargs))
+
+        decorated.cache_key = cache_key
+        decorated.invalidate = invalidate
+        decorated.cache_stats = lambda: _get_stats(prefix)
+        return decorated
+
+    return wrapper
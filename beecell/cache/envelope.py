@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+"""Binary serialization of cache items.
+
+Envelope layout, version 1::
+
+    MAGIC | version (1 byte) | codec (1 byte) | flags (1 byte) | payload
+
+codec is 'j' for json, 'p' for pickle and 'b' for raw bytes. When flag COMPRESSED is set payload is zlib compressed.
+Payload is compressed only when it is longer than the compression threshold and compression makes it shorter.
+When flag DELTA is set header is followed by the seconds spent to compute the value (float32), used for early refresh.
+
+Legacy json envelopes, {"data": value} or {"pickled": base64 pickled value}, are still decoded. A legacy envelope
+can store the seconds spent to compute the value in field delta, ignored by older versions.
+"""
+
+import codecs
+import pickle
+import struct
+import zlib
+from typing import Any, Optional, Tuple, Union
+import ujson as json
+
+MAGIC = b"\x00BCE"
+VERSION = 1
+
+# codecs
+JSON = b"j"
+PICKLE = b"p"
+RAW = b"b"
+CODECS = (JSON, PICKLE, RAW)
+
+# flags
+COMPRESSED = 1
+DELTA = 2
+
+HEADER = struct.Struct(">4sBcB")
+DELTA_FIELD = struct.Struct(">f")
+
+# default compression threshold in bytes
+COMPRESS_THRESHOLD = 1024
+# default zlib compression level
+COMPRESS_LEVEL = 1
+
+# ujson 2.x does not accept reject_bytes, see beecell.simple.jsonDumps
+_JSON_PARAMS = {"reject_bytes": False} if int(json.__version__.split(".")[0]) >= 3 else {}
+
+
+class EnvelopeError(Exception):
+    pass
+
+
+def encode(
+    value: Any,
+    codec: bytes = None,
+    compress_threshold: int = COMPRESS_THRESHOLD,
+    compress_level: int = COMPRESS_LEVEL,
+    delta: float = None,
+) -> bytes:
+    """Encode a cache item
+
+    :param value: item value
+    :param codec: JSON, PICKLE or RAW [default=RAW for bytes, JSON for other values]
+    :param compress_threshold: payload longer than this number of bytes is compressed. If None payload is never
+        compressed [default=1024]
+    :param compress_level: zlib compression level [default=1]
+    :param delta: seconds spent to compute the value [optional]
+    :return: envelope
+    :raises EnvelopeError: raise :class:`EnvelopeError`
+    """
+    if codec is None:
+        codec = RAW if isinstance(value, bytes) else JSON
+    if codec == JSON:
+        payload = json.dumps(value, ensure_ascii=False, **_JSON_PARAMS).encode("utf-8")
+    elif codec == PICKLE:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    elif codec == RAW:
+        if not isinstance(value, (bytes, bytearray)):
+            raise EnvelopeError("Raw codec requires bytes value")
+        payload = bytes(value)
+    else:
+        raise EnvelopeError("Unknown codec %s" % codec)
+
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        compressed = zlib.compress(payload, compress_level)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= COMPRESSED
+    if delta is not None:
+        flags |= DELTA
+        return HEADER.pack(MAGIC, VERSION, codec, flags) + DELTA_FIELD.pack(delta) + payload
+    return HEADER.pack(MAGIC, VERSION, codec, flags) + payload
+
+
+def decode_legacy(data: Union[str, bytes]) -> Any:
+    """Decode a legacy json envelope
+
+    :param data: envelope
+    :return: item value
+    """
+    return _legacy_value(json.loads(data))
+
+
+def _legacy_value(envelop: dict) -> Any:
+    value = envelop.get("data", None)
+    if value is None:
+        pickled = envelop.get("pickled", None)
+        if pickled is not None:
+            value = pickle.loads(codecs.decode(pickled.encode(), "base64"))
+    return value
+
+
+def decode(data: Union[str, bytes]) -> Any:
+    """Decode a cache item
+
+    :param data: envelope, binary or legacy json
+    :return: item value. None if data is None
+    :raises EnvelopeError: raise :class:`EnvelopeError`
+    """
+    return decode_with_delta(data)[0]
+
+
+def decode_with_delta(data: Union[str, bytes]) -> Tuple[Any, Optional[float]]:
+    """Decode a cache item and the seconds spent to compute it
+
+    :param data: envelope, binary or legacy json
+    :return: (item value, delta). Value is None if data is None, delta is None if it was not stored
+    :raises EnvelopeError: raise :class:`EnvelopeError`
+    """
+    if data is None:
+        return None, None
+    if not isinstance(data, bytes) or not data.startswith(MAGIC):
+        envelop: dict = json.loads(data)
+        return _legacy_value(envelop), envelop.get("delta", None)
+
+    offset = HEADER.size
+    delta = None
+    try:
+        magic, version, codec, flags = HEADER.unpack_from(data)
+        if flags & DELTA:
+            delta = DELTA_FIELD.unpack_from(data, offset)[0]
+            offset += DELTA_FIELD.size
+    except struct.error as ex:
+        raise EnvelopeError("Invalid cache envelope: %s" % ex)
+    if version != VERSION:
+        raise EnvelopeError("Unsupported cache envelope version %s" % version)
+    payload = memoryview(data)[offset:]
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+
+    if codec == JSON:
+        return json.loads(bytes(payload)), delta
+    if codec == PICKLE:
+        return pickle.loads(payload), delta
+    if codec == RAW:
+        return bytes(payload), delta
+    raise EnvelopeError("Unknown codec %s" % codec)
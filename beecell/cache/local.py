@@ -0,0 +1,243 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import logging
+import os
+import secrets
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from threading import RLock, Thread, Event
+from time import monotonic
+from typing import Any, Callable
+
+
+class LocalCache(object):
+    """Thread safe in process cache with LRU eviction and per item time to live.
+
+    :param maxsize: max number of items [default=1000]
+    :param ttl: default item time to live in seconds [default=60]
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get an item
+
+        :param key: item key
+        :param default: value returned when item does not exist or is expired [default=None]
+        :return: item value
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """Set an item. When cache is full the least recently used item is evicted.
+
+        :param key: item key
+        :param value: item value
+        :param ttl: item time to live in seconds [default=cache ttl]
+        """
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        with self._lock:
+            if ttl <= 0:
+                self._data.pop(key, None)
+                return
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def ttl_of(self, key: str) -> float:
+        """Get item remaining time to live
+
+        :param key: item key
+        :return: remaining time to live in seconds or None if item does not exist
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            return max(item[0] - monotonic(), 0)
+
+    def delete(self, key: str):
+        """Delete an item
+
+        :param key: item key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_by_pattern(self, pattern: str) -> int:
+        """Delete items whose key match a glob style pattern
+
+        :param pattern: key pattern like 'cache.*'
+        :return: number of deleted items
+        """
+        with self._lock:
+            keys = [key for key in self._data.keys() if fnmatchcase(key, pattern)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        """Delete all the items"""
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self) -> dict:
+        """Get cache statistics
+
+        :return: {'size':.., 'maxsize':.., 'hits':.., 'misses':.., 'hit_ratio':.., 'evictions':.., 'expirations':..}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total > 0 else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class RedisInvalidator(object):
+    """Listen a redis pub/sub channel in a daemon thread and call callback for every message received.
+
+    Listener is started lazily by :meth:`start` and started again in a forked process, like uwsgi workers that fork
+    after application import. Every time the subscription is (re)established callback is called with None, because
+    messages published while not subscribed are lost and the local state must be dropped.
+    Messages sent with :meth:`publish` are tagged with a sender id and are not passed to the callback of the listener
+    that sent them, the sender has already applied them.
+
+    :param redis_manager: redis manager reference (RedisManager)
+    :param channel: pub/sub channel name
+    :param callback: function called with the message data as str or None
+    :param retry_delay: seconds to wait before subscribing again after an error [default=1]
+    """
+
+    def __init__(self, redis_manager, channel: str, callback: Callable, retry_delay: float = 1):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        self.redis_manager = redis_manager
+        self.channel = channel
+        self.callback = callback
+        self.retry_delay = retry_delay
+        self.connected = False
+        self._pid = None
+        self._thread = None
+        self._stop = Event()
+        self._lock = RLock()
+        self._subscribed = Event()
+        self._token = secrets.token_hex(6)
+
+    @property
+    def sender(self) -> str:
+        """Id of this listener in the current process, a forked process has a different id"""
+        return "%s.%s" % (self._token, os.getpid())
+
+    def start(self):
+        """Start listener thread if it is not running in the current process"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self.connected = False
+            self._pid = os.getpid()
+            self._stop = Event()
+            self._subscribed = Event()
+            self._thread = Thread(target=self._run, name="invalidator-%s" % self.channel, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop listener thread"""
+        self._stop.set()
+        self.connected = False
+        self._subscribed.clear()
+
+    def wait_connected(self, timeout: float = None) -> bool:
+        """Wait until the channel is subscribed
+
+        :param timeout: max seconds to wait [optional]
+        :return: True if the channel is subscribed
+        """
+        return self._subscribed.wait(timeout)
+
+    def publish(self, message: str, pipe=None):
+        """Publish a message on the channel
+
+        :param message: message to publish
+        :param pipe: redis pipeline used to publish the message with other commands [optional]
+        """
+        message = "@%s %s" % (self.sender, message)
+        if pipe is not None:
+            pipe.publish(self.channel, message)
+        else:
+            self.redis_manager.conn.publish(self.channel, message)
+
+    def _receive(self, data: str):
+        """Call callback with a received message, skipping the messages sent by this listener"""
+        if data.startswith("@"):
+            sender, _, data = data[1:].partition(" ")
+            if sender == self.sender:
+                return
+        self.callback(data)
+
+    def _run(self):
+        stop = self._stop
+        subscribed = self._subscribed
+        while not stop.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis_manager.conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.callback(None)
+                self.connected = True
+                subscribed.set()
+                self.logger.debug("Subscribe invalidation channel %s" % self.channel)
+                while not stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message.get("type") == "message":
+                        data = message.get("data")
+                        if isinstance(data, bytes):
+                            data = data.decode("utf-8")
+                        self._receive(data)
+            except Exception as ex:
+                self.connected = False
+                subscribed.clear()
+                self.logger.warning("Invalidation channel %s error: %s" % (self.channel, ex))
+                self.callback(None)
+                stop.wait(self.retry_delay)
+            finally:
+                self.connected = False
+                subscribed.clear()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
@@ -5,10 +5,21 @@
 import hashlib
 import typing
 import secrets
+import warnings
+
+try:
+    with warnings.catch_warnings():
+        # crypt module is deprecated since python 3.11
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import crypt
+except ImportError:
+    crypt = None
 
 # Constants
 ROUNDS_DEFAULT = 5000
 ALPHABET = [ord(c) for c in "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"]
+# sha512_crypt("Hello world!", "saltstring") reference hash
+TEST_VECTOR = "svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1"
 
 # Predefined permutation for base64 encoding
 PERMUTATION = [
@@ -60,19 +71,31 @@ def digest(data: bytes) -> bytes:
     return hashlib.sha512(data).digest()
 
 
-def sha512_crypt(
-    password: typing.Union[bytes, str], salt: typing.Union[bytes, str], rounds: int = ROUNDS_DEFAULT
-) -> str:
-    """Custom implementation of SHA512-crypt."""
-    # Ensure password and salt are byte-encoded
-    if isinstance(password, str):
-        password = password.encode("utf-8")
-    if salt is None:
-        salt = custom_b64_encode(secrets.token_bytes(64))[:16].encode("ascii")
-    elif isinstance(salt, str):
-        salt = salt.encode("utf-8")
-    salt = salt[:16]
+def _round_steps(p: bytes, s: bytes) -> list:
+    """Precompute the inputs of the 42 distinct rounds of SHA512-crypt.
 
+    Round input depends only on round_num % 2, % 3 and % 7, so it repeats every 42 rounds. Odd rounds hash a constant
+    prefix followed by the last digest: the prefix is hashed once and its hash object is copied. Even rounds hash the
+    last digest followed by a constant suffix.
+
+    :return: list of (hash object of the prefix, None) or (None, suffix)
+    """
+    steps = []
+    for round_num in range(42):
+        data = b""
+        if round_num % 3:
+            data += s
+        if round_num % 7:
+            data += p
+        if round_num & 1:
+            steps.append((hashlib.sha512(p + data), None))
+        else:
+            steps.append((None, data + p))
+    return steps
+
+
+def _sha512_crypt_digest(password: bytes, salt: bytes, rounds: int) -> bytes:
+    """Compute the SHA512-crypt digest."""
     # Initial hash calculations (A and B)
     b = digest(password + salt + password)
     a_input = password + salt + repeat_to_length(b, len(password))
@@ -91,19 +114,95 @@ def sha512_crypt(
     ds = digest(salt * (16 + a[0]))
     s = repeat_to_length(ds, len(salt))
 
-    # Main rounds of SHA512 crypt computation
+    # Main rounds of SHA512 crypt computation, in cycles of 42 rounds
+    sha512 = hashlib.sha512
+    steps = _round_steps(p, s)
+    cycles, rest = divmod(rounds, 42)
     c = a
-    for round_num in range(rounds):
-        c_input = p if round_num & 1 else c
-        if round_num % 3:
-            c_input += s
-        if round_num % 7:
-            c_input += p
-        c_input += c if round_num & 1 else p
-        c = digest(c_input)
+    for steps_slice in [steps] * cycles + [steps[:rest]]:
+        for prefix, suffix in steps_slice:
+            if prefix is None:
+                c = sha512(c + suffix).digest()
+            else:
+                h = prefix.copy()
+                h.update(c)
+                c = h.digest()
+    return c
+
+
+def _sha512_crypt_native(password: bytes, salt: bytes, rounds: int) -> typing.Optional[str]:
+    """Compute the SHA512-crypt hash with the system crypt library.
+
+    :return: encoded hash or None if the parameters are not supported by crypt library
+    """
+    if crypt is None or rounds < 1000 or b"\x00" in password:
+        return None
+    try:
+        password_str = password.decode("utf-8")
+        salt_str = salt.decode("ascii")
+    except UnicodeDecodeError:
+        return None
+    if any(c in salt_str for c in "$:\n"):
+        return None
+    res = crypt.crypt(password_str, "$6$rounds=%s$%s" % (rounds, salt_str))
+    if res is None or not res.startswith("$6$"):
+        return None
+    return res.split("$")[-1]
+
+
+def _check_native() -> bool:
+    """Check the system crypt library returns the reference SHA512-crypt hash."""
+    try:
+        return _sha512_crypt_native(b"Hello world!", b"saltstring", 5000) == TEST_VECTOR
+    except Exception:
+        return False
+
+
+def set_backend(name: str = None):
+    """Set the SHA512-crypt backend
+
+    :param name: 'native' to use the system crypt library, 'builtin' to use the python engine. If None the system
+        crypt library is used when it computes the reference hash [default=None]
+    """
+    global BACKEND
+    if name is None:
+        name = "native" if _check_native() else "builtin"
+    elif name == "native" and not _check_native():
+        raise ValueError("crypt library does not support SHA512-crypt")
+    elif name not in ("native", "builtin"):
+        raise ValueError("unknown backend %s" % name)
+    BACKEND = name
+
+
+def get_backend() -> str:
+    """Get the SHA512-crypt backend
+
+    :return: 'native' or 'builtin'
+    """
+    return BACKEND
+
+
+def sha512_crypt(
+    password: typing.Union[bytes, str], salt: typing.Union[bytes, str], rounds: int = ROUNDS_DEFAULT
+) -> str:
+    """Custom implementation of SHA512-crypt."""
+    # Ensure password and salt are byte-encoded
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+    if salt is None:
+        salt = custom_b64_encode(secrets.token_bytes(64))[:16].encode("ascii")
+    elif isinstance(salt, str):
+        salt = salt.encode("utf-8")
+    salt = salt[:16]
+
+    hash_encoded = None
+    if BACKEND == "native":
+        hash_encoded = _sha512_crypt_native(password, salt, rounds)
+    if hash_encoded is None:
+        c = _sha512_crypt_digest(password, salt, rounds)
+        # Final base64 encoding of the result
+        hash_encoded = custom_b64_encode(c[:64])  # Only encode the first 64 bytes
 
-    # Final base64 encoding of the result
-    hash_encoded = custom_b64_encode(c[:64])  # Only encode the first 64 bytes
     if rounds == ROUNDS_DEFAULT:
         return f"$6${salt.decode()}${hash_encoded}"
     return f"$6$rounds={rounds}${salt.decode()}${hash_encoded}"
@@ -130,3 +229,8 @@ def password_ok(input_password, existing_crypted_password):
     """Return if the password is ok."""
     (salt, rounds) = extract_salt_and_rounds(existing_crypted_password)
     return existing_crypted_password == sha512_crypt(input_password, salt, rounds)
+
+
+# use system crypt library when it supports SHA512-crypt
+BACKEND = "builtin"
+set_backend()
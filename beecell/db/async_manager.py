@@ -0,0 +1,261 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import asyncio
+import logging
+from .manager import RedisManagerError, parse_redis_uri
+
+try:
+    import redis.asyncio as aioredis
+    from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+except ImportError:
+    aioredis = None
+
+
+class AsyncRedisManager(object):
+    """Asyncio manager for redis instance. Requires redis>=4.2.
+
+    Commands share a blocking connection pool: when all the max_connections connections are in use a command waits up
+    to timeout seconds for a free connection, so many concurrent tasks can use the same manager.
+
+    Redis cluster is not supported: a ``redis-cluster://`` uri raises :class:`RedisManagerError`. Use
+    :class:`RedisManager` with a redis cluster.
+
+    :param str redis_uri: redis connection uri parsed with :func:`parse_redis_uri`, like ``redis://localhost:6379/1``,
+        ``redis://:pwd@localhost:6379/1``, ``localhost;6379;1`` or ``redis-sentinel://host1,host2:group:26379/1``
+    :param int timeout: redis connection timeout [default=30]
+    :param int max_connections: max number of connections [default=200]
+    :param list sentinels: list of (sentinel ip, sentinel port) [optional]
+    :param str sentinel_name: sentinel group name [optional]
+    :param str sentinel_pwd: sentinel password [optional]
+    :param int db: sentinel db [default=0]
+    :param str pwd: sentinel redis password [optional]
+    :param int scan_count: keys examined by every SCAN of pattern operations [default=1000]
+    :param float scan_pause: seconds to sleep between two SCAN of pattern operations [default=0]
+    """
+
+    def __init__(
+        self,
+        redis_uri,
+        timeout=30,
+        max_connections=200,
+        sentinels=None,
+        sentinel_name=None,
+        sentinel_pwd=None,
+        db=0,
+        pwd=None,
+        scan_count=1000,
+        scan_pause=0.0,
+    ):
+        self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__)
+
+        if aioredis is None:
+            raise RedisManagerError("redis.asyncio is not available, redis>=4.2 is required")
+
+        self.is_single = False
+        self.is_cluster = False
+        self.is_sentinel = False
+        self.sentinel = None
+        self.sentinel_name = sentinel_name
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.scan_count = scan_count
+        self.scan_pause = scan_pause
+        self.hosts = []
+
+        if sentinels is None:
+            config = parse_redis_uri(redis_uri)
+            if config["type"] == "cluster":
+                raise RedisManagerError("redis cluster is not supported by AsyncRedisManager, use RedisManager")
+            if config["type"] == "sentinel":
+                sentinels = [(host, config["port"]) for host in config["hosts"]]
+                sentinel_name = config["group"]
+                db = config["db"]
+                pwd = config["pwd"]
+
+        # redis sentinels
+        if sentinels is not None:
+            self.is_sentinel = True
+            if sentinel_name is None:
+                raise RedisManagerError("sentinel group name must be specified")
+            sentinel_kwargs = {}
+            if sentinel_pwd is not None:
+                sentinel_kwargs = {"password": sentinel_pwd}
+            self.sentinel = AsyncSentinel(sentinels, socket_timeout=timeout, sentinel_kwargs=sentinel_kwargs)
+            self.sentinel_name = sentinel_name
+            self.hosts = ["%s:%s" % (host, port) for host, port in sentinels]
+            # sentinel connection pool discovers the current master when a connection is opened
+            self.server = self.sentinel.master_for(
+                sentinel_name,
+                socket_timeout=timeout,
+                db=int(db),
+                password=pwd,
+                retry_on_timeout=False,
+                max_connections=max_connections,
+            )
+
+        # single redis node
+        else:
+            self.is_single = True
+            self.hosts = ["%s:%s" % (config["host"], config["port"])]
+            pool = aioredis.BlockingConnectionPool(
+                host=config["host"],
+                port=config["port"],
+                db=config["db"],
+                password=config.get("pwd"),
+                socket_timeout=timeout,
+                retry_on_timeout=False,
+                max_connections=max_connections,
+                timeout=timeout,
+            )
+            self.server = aioredis.Redis(connection_pool=pool)
+
+    def __str__(self):
+        return "<AsyncRedisManager hosts:%s, sentinel:%s>" % (self.hosts, self.is_sentinel)
+
+    @property
+    def conn(self):
+        return self.server
+
+    async def close(self):
+        """Close connections"""
+        # close is deprecated by aclose since redis 5.0.1
+        close = getattr(self.server, "aclose", None)
+        if close is None:
+            close = self.server.close
+        await close()
+        if hasattr(self.server, "connection_pool"):
+            await self.server.connection_pool.disconnect()
+
+    async def ping(self):
+        try:
+            res = await self.conn.ping()
+            self.logger.debug("Ping redis %s: %s" % (self.conn, res))
+            return res
+        except aioredis.ConnectionError as ex:
+            self.logger.error(ex)
+            return False
+
+    async def info(self):
+        return await self.conn.info()
+
+    async def size(self):
+        return await self.conn.dbsize()
+
+    async def get(self, key):
+        """Query key value.
+
+        :param key: key to get
+        :return: value
+        """
+        return await self.conn.get(key)
+
+    async def ttl(self, key):
+        """Query key ttl.
+
+        :param key: key to get
+        :return: ttl
+        """
+        return await self.conn.ttl(key)
+
+    async def gets(self, keys):
+        """Query key list value.
+
+        :param keys: keys list
+        :return: list of values
+        """
+        return await self.conn.mget(keys)
+
+    async def set(self, key, value):
+        """Set key value.
+
+        :param key: key to insert
+        :param value: value to insert
+        """
+        return await self.conn.set(key, value)
+
+    async def setex(self, key, time, value):
+        """Set key value with expire time
+
+        :param key: key to insert
+        :param time: expire time in seconds
+        :param value: value to insert
+        """
+        return await self.conn.setex(key, time, value)
+
+    async def expire(self, name, time: int):
+        return await self.conn.expire(name, time)
+
+    async def delete_key(self, key):
+        """Delete key
+
+        :param key: redis key
+        :return: None
+        """
+        await self.conn.delete(key)
+        return None
+
+    async def iter_key_batches(self, pattern="*", count=None, pause=None):
+        """Iterate over keys by pattern in current db with SCAN. See :meth:`RedisManager.iter_key_batches`
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: async generator of key lists, one for every SCAN that found keys
+        """
+        count = count or self.scan_count
+        pause = self.scan_pause if pause is None else pause
+        cursor = 0
+        while True:
+            cursor, keys = await self.conn.scan(cursor=cursor, match=pattern, count=count)
+            if len(keys) > 0:
+                yield keys
+            if int(cursor) == 0:
+                break
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    async def iter_keys(self, pattern="*", count=None, pause=None):
+        """Iterate over keys by pattern in current db with SCAN.
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: async generator of keys
+        """
+        async for keys in self.iter_key_batches(pattern, count=count, pause=pause):
+            for key in keys:
+                yield key
+
+    async def keys(self, pattern):
+        """Get keys by pattern in current db with SCAN.
+
+        :param pattern: key search pattern
+        :return: list of keys
+        """
+        return list(dict.fromkeys([key async for key in self.iter_keys(pattern)]))
+
+    async def unlink_by_pattern(self, pattern="*", count=None, pause=None):
+        """Delete keys by pattern in current db with SCAN and an UNLINK for every batch.
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: number of keys deleted
+        """
+        res = 0
+        async for keys in self.iter_key_batches(pattern, count=count, pause=pause):
+            res += await self.conn.unlink(*keys)
+        return res
+
+    async def delete(self, pattern="*"):
+        """Delete keys by pattern in current db.
+
+        :param pattern: key search pattern [default='*']
+        :return: number of keys deleted or None if no key was found
+        """
+        res = await self.unlink_by_pattern(pattern)
+        if res > 0:
+            return res
+        return None
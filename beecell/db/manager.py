@@ -3,7 +3,9 @@
 # (C) Copyright 2018-2024 CSI-Piemonte
 
 import logging
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 import os
 from datetime import datetime, timedelta
 from sshtunnel import SSHTunnelForwarder
@@ -19,9 +21,33 @@ logger = logging.getLogger(__name__)
 try:
     import redis
     from redis.sentinel import Sentinel
+
+    class SentinelMasterClient(redis.StrictRedis):
+        """Redis master client that reports connection errors, used to detect sentinel failover"""
+
+        on_error = None
+
+        def execute_command(self, *args, **options):
+            try:
+                return super().execute_command(*args, **options)
+            except (
+                redis.exceptions.ConnectionError,
+                redis.exceptions.TimeoutError,
+                redis.exceptions.ReadOnlyError,
+            ) as ex:
+                if self.on_error is not None:
+                    self.on_error(ex)
+                raise
+
 except:
     pass
 
+try:
+    # redis cluster client requires redis>=4.1
+    from redis.cluster import RedisCluster, ClusterNode
+except ImportError:
+    RedisCluster = None
+
 
 class SqlManagerError(Exception):
     pass
@@ -155,6 +181,10 @@ class RedisManager(ConnectionManager):
     :param list sentinels: list of (sentinel ip, sentinel port)
     :param str sentinel_name: sentinel group name
     :param str sentinel_pwd: sentinel password
+    :param int scan_count: keys examined by every SCAN of pattern operations [default=1000]
+    :param float scan_pause: seconds to sleep between two SCAN of pattern operations [default=0]
+    :param float master_check_interval: min seconds between two sentinel master checks made after a connection
+        error [default=1]
     :return: RedisManager instance
 
     :Example:
@@ -163,6 +193,9 @@ class RedisManager(ConnectionManager):
         - ``redis://localhost:6379/1``
         - ``localhost:6379:1``
         - ``redis-cluster://localhost:6379,localhost:6380``
+
+    With a redis cluster uri multi key operations, like gets and pattern deletes, are split by hash slot and sent with
+    a pipeline to every primary node. Nodes are queried concurrently. Redis cluster requires redis>=4.1.
     """
 
     def __init__(
@@ -175,6 +208,9 @@ class RedisManager(ConnectionManager):
         sentinel_pwd=None,
         db=0,
         pwd=None,
+        scan_count=1000,
+        scan_pause=0.0,
+        master_check_interval=1.0,
     ):
         ConnectionManager.__init__(self)
 
@@ -189,6 +225,22 @@ class RedisManager(ConnectionManager):
         self.max_connections = max_connections
         self.timeout = timeout
         self.hosts = []
+        self.scan_count = scan_count
+        self.scan_pause = scan_pause
+        self.master_address = None
+        self.master_check_interval = master_check_interval
+        self._master_checked = None
+        self._master_lock = Lock()
+        self._failover_stop = None
+        self._stats_lock = Lock()
+        self._conn_stats = {
+            "created": 0,
+            "reused": 0,
+            "failovers": 0,
+            "switch_master": 0,
+            "errors": 0,
+            "master_checks": 0,
+        }
 
         # redis sentinels
         if sentinels is not None:
@@ -207,6 +259,21 @@ class RedisManager(ConnectionManager):
             )
             self.sentinel_name = sentinel_name
 
+        # redis cluster
+        elif redis_uri.find("redis-cluster") >= 0:
+            if RedisCluster is None:
+                raise RedisManagerError("redis cluster is not supported, redis>=4.1 is required")
+            self.is_cluster = True
+            nodes = parse_redis_uri(redis_uri)["nodes"]
+            self.hosts = ["%s:%s" % (node["host"], node["port"]) for node in nodes]
+            self.server = RedisCluster(
+                startup_nodes=[ClusterNode(node["host"], int(node["port"])) for node in nodes],
+                password=pwd,
+                socket_timeout=timeout,
+                retry_on_timeout=False,
+                max_connections=max_connections,
+            )
+
         # single redis node
         elif redis_uri.find("redis") >= 0:
             self.is_single = True
@@ -249,17 +316,149 @@ class RedisManager(ConnectionManager):
     @property
     def conn(self):
         if self.is_sentinel is True:
-            self.server = self.sentinel.master_for(
-                self.sentinel_name,
-                socket_timeout=self.socket_timeout,
-                db=int(self.db),
-                password=self.pwd,
-                retry_on_timeout=False,
-                connection_pool=None,
-                max_connections=self.max_connections,
-            )
+            server = self.server
+            if server is not None:
+                self._count("reused")
+                return server
+            with self._master_lock:
+                if self.server is None:
+                    self.server = self._master_for()
+                return self.server
         return self.server
 
+    def _master_for(self):
+        """Create the sentinel master client. Client is created once and replaced only on failover."""
+        server = self.sentinel.master_for(
+            self.sentinel_name,
+            redis_class=SentinelMasterClient,
+            socket_timeout=self.socket_timeout,
+            db=int(self.db),
+            password=self.pwd,
+            retry_on_timeout=False,
+            connection_pool=None,
+            max_connections=self.max_connections,
+        )
+        server.on_error = self._master_error
+        try:
+            self.master_address = self.sentinel.discover_master(self.sentinel_name)
+        except Exception as ex:
+            self.logger.warning("Discover redis sentinel %s master failed: %s" % (self.sentinel_name, ex))
+        self._count("created")
+        self.logger.debug("Create redis sentinel %s master client %s" % (self.sentinel_name, self.master_address))
+        return server
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._conn_stats[name] += value
+
+    def _master_error(self, ex):
+        """Replace the master client when a connection error is caused by a failover. Master is checked at most once
+        every master_check_interval seconds, errors raised together by many commands make a single check."""
+        now = monotonic()
+        with self._stats_lock:
+            self._conn_stats["errors"] += 1
+            if self._master_checked is not None and now - self._master_checked < self.master_check_interval:
+                return
+            self._master_checked = now
+            self._conn_stats["master_checks"] += 1
+        try:
+            address = self.sentinel.discover_master(self.sentinel_name)
+        except Exception as ex2:
+            self.logger.warning("Discover redis sentinel %s master failed: %s" % (self.sentinel_name, ex2))
+            return
+        if address != self.master_address:
+            self.refresh_master(reason="connection error: %s" % ex)
+
+    def refresh_master(self, reason=None):
+        """Close the sentinel master client. A new client is created on next use.
+
+        :param reason: refresh reason written in log [optional]
+        """
+        if self.is_sentinel is not True:
+            return
+        with self._master_lock:
+            server = self.server
+            self.server = None
+        self._count("failovers")
+        self.logger.warning("Refresh redis sentinel %s master client: %s" % (self.sentinel_name, reason))
+        if server is not None:
+            # close idle connections only, commands in progress on other threads complete on the old master client
+            server.connection_pool.disconnect(inuse_connections=False)
+
+    def start_failover_listener(self, retry_delay=1):
+        """Listen the sentinel +switch-master channel in a daemon thread and refresh the master client when the
+        master of the sentinel group changes.
+
+        :param retry_delay: seconds to wait before subscribing again after an error [default=1]
+        """
+        if self.is_sentinel is not True or self._failover_stop is not None:
+            return
+        self._failover_stop = Event()
+        thread = Thread(
+            target=self._listen_failover,
+            args=(self._failover_stop, retry_delay),
+            name="sentinel-%s" % self.sentinel_name,
+            daemon=True,
+        )
+        thread.start()
+
+    def stop_failover_listener(self):
+        """Stop the sentinel +switch-master listener"""
+        if self._failover_stop is not None:
+            self._failover_stop.set()
+            self._failover_stop = None
+
+    def _listen_failover(self, stop, retry_delay):
+        index = 0
+        while not stop.is_set():
+            sentinel = self.sentinel.sentinels[index % len(self.sentinel.sentinels)]
+            pubsub = None
+            try:
+                pubsub = sentinel.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe("+switch-master")
+                while not stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None or message.get("type") != "message":
+                        continue
+                    data = message.get("data")
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    # <master name> <old ip> <old port> <new ip> <new port>
+                    if data.split(" ")[0] == self.sentinel_name:
+                        self._count("switch_master")
+                        self.refresh_master(reason="+switch-master %s" % data)
+            except Exception as ex:
+                self.logger.warning("Redis sentinel +switch-master listener error: %s" % ex)
+                index += 1
+                stop.wait(retry_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def get_conn_stats(self):
+        """Get connection statistics
+
+        :return: {'created':.., 'reused':.., 'failovers':.., 'switch_master':.., 'errors':.., 'master_checks':..,
+            'master':.., 'pool': {'created':.., 'available':.., 'in_use':..}}. created, reused, failovers,
+            switch_master, errors and master_checks count sentinel master clients
+        """
+        with self._stats_lock:
+            res = dict(self._conn_stats)
+        res["master"] = self.master_address
+        server = self.server
+        pool = server.connection_pool if server is not None else None
+        res["pool"] = None
+        if pool is not None:
+            res["pool"] = {
+                "created": getattr(pool, "_created_connections", None),
+                "available": len(getattr(pool, "_available_connections", [])),
+                "in_use": len(getattr(pool, "_in_use_connections", [])),
+            }
+        return res
+
     def ping(self):
         try:
             res = self.conn.ping()
@@ -364,52 +563,216 @@ class RedisManager(ConnectionManager):
         return res
 
     def inspect(self, pattern="*", debug=False):
-        """Inspect keys in current db.
+        """Inspect keys in current db. See :meth:`iter_inspect`
 
         :param pattern: key search pattern [default='*']
-        :return: list of tuple (key, type, ttl)
+        :param debug: if True add DEBUG OBJECT output [default=False]
+        :return: list of tuple (key, type, ttl) or (key, type, ttl, debug)
         """
-        keys = self.conn.keys(pattern)
-        # self.conn.scan()
+        return list(self.iter_inspect(pattern, debug=debug))
 
-        data = []
-        for key in keys:
-            if debug is True:
-                data.append(
-                    (
-                        key,
-                        self.conn.type(key),
-                        self.conn.ttl(key),
-                        self.conn.debug_object(key),
-                    )
-                )
-            else:
-                data.append((key, self.conn.type(key), self.conn.ttl(key)))
-        return data
+    def iter_inspect(self, pattern="*", debug=False, count=None, pause=None):
+        """Iterate over keys in current db with their type and ttl. Keys are found with SCAN, type and ttl of every
+        batch are read with a pipeline. Keys expired during the iteration are skipped.
+
+        :param pattern: key search pattern [default='*']
+        :param debug: if True add DEBUG OBJECT output [default=False]
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: generator of tuple (key, type, ttl) or (key, type, ttl, debug)
+        """
+        size = 3 if debug is True else 2
+        for keys in self.iter_key_batches(pattern, count=count, pause=pause):
+            pipe = self.conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.type(key)
+                pipe.ttl(key)
+                if debug is True:
+                    pipe.debug_object(key)
+            res = pipe.execute(raise_on_error=False)
+            for index, key in enumerate(keys):
+                item = res[index * size : (index + 1) * size]
+                ktype = self._type_name(item[0])
+                if ktype in (None, "none"):
+                    continue
+                if debug is True:
+                    yield key, item[0], item[1], None if isinstance(item[2], Exception) else item[2]
+                else:
+                    yield key, item[0], item[1]
+
+    @staticmethod
+    def _type_name(ktype):
+        if isinstance(ktype, Exception):
+            return None
+        if isinstance(ktype, bytes):
+            return ktype.decode("utf-8")
+        return ktype
 
     def scan(self, pattern="*", cursor=0, count=10):
-        """Scan keys in current db.
+        """Scan keys in current db. In a redis cluster primary nodes are scanned one after the other, cursor contains
+        the node index and the node cursor.
 
         :param pattern: key search pattern [default='*']
         :param cursor: start cursor position [default=0]
         :param count: keys max number returned [default=10]
-        :return: list of tuple (key, type, ttl)
+        :return: (next cursor, list of keys). Next cursor is 0 after the last page
         """
+        if self.is_cluster is True:
+            nodes = sorted(self.conn.get_primaries(), key=lambda node: node.name)
+            index, node_cursor = int(cursor) % len(nodes), int(cursor) // len(nodes)
+            node_cursor, keys = nodes[index].redis_connection.scan(cursor=node_cursor, match=pattern, count=count)
+            if int(node_cursor) == 0:
+                # next node from its first page, cursor 0 after the last node
+                return (index + 1) % len(nodes), keys
+            return int(node_cursor) * len(nodes) + index, keys
         keys = self.conn.scan(cursor=cursor, match=pattern, count=count)
         return keys
 
+    def iter_key_batches(self, pattern="*", count=None, pause=None):
+        """Iterate over keys by pattern in current db with SCAN. Unlike KEYS every SCAN examines only count keys, so
+        the server is not blocked on large db. A key can be returned more than once if the db is resized during the
+        iteration.
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: generator of key lists, one for every SCAN that found keys
+        """
+        count = count or self.scan_count
+        pause = self.scan_pause if pause is None else pause
+        if self.is_cluster is True:
+            for node in self.conn.get_primaries():
+                yield from self._scan_batches(node.redis_connection, pattern, count, pause)
+        else:
+            yield from self._scan_batches(self.conn, pattern, count, pause)
+
+    @staticmethod
+    def _scan_batches(conn, pattern, count, pause):
+        cursor = 0
+        while True:
+            cursor, keys = conn.scan(cursor=cursor, match=pattern, count=count)
+            if len(keys) > 0:
+                yield keys
+            if int(cursor) == 0:
+                break
+            if pause > 0:
+                sleep(pause)
+
+    def iter_keys(self, pattern="*", count=None, pause=None):
+        """Iterate over keys by pattern in current db with SCAN.
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: generator of keys
+        """
+        for keys in self.iter_key_batches(pattern, count=count, pause=pause):
+            for key in keys:
+                yield key
+
+    def unlink_by_pattern(self, pattern="*", count=None, pause=None):
+        """Delete keys by pattern in current db. Keys are found with SCAN and deleted with an UNLINK for every batch,
+        memory is reclaimed by redis in background.
+
+        :param pattern: key search pattern [default='*']
+        :param count: keys examined by every SCAN [default=manager scan_count]
+        :param pause: seconds to sleep between two SCAN [default=manager scan_pause]
+        :return: number of keys deleted
+        """
+        count = count or self.scan_count
+        pause = self.scan_pause if pause is None else pause
+        if self.is_cluster is True:
+
+            def unlink_node(node):
+                res = 0
+                for keys in self._scan_batches(node.redis_connection, pattern, count, pause):
+                    res += self._unlink_slots(node.redis_connection, keys)
+                return res
+
+            return sum(self._run_nodes(unlink_node, self.conn.get_primaries()))
+
+        conn = self.conn
+        res = 0
+        for keys in self._scan_batches(conn, pattern, count, pause):
+            res += conn.unlink(*keys)
+        return res
+
+    def unlink_keys(self, keys):
+        """Delete a list of keys with UNLINK. In a redis cluster keys are split by hash slot and every node is called
+        concurrently.
+
+        :param keys: keys list
+        :return: number of keys deleted
+        """
+        if len(keys) == 0:
+            return 0
+        if self.is_cluster is True:
+            nodes = self._group_by_node(keys)
+            return sum(
+                self._run_nodes(
+                    lambda item: self._unlink_slots(item[0].redis_connection, [keys[i] for i in item[1]]),
+                    list(nodes.items()),
+                )
+            )
+        return self.conn.unlink(*keys)
+
+    def _unlink_slots(self, conn, keys):
+        """Delete keys owned by a cluster node with a pipeline of an UNLINK for every hash slot"""
+        slots = {}
+        for key in keys:
+            slots.setdefault(self.conn.keyslot(key), []).append(key)
+        pipe = conn.pipeline(transaction=False)
+        for slot_keys in slots.values():
+            pipe.unlink(*slot_keys)
+        try:
+            return sum(pipe.execute())
+        except redis.exceptions.ResponseError as ex:
+            if not self._is_redirect(ex):
+                raise
+            # slots are moving, let the cluster client follow the redirections
+            return self.conn.unlink(*keys)
+
+    def _is_redirect(self, ex):
+        """Check if error is a cluster MOVED or ASK redirection. Slots map is reloaded on the next command"""
+        if str(ex).startswith(("MOVED", "ASK")) or ex.__class__.__name__ in ("MovedError", "AskError"):
+            self.logger.warning("Redis cluster slot redirection: %s" % ex)
+            self.conn.nodes_manager.initialize()
+            return True
+        return False
+
+    def _group_by_node(self, keys):
+        """Group keys by the cluster primary node that owns their hash slot
+
+        :param keys: keys list
+        :return: {node: [key index, ..]}
+        """
+        conn = self.conn
+        nodes = {}
+        for index, key in enumerate(keys):
+            node = conn.nodes_manager.get_node_from_slot(conn.keyslot(key))
+            nodes.setdefault(node, []).append(index)
+        return nodes
+
+    def _run_nodes(self, func, items):
+        """Call func for every item, concurrently when there are more items
+
+        :param func: function to call
+        :param items: list of items, one for every cluster node
+        :return: list of results
+        """
+        if len(items) < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            return list(executor.map(func, items))
+
     def delete(self, pattern="*"):
         """Delete keys by pattern in current db.
 
         :param pattern: key search pattern [default='*']
-        :return: list of tuple (key, type, ttl)
+        :return: number of keys deleted or None if no key was found
         """
-        # print("+++++ RedisManager - delete - pattern: %s" % pattern)
-        keys = self.conn.keys(pattern)
-        # print("+++++ RedisManager - delete - keys: %s" % keys)
-        if len(keys) > 0:
-            res = self.conn.delete(*keys)
-            # print("+++++ RedisManager - delete - res: %s" % res)
+        res = self.unlink_by_pattern(pattern)
+        if res > 0:
             return res
         return None
 
@@ -423,44 +786,91 @@ class RedisManager(ConnectionManager):
         return None
 
     def query(self, keys, ttl=False):
-        """Query key list value.
+        """Query key list value. See :meth:`iter_query`
 
         :param ttl: if True return for every key (value, ttl)
         :param keys: keys list from inspect
         :return: lists of keys with value
         """
-        data = {}
+        return dict(self.iter_query(keys, ttl=ttl))
+
+    def iter_query(self, keys, ttl=False, chunk_size=None):
+        """Iterate over key values. Keys are read in chunks with two pipelines: the first reads strings and the size
+        of lists, hashes and sets, the second reads lists with LRANGE of at most chunk_size items, small hashes with
+        HGETALL and small sets with SMEMBERS. Hashes and sets bigger than chunk_size are read with HSCAN and SSCAN.
+
+        :param keys: iterable of keys from inspect or iter_inspect, tuple (key, type, ttl) or (key, type, ttl, debug)
+        :param ttl: if True return for every key (value, ttl) [default=False]
+        :param chunk_size: keys read with every pipeline and max items read with a single command [default=manager
+            scan_count]
+        :return: generator of tuple (key, value) or (key, (value, ttl)). Value is None if it can not be read
+        """
+        chunk_size = chunk_size or self.scan_count
+        chunk = []
         for key in keys:
-            ktype = key[1]
+            chunk.append(key)
+            if len(chunk) >= chunk_size:
+                yield from self._query_chunk(chunk, ttl, chunk_size)
+                chunk = []
+        if len(chunk) > 0:
+            yield from self._query_chunk(chunk, ttl, chunk_size)
+
+    def _query_chunk(self, keys, ttl, chunk_size):
+        conn = self.conn
+        types = [self._type_name(key[1]) for key in keys]
+
+        # read strings and sizes
+        pipe = conn.pipeline(transaction=False)
+        for key, type_name in zip(keys, types):
             kname = key[0]
-            kttl = key[2]
+            if type_name == "list":
+                pipe.llen(kname)
+            elif type_name == "hash":
+                pipe.hlen(kname)
+            elif type_name == "set":
+                pipe.scard(kname)
+            else:
+                pipe.get(kname)
+        first = pipe.execute(raise_on_error=False)
 
-            def get_value(kvalue, kttl):
-                if ttl is True:
-                    return (kvalue, kttl)
-                else:
-                    return kvalue
-
-            if ktype == "hash":
-                data[kname] = get_value(self.conn.hgetall(kname), kttl)
-            elif ktype == "list":
-                items = []
-                for index in range(0, self.conn.llen(kname)):
-                    items.append(self.conn.lindex(kname, index))
-                data[kname] = get_value(items, kttl)
-            elif ktype == "string":
-                data[kname] = get_value(self.conn.get(kname), kttl)
-            elif ktype == "set":
-                items = []
-                for item in self.conn.sscan_iter(kname):
-                    items.append(item)
-                data[kname] = get_value(items, kttl)
+        # read lists, small hashes and small sets
+        pipe = conn.pipeline(transaction=False)
+        commands = []
+        for key, type_name, size in zip(keys, types, first):
+            kname = key[0]
+            if isinstance(size, Exception) or type_name not in ("list", "hash", "set"):
+                commands.append(0)
+            elif type_name == "list":
+                for start in range(0, size, chunk_size):
+                    pipe.lrange(kname, start, start + chunk_size - 1)
+                commands.append(len(range(0, size, chunk_size)))
+            elif size > chunk_size:
+                commands.append(0)
+            elif type_name == "hash":
+                pipe.hgetall(kname)
+                commands.append(1)
             else:
-                try:
-                    data[kname] = get_value(self.conn.get(kname), kttl)
-                except:
-                    data[kname] = None
-        return data
+                pipe.smembers(kname)
+                commands.append(1)
+        second = iter(pipe.execute(raise_on_error=False)) if sum(commands) > 0 else iter([])
+
+        for key, type_name, size, ncommands in zip(keys, types, first, commands):
+            kname, kttl = key[0], key[2]
+            res = [next(second) for i in range(ncommands)]
+            if isinstance(size, Exception) or any(isinstance(item, Exception) for item in res):
+                value = None
+            elif type_name == "list":
+                value = [item for items in res for item in items]
+            elif type_name == "hash":
+                value = res[0] if ncommands > 0 else dict(conn.hscan_iter(kname, count=chunk_size))
+            elif type_name == "set":
+                value = list(res[0]) if ncommands > 0 else list(conn.sscan_iter(kname, count=chunk_size))
+            else:
+                value = size
+            if ttl is True:
+                yield kname, (value, kttl)
+            else:
+                yield kname, value
 
     def get(self, key):
         """Query key value.
@@ -479,12 +889,37 @@ class RedisManager(ConnectionManager):
         return self.conn.ttl(key)
 
     def gets(self, keys):
-        """Query key list value.
+        """Query key list value. In a redis cluster keys are split by hash slot, every node is called concurrently
+        with a pipeline of a MGET for every slot.
 
-        :param ttl: if True return for every key (value, ttl)
-        :param keys: keys list from inspect
-        :return: lists of keys with value
+        :param keys: keys list
+        :return: list of values, in the same order of keys
         """
+        if self.is_cluster is True:
+            if len(keys) == 0:
+                return []
+            res = [None] * len(keys)
+
+            def get_node(item):
+                node, indexes = item
+                slots = {}
+                for index in indexes:
+                    slots.setdefault(self.conn.keyslot(keys[index]), []).append(index)
+                pipe = node.redis_connection.pipeline(transaction=False)
+                for slot_indexes in slots.values():
+                    pipe.mget([keys[index] for index in slot_indexes])
+                for slot_indexes, values in zip(slots.values(), pipe.execute()):
+                    for index, value in zip(slot_indexes, values):
+                        res[index] = value
+
+            try:
+                self._run_nodes(get_node, list(self._group_by_node(keys).items()))
+            except redis.exceptions.ResponseError as ex:
+                if not self._is_redirect(ex):
+                    raise
+                # slots are moving, let the cluster client follow the redirections
+                return self.conn.mget_nonatomic(keys)
+            return res
         return self.conn.mget(keys)
 
     def set(self, key, value):
@@ -554,7 +989,12 @@ class RedisManager(ConnectionManager):
         return self.conn.expire(name, time)
 
     def keys(self, pattern):
-        return self.conn.keys(pattern)
+        """Get keys by pattern in current db with SCAN.
+
+        :param pattern: key search pattern
+        :return: list of keys
+        """
+        return list(dict.fromkeys(self.iter_keys(pattern)))
 
 
 def manage_connection(method):
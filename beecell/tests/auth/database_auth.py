@@ -3,15 +3,16 @@
 # (C) Copyright 2018-2024 CSI-Piemonte
 
 import bcrypt
+from unittest import mock
 from sqlalchemy import Column, String, Integer, Boolean
 from sqlalchemy.ext.declarative import declarative_base
-from beecell.auth import SystemUser, DatabaseAuth, AbstractAuthDbManager
+from beecell.auth import AuthError, SystemUser, DatabaseAuth, AbstractAuthDbManager
 from beecell.db.manager import SqlManager
 from beecell.simple import is_encrypted, decrypt_data
 from beecell.tests.test_util import BeecellTestCase, runtest
 
 
-tests = ["test_login"]
+tests = ["test_login", "test_login_password_error"]
 
 session = None
 Base = declarative_base()
@@ -71,6 +72,30 @@ class DbAuthTestCase(BeecellTestCase):
         self.logger.debug(user)
         self.manager.release_session(session)
 
+    def test_login_password_error(self):
+        auth_manager = mock.MagicMock()
+        auth_manager.return_value.get_user.return_value = mock.MagicMock(active=True)
+        auth_manager.return_value.verify_user_password.side_effect = AuthError("", "Password expired", code=3)
+        conn_manager = mock.MagicMock()
+
+        # error of the authentication manager is an invalid credentials error
+        auth_provider = DatabaseAuth(auth_manager, conn_manager, SystemUser)
+        with self.assertRaises(AuthError) as ctx:
+            auth_provider.login("user1", "pwd1")
+        self.assertEqual(ctx.exception.code, 1)
+        conn_manager.release_session.assert_called_once()
+
+        # error of the password verifier is returned
+        verifier = mock.MagicMock()
+        verifier.verify.side_effect = AuthError(
+            "", "Password verification queue is full", code=AuthError.CONNECTIONERROR
+        )
+        auth_manager.return_value.get_password_check.return_value = (mock.MagicMock(), "hashed")
+        auth_provider = DatabaseAuth(auth_manager, conn_manager, SystemUser, verifier=verifier)
+        with self.assertRaises(AuthError) as ctx:
+            auth_provider.login("user1", "pwd1")
+        self.assertEqual(ctx.exception.code, AuthError.CONNECTIONERROR)
+
 
 if __name__ == "__main__":
     runtest(DbAuthTestCase, tests)
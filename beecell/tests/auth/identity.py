@@ -0,0 +1,277 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import binascii
+import json
+import pickle
+import time
+import timeit
+import zlib
+from uuid import uuid4
+from beecell.auth import IdentityMgr, AuthError, compact_perms
+from beecell.auth.identity import CHANNEL, PREFIX, PREFIX_INDEX, PREFIX_TOKENS
+from beecell.auth.identity_codec import (
+    decode_identity,
+    decode_perms,
+    encode_identity,
+    is_perms_block,
+    to_legacy_identity,
+)
+from beecell.db.manager import RedisManager
+from beecell.tests.auth.perm import random_perms
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_set_identity",
+    "test_get_identity",
+    "test_remove_identity",
+    "test_round_trips_benchmark",
+    "test_identity_cache",
+    "test_identity_cache_invalidation",
+    "test_refresh_policy",
+    "test_iter_identities",
+    "test_user_tokens_index",
+    "test_identity_codec",
+    "test_identity_codec_benchmark",
+]
+
+
+def compress_perms(perms):
+    return binascii.b2a_base64(zlib.compress(json.dumps(perms).encode("utf-8")))
+
+
+class IdentityMgrTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+
+        self.manager = RedisManager(self.conf("redis.single"))
+        self.uuid = str(uuid4())
+        self.perms = [
+            [1, 1, "ssh", "SshGroup.SshNode", "5312d5694c//*", 2, "view"],
+            [2, 2, "service", "Organization.Division", "502edae4ab//*", 1, "*"],
+        ]
+        self.identity = {
+            "uid": self.uuid,
+            "user": {"id": "test1@local", "name": "test1@local", "perms": compress_perms(self.perms)},
+            "timestamp": "",
+        }
+
+    def tearDown(self):
+        self.manager.conn.delete(PREFIX + self.uuid, PREFIX_INDEX + "test1@local", PREFIX_TOKENS + "test1@local")
+        BeecellTestCase.tearDown(self)
+
+    def test_set_identity(self):
+        idmgr = IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        self.assertTrue(idmgr.ttl > 0)
+
+    def test_get_identity(self):
+        IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        idmgr = IdentityMgr.factory(self.uuid, redismanager=self.manager)
+        self.assertEqual(idmgr.user, "test1@local")
+        self.assertTrue(idmgr.can("view", "ssh", "5312d5694c//a1", "SshGroup.SshNode"))
+        self.assertFalse(idmgr.can("use", "ssh", "5312d5694c//a1", "SshGroup.SshNode"))
+
+    def test_remove_identity(self):
+        idmgr = IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        idmgr._remove()
+        with self.assertRaises(AuthError):
+            IdentityMgr.get_identity(self.uuid, self.manager)
+
+    def test_round_trips_benchmark(self):
+        conn = self.manager.conn
+        key_value = pickle.dumps(self.identity)
+        key = PREFIX + self.uuid
+        index = PREFIX_INDEX + "test1@local"
+
+        def sequential():
+            conn.setex(key, 60, key_value)
+            conn.lpush(index, self.uuid)
+            conn.expire(index, 60)
+            conn.expire(key, 60)
+            conn.expire(index, 60)
+
+        idmgr = IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+
+        def pipelined():
+            idmgr._store()
+            idmgr.reset_ttl()
+
+        number = 200
+        seq = timeit.timeit(sequential, number=number) / number
+        pipe = timeit.timeit(pipelined, number=number) / number
+        self.logger.debug("store + reset_ttl - sequential: %.6fs - pipelined: %.6fs" % (seq, pipe))
+        self.logger.debug(IdentityMgr.get_stats())
+
+    def test_identity_cache(self):
+        IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        cache = IdentityMgr.enable_cache(self.manager, ttl=30)
+        try:
+            for i in range(3):
+                idmgr = IdentityMgr.factory(self.uuid, redismanager=self.manager)
+                self.assertTrue(idmgr.can("view", "ssh", "5312d5694c//a1", "SshGroup.SshNode"))
+                time.sleep(0.2)
+            self.assertTrue(cache.get_stats()["hits"] > 0)
+
+            # identity changed by another worker
+            other = IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+            other._remove()
+            time.sleep(0.2)
+            with self.assertRaises(AuthError):
+                IdentityMgr.factory(self.uuid, redismanager=self.manager)
+            self.logger.debug(IdentityMgr.get_stats())
+        finally:
+            IdentityMgr.disable_cache()
+
+    def test_identity_cache_invalidation(self):
+        cache = IdentityMgr.enable_cache(self.manager, ttl=30)
+        try:
+            cache.invalidator.start()
+            self.assertTrue(cache.invalidator.wait_connected(5))
+            entry = {"identity": self.identity}
+
+            # identity invalidated while it was read is not cached, other identities are
+            generation = cache.generation
+            cache._invalidate(self.uuid)
+            cache.set(self.uuid, entry, 30, generation)
+            cache.set("other", entry, 30, generation)
+            self.assertIsNone(cache.get(self.uuid))
+            self.assertIsNotNone(cache.get("other"))
+
+            # process stores the identity, the echo of its own message is skipped
+            IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+            generation = cache.generation
+            time.sleep(0.2)
+            self.assertEqual(cache.generation, generation)
+
+            # message of another process drops the identity
+            cache.set(self.uuid, entry, 30, generation)
+            self.manager.conn.publish(CHANNEL, self.uuid)
+            time.sleep(0.2)
+            self.assertIsNone(cache.get(self.uuid))
+            self.assertIsNotNone(cache.get("other"))
+        finally:
+            IdentityMgr.disable_cache()
+
+    def test_refresh_policy(self):
+        policy = IdentityMgr.enable_refresh_policy(fraction=0.5)
+        try:
+            IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+            for i in range(10):
+                idmgr = IdentityMgr.factory(self.uuid, redismanager=self.manager)
+                idmgr.save()
+            res = policy.get_stats()
+            self.logger.debug(res)
+            self.assertEqual(res["refreshed"], 0)
+            self.assertEqual(res["skipped"], 20)
+
+            # remaining lifetime below half of expire time
+            policy.forget(self.uuid)
+            IdentityMgr.factory(self.uuid, redismanager=self.manager)
+            self.assertEqual(policy.get_stats()["refreshed"], 1)
+            self.assertTrue(self.manager.conn.ttl(PREFIX + self.uuid) > 55)
+        finally:
+            IdentityMgr.disable_refresh_policy()
+
+    def test_iter_identities(self):
+        IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        uids = [identity["uid"] for identity in IdentityMgr.iter_identities(self.manager, count=100)]
+        self.assertIn(self.uuid, uids)
+
+        cursor, identities = IdentityMgr.scan_identities(self.manager, count=100, user="test1@local")
+        self.assertIn(self.uuid, [identity["uid"] for identity in identities])
+        self.assertTrue(identities[0]["ttl"] > 0)
+
+    def test_user_tokens_index(self):
+        index = PREFIX_TOKENS + "test1@local"
+        for i in range(5):
+            idmgr = IdentityMgr.set_identity(self.uuid, self.identity, self.manager, expire_time=60)
+        self.assertEqual(self.manager.conn.zcard(index), 1)
+        self.assertEqual(IdentityMgr.get_user_tokens(self.manager, "test1@local"), [self.uuid])
+        # index expire time is rounded up to the second
+        self.assertTrue(0 < self.manager.conn.ttl(index) <= 61)
+
+        # expired token is pruned on next store
+        self.manager.conn.zadd(index, {"expired-token": 1})
+        idmgr.reset_ttl(never_expire=True)
+        self.assertEqual(self.manager.conn.zcard(index), 1)
+        self.assertEqual(self.manager.conn.ttl(index), -1)
+
+        # index script is loaded again after a flush
+        self.manager.conn.script_flush()
+        self.manager.conn.zadd(index, {"expired-token": 1})
+        idmgr.reset_ttl(never_expire=True)
+        self.assertEqual(self.manager.conn.zcard(index), 1)
+
+        idmgr._remove()
+        self.assertEqual(IdentityMgr.get_user_tokens(self.manager, "test1@local"), [])
+
+    def test_identity_codec(self):
+        perms = random_perms(1000)
+        identity = dict(self.identity)
+        identity["user"] = dict(identity["user"], perms=compress_perms(perms))
+        data = encode_identity(identity)
+        res = decode_identity(data)
+        self.assertEqual(res["uid"], self.uuid)
+        self.assertEqual(decode_perms(res["user"]["perms"]), perms)
+        self.assertNotIn("fullperms", res)
+        self.assertEqual(decode_perms(to_legacy_identity(res)["user"]["perms"]), perms)
+        # decoded identity keeps perms blocks
+        self.assertTrue(is_perms_block(res["user"]["perms"]))
+
+        # legacy pickled identity
+        res = decode_identity(pickle.dumps(identity))
+        self.assertEqual(decode_perms(res["user"]["perms"]), perms)
+
+        # identities are stored pickled by default
+        IdentityMgr.set_identity(self.uuid, identity, self.manager, expire_time=60)
+        self.assertFalse(self.manager.conn.get(PREFIX + self.uuid).startswith(b"\x00BID"))
+        idmgr = IdentityMgr.factory(self.uuid, redismanager=self.manager)
+        self.assertEqual(idmgr.full_perms, compact_perms(perms))
+
+        IdentityMgr.legacy_format = False
+        try:
+            IdentityMgr.set_identity(self.uuid, identity, self.manager, expire_time=60)
+            self.assertTrue(self.manager.conn.get(PREFIX + self.uuid).startswith(b"\x00BID"))
+            idmgr = IdentityMgr.factory(self.uuid, redismanager=self.manager)
+            self.assertEqual(idmgr.full_perms, compact_perms(perms))
+            self.assertEqual(decode_perms(idmgr.identity["user"]["perms"]), idmgr.full_perms)
+            self.assertTrue(is_perms_block(idmgr._identity["user"]["perms"]))
+        finally:
+            IdentityMgr.legacy_format = True
+
+    def test_identity_codec_benchmark(self):
+        for size in [100, 1000, 10000, 50000]:
+            perms = random_perms(size)
+            identity = dict(self.identity)
+            identity["user"] = dict(identity["user"], perms=compress_perms(perms))
+            identity["fullperms"] = identity["user"]["perms"]
+            legacy = pickle.dumps(identity)
+            binary = encode_identity(identity)
+
+            def decode_legacy():
+                data = pickle.loads(legacy)
+                return json.loads(zlib.decompress(binascii.a2b_base64(data["fullperms"])))
+
+            def decode_binary():
+                data = decode_identity(binary)
+                return decode_perms(data["fullperms"])
+
+            number = 20
+            self.logger.debug(
+                "perms: %s - size legacy: %s binary: %s - load legacy: %.6fs binary: %.6fs - "
+                "load with perms legacy: %.6fs binary: %.6fs"
+                % (
+                    size,
+                    len(legacy),
+                    len(binary),
+                    timeit.timeit(lambda: pickle.loads(legacy), number=number) / number,
+                    timeit.timeit(lambda: decode_identity(binary), number=number) / number,
+                    timeit.timeit(decode_legacy, number=number) / number,
+                    timeit.timeit(decode_binary, number=number) / number,
+                )
+            )
+
+
+if __name__ == "__main__":
+    runtest(IdentityMgrTestCase, tests)
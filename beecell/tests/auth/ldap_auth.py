@@ -2,10 +2,21 @@
 #
 # (C) Copyright 2018-2024 CSI-Piemonte
 
+from unittest import mock
+from ldap.controls import SimplePagedResultsControl
 from beecell.auth import LdapAuth, SystemUser
 from beecell.tests.test_util import BeecellTestCase, runtest
 
-tests = ["test_login_ldap", "test_login_ad_ldap"]
+tests = [
+    "test_login_ldap",
+    "test_login_ad_ldap",
+    "test_login_ldap_pool",
+    "test_login_ldap_cache",
+    "test_login_ldap_cache_rebind",
+    "test_search_users",
+    "test_iter_search_close",
+    "test_login_ldap_servers",
+]
 
 
 class LdapAuthTestCase(BeecellTestCase):
@@ -51,6 +62,157 @@ class LdapAuthTestCase(BeecellTestCase):
         for k, v in user.get_attributes().items():
             self.logger.debug("%s: %s" % (k, v))
 
+    def test_login_ldap_pool(self):
+        self.auth_provider = LdapAuth(
+            self.conf("ldap.host"),
+            SystemUser,
+            port=self.conf("ldap.port"),
+            timeout=self.conf("ldap.timeout"),
+            ssl=self.conf("ldap.ssl"),
+            dn=self.conf("ldap.dn"),
+            search_filter=self.conf("ldap.search_filter"),
+            search_id=self.conf("ldap.search_id"),
+            bind_user=self.conf("ldap.bind_user"),
+            bind_pwd=self.conf("ldap.bind_pwd"),
+            pool_size=2,
+        )
+        for i in range(5):
+            self.auth_provider.login(self.conf("ldap.user"), self.conf("ldap.pwd"))
+        stats = self.auth_provider.get_pool_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["service"]["opened"], 1)
+        self.assertEqual(stats["user"]["opened"], 1)
+        self.auth_provider.close_pool()
+
+    def test_login_ldap_cache(self):
+        self.auth_provider = LdapAuth(
+            self.conf("ldap.host"),
+            SystemUser,
+            port=self.conf("ldap.port"),
+            timeout=self.conf("ldap.timeout"),
+            ssl=self.conf("ldap.ssl"),
+            dn=self.conf("ldap.dn"),
+            search_filter=self.conf("ldap.search_filter"),
+            search_id=self.conf("ldap.search_id"),
+            bind_user=self.conf("ldap.bind_user"),
+            bind_pwd=self.conf("ldap.bind_pwd"),
+            cache_ttl=60,
+        )
+        for i in range(3):
+            self.auth_provider.login(self.conf("ldap.user"), self.conf("ldap.pwd"))
+        stats = self.auth_provider.get_cache_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_login_ldap_cache_rebind(self):
+        # fake connection where only the bind user can search
+        bound = []
+        conn = mock.MagicMock()
+        conn.simple_bind_s.side_effect = lambda user, pwd: bound.append(user)
+        conn.unbind_s.side_effect = lambda: bound.append(None)
+
+        def search_s(dn, scope, query, fields):
+            if bound[-1] != "cn=service":
+                return []
+            uid = query.split("=")[1].rstrip(")")
+            return [("uid=%s,dc=users" % uid, {"uid": [uid.encode()]})]
+
+        conn.search_s.side_effect = search_s
+        with mock.patch.object(LdapAuth, "_open", return_value=conn):
+            self.auth_provider = LdapAuth(
+                "localhost",
+                SystemUser,
+                search_filter="(uid={username})",
+                bind_user="cn=service",
+                bind_pwd="service",
+                cache_ttl=60,
+            )
+            # second login has a cache miss after the connection was bound by the first user
+            user1 = self.auth_provider.login("user1", "pwd1")
+            user2 = self.auth_provider.login("user2", "pwd2")
+        self.assertEqual(user1.id, "user1")
+        self.assertEqual(user2.id, "user2")
+        self.assertEqual(self.auth_provider.get_cache_stats()["misses"], 2)
+
+    def test_search_users(self):
+        self.auth_provider = LdapAuth(
+            self.conf("ldap.host"),
+            SystemUser,
+            port=self.conf("ldap.port"),
+            timeout=self.conf("ldap.timeout"),
+            ssl=self.conf("ldap.ssl"),
+            dn=self.conf("ldap.dn"),
+            bind_user=self.conf("ldap.bind_user"),
+            bind_pwd=self.conf("ldap.bind_pwd"),
+            page_size=10,
+        )
+        self.auth_provider.authenticate(self.conf("ldap.bind_user"), self.conf("ldap.bind_pwd"))
+        users = self.auth_provider.search_users("(objectClass=person)")
+        self.logger.debug("Found %s users" % len(users))
+        self.auth_provider.close()
+
+    def test_iter_search_close(self):
+        # fake connection with two pages of two entries
+        conn = mock.MagicMock()
+        requests = []
+
+        def search_ext(dn, scope, query, fields, serverctrls=None):
+            control = serverctrls[0]
+            requests.append((control.criticality, control.size, control.cookie))
+            return len(requests)
+
+        def result3(msgid):
+            control = mock.MagicMock(controlType=SimplePagedResultsControl.controlType)
+            control.cookie = b"page2" if requests[-1][2] == "" else b""
+            entries = [("uid=user%s,dc=users" % i, {"uid": [("user%s" % i).encode()]}) for i in range(2)]
+            return 101, entries, msgid, [control]
+
+        conn.search_ext.side_effect = search_ext
+        conn.result3.side_effect = result3
+        with mock.patch.object(LdapAuth, "_open", return_value=conn):
+            self.auth_provider = LdapAuth("localhost", SystemUser, page_size=2)
+            self.auth_provider.connect()
+            self.assertEqual(len(list(self.auth_provider.iter_search("(uid=*)"))), 4)
+            self.assertEqual(requests, [(False, 2, ""), (False, 2, b"page2")])
+
+            # generator closed in the first page abandons the search
+            del requests[:]
+            entries = self.auth_provider.iter_search("(uid=*)")
+            next(entries)
+            entries.close()
+            self.assertEqual(requests, [(False, 2, ""), (False, 0, b"page2")])
+
+            # generator closed in the first page closes the pooled connection
+            self.auth_provider = LdapAuth("localhost", SystemUser, page_size=2, pool_size=2)
+            entries = self.auth_provider.iter_search("(uid=*)")
+            next(entries)
+            entries.close()
+            stats = self.auth_provider.pool.get_stats()
+            self.assertEqual(stats["size"], 0)
+            self.assertEqual(stats["closed"], 1)
+            conn.unbind_s.assert_called_once()
+
+    def test_login_ldap_servers(self):
+        # first host refuses connections
+        self.auth_provider = LdapAuth(
+            ["127.0.0.1:1", "%s:%s" % (self.conf("ldap.host"), self.conf("ldap.port"))],
+            SystemUser,
+            timeout=self.conf("ldap.timeout"),
+            ssl=self.conf("ldap.ssl"),
+            dn=self.conf("ldap.dn"),
+            search_filter=self.conf("ldap.search_filter"),
+            search_id=self.conf("ldap.search_id"),
+            bind_user=self.conf("ldap.bind_user"),
+            bind_pwd=self.conf("ldap.bind_pwd"),
+        )
+        for i in range(3):
+            self.auth_provider.login(self.conf("ldap.user"), self.conf("ldap.pwd"))
+        stats = self.auth_provider.get_server_stats()
+        self.logger.debug(stats)
+        self.assertFalse(stats[0]["healthy"])
+        self.assertTrue(stats[1]["healthy"])
+
 
 if __name__ == "__main__":
     runtest(LdapAuthTestCase, tests)
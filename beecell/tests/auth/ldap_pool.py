@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+from unittest import mock
+import ldap
+from beecell.auth import AuthError, LdapAuth, SystemUser
+from beecell.auth.ldap_pool import LdapConnectionPool
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_acquire_release",
+    "test_acquire_timeout",
+    "test_broken_connection",
+    "test_health_check",
+    "test_host_none",
+]
+
+
+class LdapConnectionPoolTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+        self.conns = []
+
+    def tearDown(self):
+        BeecellTestCase.tearDown(self)
+
+    def factory(self):
+        conn = mock.MagicMock()
+        self.conns.append(conn)
+        return conn
+
+    def test_acquire_release(self):
+        pool = LdapConnectionPool(self.factory, bind_dn="cn=service", bind_pwd="service", maxsize=2)
+        pconn1 = pool.acquire()
+        pconn2 = pool.acquire()
+        self.assertEqual(len(self.conns), 2)
+        self.conns[0].simple_bind_s.assert_called_once_with("cn=service", "service")
+        pool.release(pconn2)
+        pool.release(pconn1)
+
+        # idle connection is reused
+        with pool.connection() as conn:
+            self.assertIs(conn, pconn1.conn)
+        stats = pool.get_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["opened"], 2)
+        self.assertEqual(stats["acquired"], 3)
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["idle"], 2)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["peak_in_use"], 2)
+
+        # cleared pool closes idle connections
+        pool.clear()
+        self.assertEqual(pool.get_stats()["size"], 0)
+        self.conns[0].unbind_s.assert_called_once()
+
+    def test_acquire_timeout(self):
+        pool = LdapConnectionPool(self.factory, maxsize=1, wait_timeout=0.1)
+        pconn = pool.acquire()
+        with self.assertRaises(AuthError) as ctx:
+            pool.acquire()
+        self.assertEqual(ctx.exception.code, 7)
+        stats = pool.get_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["waits"], 1)
+        self.assertGreaterEqual(stats["max_wait_time"], 0.1)
+        self.assertEqual(stats["acquired"], 1)
+
+        # released connection is given to the next caller
+        pool.release(pconn)
+        self.assertIs(pool.acquire().conn, pconn.conn)
+
+    def test_broken_connection(self):
+        pool = LdapConnectionPool(self.factory, maxsize=1)
+        with self.assertRaises(ldap.SERVER_DOWN):
+            with pool.connection() as conn:
+                raise ldap.SERVER_DOWN("down")
+        conn.unbind_s.assert_called_once()
+
+        # ldap errors that do not break the connection keep it in the pool
+        with self.assertRaises(ldap.NO_SUCH_OBJECT):
+            with pool.connection() as conn:
+                raise ldap.NO_SUCH_OBJECT("no such object")
+        conn.unbind_s.assert_not_called()
+        stats = pool.get_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["closed"], 1)
+        self.assertEqual(stats["idle"], 1)
+
+        # connection that can not be bound is not counted in pool size
+        conn = mock.MagicMock()
+        conn.simple_bind_s.side_effect = ldap.INVALID_CREDENTIALS("invalid")
+        pool = LdapConnectionPool(lambda: conn, bind_dn="cn=service", bind_pwd="wrong", maxsize=1)
+        with self.assertRaises(ldap.INVALID_CREDENTIALS):
+            pool.acquire()
+        conn.unbind_s.assert_called_once()
+        self.assertEqual(pool.get_stats()["size"], 0)
+
+    def test_health_check(self):
+        pool = LdapConnectionPool(self.factory, maxsize=1, idle_check=0)
+        pool.release(pool.acquire())
+        self.conns[0].whoami_s.side_effect = ldap.SERVER_DOWN("down")
+
+        # idle connection failing the check is replaced
+        pconn = pool.acquire()
+        self.assertIs(pconn.conn, self.conns[1])
+        stats = pool.get_stats()
+        self.assertEqual(stats["health_failures"], 1)
+        self.assertEqual(stats["opened"], 2)
+        self.assertEqual(stats["size"], 1)
+
+    def test_host_none(self):
+        auth_provider = LdapAuth(None, SystemUser, port=389)
+        self.assertEqual(auth_provider.hosts, [None])
+        self.assertEqual(auth_provider._get_uri("ldap", auth_provider.host), "ldap://None:389")
+
+
+if __name__ == "__main__":
+    runtest(LdapConnectionPoolTestCase, tests)
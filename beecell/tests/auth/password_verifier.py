@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from beecell.auth import AuthError, PasswordVerifier
+from beecell.crypto_util.sha512_crypto import sha512_crypt, password_ok
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = ["test_verify", "test_verify_cache", "test_queue_full", "test_timeout", "test_verify_benchmark"]
+
+
+def slow_password_ok(password, hashed):
+    time.sleep(1)
+    return password_ok(password, hashed)
+
+
+class PasswordVerifierTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+        self.hashed = sha512_crypt("my-password", None)
+
+    def tearDown(self):
+        BeecellTestCase.tearDown(self)
+
+    def test_verify(self):
+        verifier = PasswordVerifier(workers=2, cache_ttl=0)
+        try:
+            self.assertTrue(verifier.verify(password_ok, "my-password", self.hashed, user="test1"))
+            self.assertFalse(verifier.verify(password_ok, "my-passwore", self.hashed, user="test1"))
+            stats = verifier.get_stats()
+            self.assertEqual(stats["verified"], 1)
+            self.assertEqual(stats["failed"], 1)
+            self.assertEqual(stats["pending"], 0)
+        finally:
+            verifier.shutdown()
+
+    def test_verify_cache(self):
+        verifier = PasswordVerifier(workers=0, cache_ttl=60)
+        for i in range(3):
+            self.assertTrue(verifier.verify(password_ok, "my-password", self.hashed, user="test1"))
+            self.assertFalse(verifier.verify(password_ok, "my-passwore", self.hashed, user="test1"))
+        self.assertEqual(verifier.get_stats()["cache_hits"], 2)
+
+        # password change invalidates cached verification
+        self.assertFalse(verifier.verify(password_ok, "my-password", sha512_crypt("new-password", None), user="test1"))
+
+        # cache key does not contain password
+        for key in verifier.cache._data.keys():
+            self.assertNotIn("my-password", key)
+
+    def test_queue_full(self):
+        verifier = PasswordVerifier(workers=1, max_pending=1, cache_ttl=0)
+        try:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(verifier.verify, slow_password_ok, "my-password", self.hashed) for i in range(3)
+                ]
+                errors = 0
+                for future in futures:
+                    try:
+                        self.assertTrue(future.result())
+                    except AuthError as ex:
+                        self.assertEqual(ex.code, AuthError.CONNECTIONERROR)
+                        errors += 1
+            self.assertEqual(errors, 2)
+            self.assertEqual(verifier.get_stats()["rejected"], 2)
+        finally:
+            verifier.shutdown()
+
+    def test_timeout(self):
+        verifier = PasswordVerifier(workers=1, timeout=0.2, cache_ttl=0)
+        try:
+            with self.assertRaises(AuthError):
+                verifier.verify(slow_password_ok, "my-password", self.hashed)
+            self.assertEqual(verifier.get_stats()["timeouts"], 1)
+        finally:
+            verifier.shutdown()
+
+    def test_verify_benchmark(self):
+        number = 100
+        inline = PasswordVerifier(workers=0, cache_ttl=0)
+        start = time.time()
+        for i in range(number):
+            inline.verify(password_ok, "my-password", self.hashed)
+        elapsed_inline = time.time() - start
+
+        verifier = PasswordVerifier(workers=4, max_pending=number, cache_ttl=60)
+        try:
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(
+                    executor.map(
+                        lambda i: verifier.verify(password_ok, "my-password", self.hashed, user="u%s" % i),
+                        range(number),
+                    )
+                )
+            elapsed_pool = time.time() - start
+
+            start = time.time()
+            for i in range(number):
+                verifier.verify(password_ok, "my-password", self.hashed, user="u%s" % i)
+            elapsed_cache = time.time() - start
+        finally:
+            verifier.shutdown()
+        self.logger.debug(
+            "%s verifications - inline: %.4fs - pool: %.4fs - cached: %.4fs"
+            % (number, elapsed_inline, elapsed_pool, elapsed_cache)
+        )
+
+
+if __name__ == "__main__":
+    runtest(PasswordVerifierTestCase, tests)
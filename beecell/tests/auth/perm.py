@@ -2,10 +2,78 @@
 #
 # (C) Copyright 2018-2024 CSI-Piemonte
 
-from beecell.auth import extract
+import random
+import timeit
+import warnings
+from beecell.auth import extract, compact_perms, PermIndex
+from beecell.auth import perm as perm_module
 from beecell.tests.test_util import BeecellTestCase, runtest
 
-tests = ["test_extract"]
+tests = [
+    "test_extract",
+    "test_deprecated",
+    "test_compact_perms",
+    "test_compact_perms_benchmark",
+    "test_perm_index",
+    "test_perm_index_all_segments",
+    "test_perm_index_filter",
+    "test_perm_index_benchmark",
+]
+
+
+def scan_can(perms, action, objtype, objid, objdef):
+    """Copy of the linear scan of IdentityMgr.can before PermIndex, where a single matching objid segment granted
+    access"""
+    action = action.lower()
+    objtype = objtype.lower()
+    objid = objid.lower()
+    objdef = objdef.lower()
+    objids = objid.split("//")
+    for perm in perms:
+        perm_objtype = perm[2].lower()
+        perm_objdef = perm[3].lower()
+        perm_objid = perm[4].lower()
+        perm_action = perm[6].lower()
+
+        if objtype == perm_objtype:
+            if objdef == perm_objdef:
+                if perm_action == "*" or perm_action == action:
+                    perm_objids = perm_objid.split("//")
+                    if len(objids) == len(perm_objids):
+                        for i in range(0, len(perm_objids)):
+                            if perm_objids[i] == "*" or perm_objids[i] == objids[i]:
+                                return True
+    return False
+
+
+def match_can(perms, action, objtype, objid, objdef):
+    """Linear scan of the permissions list where every objid segment must match, used as reference for PermIndex"""
+    action = action.lower()
+    objtype = objtype.lower()
+    objdef = objdef.lower()
+    objids = objid.lower().split("//")
+    for perm in perms:
+        if objtype == perm[2].lower() and objdef == perm[3].lower():
+            if perm[6].lower() == "*" or perm[6].lower() == action:
+                perm_objids = perm[4].lower().split("//")
+                if len(objids) == len(perm_objids):
+                    if all(p == "*" or p == o for p, o in zip(perm_objids, objids)):
+                        return True
+    return False
+
+
+def random_perms(size, depth=4, seed=1):
+    """Generate a list of random permissions like [pid, oid, objtype, objdef, objid, aid, action]"""
+    rnd = random.Random(seed)
+    objtypes = ["service", "resource", "ssh"]
+    objdefs = ["Organization", "Organization.Division", "Organization.Division.Account", "SshGroup.SshNode"]
+    actions = ["*", "view", "use", "update", "delete"]
+    segments = ["%010x" % rnd.getrandbits(40) for i in range(50)] + ["*"]
+    perms = []
+    for i in range(size):
+        objid = "//".join(rnd.choice(segments) for d in range(rnd.randint(1, depth)))
+        perms.append([i, i, rnd.choice(objtypes), rnd.choice(objdefs), objid, i, rnd.choice(actions)])
+    return perms
 
 
 class PermTestCase(BeecellTestCase):
@@ -27,6 +95,116 @@ class PermTestCase(BeecellTestCase):
         ]
         res = extract(perms)
         self.logger.debug(res)
+        self.assertEqual(res, ["a2//b3//*//*", "a1//*//*//*"])
+
+        # mixed depth and wildcards not on the last segments
+        perms = ["a1//*//c1", "a1//b1//c1", "a1//b1//c2", "a1//b1", "*//b1", "a1//b1", "a1//*//*//d1", "a1//b2//c3//d1"]
+        res = extract(perms)
+        self.logger.debug(res)
+        self.assertEqual(res, ["a1//*//c1", "a1//b1//c2", "*//b1", "a1//*//*//d1"])
+        self.assertEqual(extract([]), [])
+
+    def test_deprecated(self):
+        perms = ["a1//b1//c4//*", "a1//b2//*//*", "a2//*//*//*", "a2//b4//c3//d1"]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            vals = perm_module.group([p.split("//") for p in perms], 0, 4)
+            res = perm_module.compact(vals)
+            self.assertEqual(perm_module.explore({"*": {"*": "a2//*"}}), "a2//*")
+        self.assertEqual(sorted(res), ["a1//b1//c4//*", "a1//b2//*//*", "a2//*//*//*"])
+        self.assertEqual(len(caught), 3)
+        self.assertTrue(all(issubclass(w.category, DeprecationWarning) for w in caught))
+
+    def test_compact_perms(self):
+        perms = [
+            [1, 1, "ssh", "SshGroup.SshNode", "5312d5694c//*", 2, "view"],
+            [2, 2, "ssh", "SshGroup.SshNode", "5312d5694c//a1", 2, "view"],
+            [3, 3, "ssh", "SshGroup.SshNode", "5312d5694c//a1", 6, "use"],
+            [4, 4, "ssh", "sshgroup.sshnode", "*//*", 1, "*"],
+            [5, 5, "ssh", "SshGroup", "5312d5694c", 2, "view"],
+        ]
+        res = compact_perms(perms)
+        self.assertEqual([p[0] for p in res], [4, 5])
+
+        perms = random_perms(5000, depth=3)
+        res = compact_perms(perms)
+        self.logger.debug("perms: %s - compacted: %s" % (len(perms), len(res)))
+        self.assertLess(len(res), len(perms))
+        self.assertEqual(compact_perms(res), res)
+        index = PermIndex(perms)
+        reduced = PermIndex(res)
+        for perm in perms + random_perms(2000, depth=3, seed=2):
+            args = (perm[6], perm[2], perm[4], perm[3])
+            self.assertEqual(reduced.can(*args), index.can(*args))
+
+    def test_compact_perms_benchmark(self):
+        perms = random_perms(100000, depth=6)
+        elapsed = timeit.timeit(lambda: compact_perms(perms), number=1)
+        res = compact_perms(perms)
+        self.logger.debug("perms: %s - compacted: %s - elapsed: %.6fs" % (len(perms), len(res), elapsed))
+
+    def test_perm_index(self):
+        perms = [
+            [1, 1, "ssh", "SshGroup.SshNode", "5312d5694c//*", 2, "view"],
+            [2, 2, "ssh", "SshKey", "8d83c41bdd", 2, "view"],
+            [3, 3, "resource", "Zabbix.Template", "*//*", 1, "*"],
+        ]
+        index = PermIndex(perms)
+        self.assertTrue(index.can("view", "ssh", "5312d5694c//a1", "SshGroup.SshNode"))
+        self.assertFalse(index.can("use", "ssh", "5312d5694c//a1", "SshGroup.SshNode"))
+        self.assertFalse(index.can("view", "ssh", "a1//5312d5694c", "SshGroup.SshNode"))
+        self.assertFalse(index.can("view", "ssh", "5312d5694c", "SshGroup.SshNode"))
+        self.assertTrue(index.can("VIEW", "SSH", "8D83C41BDD", "sshkey"))
+        self.assertTrue(index.can("delete", "resource", "a//b", "Zabbix.Template"))
+        self.assertFalse(index.can("delete", "resource", "a//b//c", "Zabbix.Template"))
+
+        perms = random_perms(2000)
+        index = PermIndex(perms)
+        for perm in random_perms(2000, seed=2):
+            args = (perm[6], perm[2], perm[4], perm[3])
+            self.assertEqual(index.can(*args), match_can(perms, *args))
+
+    def test_perm_index_all_segments(self):
+        perms = [
+            [1, 1, "ssh", "SshGroup.SshNode", "5312d5694c//a1", 2, "view"],
+            [2, 2, "ssh", "SshGroup.SshNode", "*//b1", 2, "view"],
+        ]
+        index = PermIndex(perms)
+        checks = [
+            ("5312d5694c//a1", True),
+            ("x1//b1", True),
+            # a single matching segment granted access before
+            ("5312d5694c//a2", False),
+            ("x1//a1", False),
+            ("x1//b2", False),
+        ]
+        for objid, allowed in checks:
+            self.assertEqual(index.can("view", "ssh", objid, "SshGroup.SshNode"), allowed)
+            self.assertTrue(scan_can(perms, "view", "ssh", objid, "SshGroup.SshNode"))
+
+    def test_perm_index_filter(self):
+        perms = random_perms(2000)
+        index = PermIndex(perms)
+        objids = [p[4] for p in random_perms(2000, seed=2)]
+        for objtype, objdef in [("service", "Organization.Division"), ("ssh", "SshGroup.SshNode")]:
+            mask = index.mask("view", objtype, objdef, objids)
+            self.assertEqual(mask, [match_can(perms, "view", objtype, objid, objdef) for objid in objids])
+            allowed = index.filter("view", objtype, objdef, objids)
+            self.assertEqual(allowed, [objid for objid, res in zip(objids, mask) if res])
+
+    def test_perm_index_benchmark(self):
+        perms = random_perms(20000)
+        checks = [(p[6], p[2], p[4], p[3]) for p in random_perms(200, seed=2)]
+
+        start = timeit.default_timer()
+        index = PermIndex(perms)
+        build = timeit.default_timer() - start
+        scan = timeit.timeit(lambda: [scan_can(perms, *c) for c in checks], number=1) / len(checks)
+        indexed = timeit.timeit(lambda: [index.can(*c) for c in checks], number=10) / (len(checks) * 10)
+        self.logger.debug(
+            "perms: %s - index build: %.6fs - scan can: %.6fs - index can: %.6fs - speedup: %.1fx"
+            % (len(perms), build, scan, indexed, scan / indexed)
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import asyncio
+import time
+from unittest import mock
+from beecell.cache.async_client import AsyncCacheClient
+from beecell.db.async_manager import AsyncRedisManager
+from beecell.db.manager import RedisManagerError
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_set_get",
+    "test_bulk",
+    "test_get_or_set",
+    "test_tags_and_pattern",
+    "test_concurrent_benchmark",
+    "test_close",
+    "test_cluster",
+]
+
+
+class AsyncCacheClientTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+
+        self.prefix = "test.async."
+
+    def tearDown(self):
+        BeecellTestCase.tearDown(self)
+
+    def run_async(self, test):
+        async def run():
+            manager = AsyncRedisManager(self.conf("redis.single"), max_connections=20)
+            client = AsyncCacheClient(manager, prefix=self.prefix)
+            try:
+                await test(client)
+            finally:
+                await client.delete_by_pattern("*")
+                await manager.close()
+
+        asyncio.run(run())
+
+    def test_set_get(self):
+        async def test(client):
+            await client.set("ref.key1", {"a": 1}, ttl=60)
+            await client.set("ref.key2", {1, 2}, ttl=60, pickling=True)
+            self.assertEqual(await client.get("ref.key1"), {"a": 1})
+            self.assertEqual(await client.get("ref.key2"), {1, 2})
+            self.assertIsNone(await client.get("ref.key3"))
+            await client.delete("ref.key1")
+            self.assertIsNone(await client.get("ref.key1"))
+
+        self.run_async(test)
+
+    def test_bulk(self):
+        async def test(client):
+            await client.set_many({"ref.key%s" % i: i for i in range(25)}, ttl=60, chunk_size=10)
+            res = await client.get_many(["ref.key1", "ref.key2", "ref.missing"], chunk_size=2)
+            self.assertEqual(res, {"ref.key1": 1, "ref.key2": 2})
+            self.assertEqual(await client.delete_many(["ref.key%s" % i for i in range(25)], chunk_size=10), 25)
+
+        self.run_async(test)
+
+    def test_get_or_set(self):
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return "value"
+
+        async def test(client):
+            res = await asyncio.gather(*[client.get_or_set("ref.key1", loader, ttl=60, beta=0) for i in range(10)])
+            self.assertEqual(res, ["value"] * 10)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(await client.get_or_set("ref.key2", lambda: 2, ttl=60), 2)
+            self.logger.debug(client.get_load_stats())
+
+        self.run_async(test)
+
+    def test_tags_and_pattern(self):
+        async def test(client):
+            await client.set("ref.key1", 1, ttl=60, tags=["org1"])
+            await client.set_many({"ref.key2": 2, "ref.key3": 3}, ttl=60, tags=["org1"])
+            await client.set("other.key1", 1, ttl=60)
+            self.assertEqual(len(await client.get_by_pattern("ref.*")), 3)
+            self.assertEqual(await client.invalidate_tags(["org1", "missing"]), 3)
+            self.assertEqual(await client.get_keys_by_pattern("*"), [(self.prefix + "other.key1").encode()])
+            self.assertEqual(await client.delete_by_pattern("other.*", count=5), 1)
+
+        self.run_async(test)
+
+    def test_concurrent_benchmark(self):
+        async def test(client):
+            await client.set_many({"ref.key%s" % i: {"id": i} for i in range(100)}, ttl=60)
+            start = time.monotonic()
+            res = await asyncio.gather(*[client.get("ref.key%s" % (i % 100)) for i in range(2000)])
+            elapsed = time.monotonic() - start
+            self.assertEqual(res[150], {"id": 50})
+            self.logger.debug("2000 concurrent get on 20 connections: %.6fs" % elapsed)
+
+        self.run_async(test)
+
+    def test_close(self):
+        async def run():
+            manager = AsyncRedisManager(self.conf("redis.single"))
+            # redis>=5.0.1 client
+            manager.server = mock.MagicMock(aclose=mock.AsyncMock(), connection_pool=mock.AsyncMock())
+            await manager.close()
+            manager.server.aclose.assert_awaited_once()
+            manager.server.close.assert_not_called()
+            manager.server.connection_pool.disconnect.assert_awaited_once()
+
+            # older client
+            manager.server = mock.MagicMock(spec=["close", "connection_pool"])
+            manager.server.close = mock.AsyncMock()
+            manager.server.connection_pool = mock.AsyncMock()
+            await manager.close()
+            manager.server.close.assert_awaited_once()
+
+        asyncio.run(run())
+
+    def test_cluster(self):
+        with self.assertRaises(RedisManagerError):
+            AsyncRedisManager("redis-cluster://10.0.0.1:6379,10.0.0.2:6379")
+        with self.assertRaises(RedisManagerError):
+            AsyncCacheClient(mock.MagicMock(is_cluster=True))
+
+
+if __name__ == "__main__":
+    runtest(AsyncCacheClientTestCase, tests)
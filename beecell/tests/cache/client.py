@@ -0,0 +1,384 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import time
+import timeit
+from threading import Event, Thread
+from unittest import mock
+from beecell.cache import envelope
+from beecell.cache.client import CacheClient, LOCK_PREFIX, tag_name
+from beecell.db.manager import RedisManager
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_set_get",
+    "test_local_cache",
+    "test_local_cache_invalidation",
+    "test_local_cache_sender",
+    "test_local_cache_generations",
+    "test_local_cache_benchmark",
+    "test_bulk",
+    "test_bulk_local_cache",
+    "test_bulk_benchmark",
+    "test_pattern",
+    "test_envelope",
+    "test_get_or_set",
+    "test_get_or_set_single_flight",
+    "test_get_or_set_stale",
+    "test_get_or_set_early_refresh",
+    "test_tags",
+    "test_tags_benchmark",
+    "test_tags_cluster_scripts",
+]
+
+
+class CacheClientTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+
+        self.manager = RedisManager(self.conf("redis.single"))
+        self.prefix = "test.cache."
+        self.client = CacheClient(self.manager, prefix=self.prefix)
+
+    def tearDown(self):
+        self.client.delete_by_pattern("*")
+        BeecellTestCase.tearDown(self)
+
+    def wait_connected(self, client):
+        client.get("ref.missing")
+        if not client.invalidator.wait_connected(5):
+            self.fail("invalidation channel not subscribed")
+
+    def watch_messages(self, client):
+        """Get an event set every time client receives an invalidation message"""
+        received = Event()
+        callback = client.invalidator.callback
+
+        def watch(message):
+            callback(message)
+            if message is not None:
+                received.set()
+
+        client.invalidator.callback = watch
+        return received
+
+    def test_set_get(self):
+        self.client.set("ref.key1", {"a": 1}, ttl=60)
+        self.client.set("ref.key2", {1, 2}, ttl=60, pickling=True)
+        self.assertEqual(self.client.get("ref.key1"), {"a": 1})
+        self.assertEqual(self.client.get("ref.key2"), {1, 2})
+        self.assertIsNone(self.client.get("ref.key3"))
+        self.assertIsNone(self.client.get_stats())
+
+    def test_local_cache(self):
+        client = CacheClient(self.manager, prefix=self.prefix, local_cache=True, local_ttl=30)
+        try:
+            self.wait_connected(client)
+            client.set("ref.key1", {"a": 1}, ttl=1)
+            for i in range(5):
+                self.assertEqual(client.get("ref.key1"), {"a": 1})
+            stats = client.get_stats()
+            self.logger.debug(stats)
+            self.assertEqual(stats["prefixes"]["ref"]["hits"], 4)
+
+            # local item does not outlive redis ttl
+            self.assertTrue(client.local.ttl_of(self.prefix + "ref.key1") <= 1)
+            time.sleep(1.1)
+            self.assertIsNone(client.get("ref.key1"))
+        finally:
+            client.invalidator.stop()
+
+    def test_local_cache_invalidation(self):
+        client1 = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        client2 = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        try:
+            self.wait_connected(client1)
+            self.wait_connected(client2)
+            received = self.watch_messages(client2)
+            client1.set("ref.key1", "v1", ttl=60)
+            client1.set("ref.key2", "v2", ttl=60)
+            self.assertEqual(client2.get("ref.key1"), "v1")
+            self.assertEqual(client2.get("ref.key2"), "v2")
+
+            received.clear()
+            client1.set("ref.key1", "v1.1", ttl=60)
+            self.assertTrue(received.wait(5))
+            self.assertEqual(client2.get("ref.key1"), "v1.1")
+
+            received.clear()
+            client1.delete_by_pattern("ref.*")
+            self.assertTrue(received.wait(5))
+            self.assertIsNone(client2.get("ref.key1"))
+            self.assertIsNone(client2.get("ref.key2"))
+        finally:
+            client1.invalidator.stop()
+            client2.invalidator.stop()
+
+    def test_local_cache_sender(self):
+        client = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        try:
+            self.wait_connected(client)
+            client.set("ref.key1", "v1", ttl=60)
+            self.assertEqual(client.get("ref.key1"), "v1")
+            name = self.prefix + "ref.key1"
+
+            # echo of its own message does not drop the item
+            client.invalidator._receive("@%s k:%s" % (client.invalidator.sender, name))
+            self.assertEqual(client.local.get(name), "v1")
+
+            # messages of other clients and legacy messages drop the item
+            client.invalidator._receive("@other.1 k:%s" % name)
+            self.assertIsNone(client.local.get(name))
+            self.assertEqual(client.get("ref.key1"), "v1")
+            client.invalidator._receive("k:%s" % name)
+            self.assertIsNone(client.local.get(name))
+        finally:
+            client.invalidator.stop()
+
+    def test_local_cache_generations(self):
+        client = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        try:
+            name1 = self.prefix + "ref.key1"
+            name2 = self.prefix + "ref.key2"
+
+            # invalidation of another key does not skip the fill
+            generation = client._generation
+            client._invalidate("k:%s" % name2)
+            client._fill(name1, "v1", 60, generation)
+            self.assertEqual(client.local.get(name1), "v1")
+
+            # invalidation of the same key skips the fill
+            generation = client._generation
+            client._invalidate("k:%s" % name1)
+            client._fill(name1, "v1", 60, generation)
+            self.assertIsNone(client.local.get(name1))
+
+            # pattern invalidation skips all the fills
+            generation = client._generation
+            client._invalidate("p:%s*" % self.prefix)
+            client._fill(name2, "v2", 60, generation)
+            self.assertIsNone(client.local.get(name2))
+        finally:
+            client.invalidator.stop()
+
+    def test_local_cache_benchmark(self):
+        client = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        try:
+            self.wait_connected(client)
+            value = {"id": 1, "name": "reference", "items": list(range(100))}
+            client.set("ref.key1", value, ttl=60)
+
+            number = 1000
+            remote = timeit.timeit(lambda: self.client.get("ref.key1"), number=number) / number
+            local = timeit.timeit(lambda: client.get("ref.key1"), number=number) / number
+            self.logger.debug("get - redis: %.6fs - local: %.6fs" % (remote, local))
+            self.logger.debug(client.get_stats())
+        finally:
+            client.invalidator.stop()
+
+    def test_bulk(self):
+        items = {"ref.key%s" % i: {"id": i} for i in range(25)}
+        self.client.set_many(items, ttl=60, chunk_size=10)
+        self.assertEqual(self.client.get("ref.key3"), {"id": 3})
+
+        res = self.client.get_many(["ref.key1", "ref.key2", "ref.missing"], chunk_size=2)
+        self.assertEqual(res, {"ref.key1": {"id": 1}, "ref.key2": {"id": 2}})
+
+        self.assertEqual(self.client.delete_many(list(items.keys()) + ["ref.missing"], chunk_size=10), 25)
+        self.assertEqual(self.client.get_many(list(items.keys())), {})
+
+    def test_bulk_local_cache(self):
+        client = CacheClient(self.manager, prefix=self.prefix, local_cache=True)
+        try:
+            self.wait_connected(client)
+            client.set_many({"ref.key1": 1, "ref.key2": 2}, ttl=60)
+            self.assertEqual(client.get_many(["ref.key1", "ref.key2"]), {"ref.key1": 1, "ref.key2": 2})
+            self.assertEqual(client.get_many(["ref.key1", "ref.key2"]), {"ref.key1": 1, "ref.key2": 2})
+            self.assertEqual(client.get_stats()["prefixes"]["ref"]["hits"], 2)
+            client.delete_many(["ref.key1"])
+            self.assertEqual(client.get_many(["ref.key1", "ref.key2"]), {"ref.key2": 2})
+        finally:
+            client.invalidator.stop()
+
+    def test_bulk_benchmark(self):
+        items = {"ref.key%s" % i: {"id": i, "name": "item%s" % i} for i in range(500)}
+        keys = list(items.keys())
+
+        def single():
+            for key, value in items.items():
+                self.client.set(key, value, ttl=60)
+            return [self.client.get(key) for key in keys]
+
+        def bulk():
+            self.client.set_many(items, ttl=60)
+            return self.client.get_many(keys)
+
+        number = 5
+        self.logger.debug(
+            "set + get 500 items - single: %.6fs - bulk: %.6fs"
+            % (timeit.timeit(single, number=number) / number, timeit.timeit(bulk, number=number) / number)
+        )
+
+    def test_pattern(self):
+        self.client.set_many({"ref.key%s" % i: i for i in range(30)}, ttl=60)
+        self.client.set("other.key1", 1, ttl=60)
+        items = list(self.client.iter_by_pattern("ref.*", count=5))
+        self.assertEqual(len({item["key"] for item in items}), 30)
+        self.assertEqual(len(self.client.get_by_pattern("ref.*")), 30)
+        self.assertEqual(len(self.client.get_keys_by_pattern("ref.*")), 30)
+        self.assertEqual(self.client.delete_by_pattern("ref.*", count=5, pause=0.001), 30)
+        self.assertEqual(self.client.get_keys_by_pattern("*"), [(self.prefix + "other.key1").encode()])
+        self.assertIsNone(self.client.delete_by_pattern("ref.*"))
+
+    def test_envelope(self):
+        value = {"items": list(range(1000))}
+        binary = CacheClient(self.manager, prefix=self.prefix, legacy_envelope=False)
+        binary.set("ref.key1", value, ttl=60)
+        binary.set("ref.key2", b"\x00binary", ttl=60)
+        self.assertTrue(self.manager.get(self.prefix + "ref.key1").startswith(envelope.MAGIC))
+        self.assertEqual(binary.get("ref.key1"), value)
+        self.assertEqual(binary.get("ref.key2"), b"\x00binary")
+
+        # values are written by default in the json envelope read by older versions
+        self.client.set("ref.key3", value, ttl=60)
+        self.client.set("ref.key4", {1, 2}, ttl=60, pickling=True)
+        self.assertTrue(self.manager.get(self.prefix + "ref.key3").startswith(b"{"))
+        self.assertEqual(binary.get_many(["ref.key3", "ref.key4"]), {"ref.key3": value, "ref.key4": {1, 2}})
+        self.assertEqual(self.client.get_many(["ref.key1", "ref.key3"]), {"ref.key1": value, "ref.key3": value})
+
+        # json envelope keeps the load time used for early refresh
+        self.client.get_or_set("ref.key5", lambda: value, ttl=60)
+        raw = self.manager.get(self.prefix + "ref.key5")
+        self.assertEqual(envelope.decode_legacy(raw), value)
+        self.assertIsNotNone(envelope.decode_with_delta(raw)[1])
+
+    def test_get_or_set(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {"id": len(calls)}
+
+        self.assertEqual(self.client.get_or_set("ref.key1", loader, ttl=60), {"id": 1})
+        self.assertEqual(self.client.get_or_set("ref.key1", loader, ttl=60), {"id": 1})
+        self.assertEqual(self.client.get("ref.key1"), {"id": 1})
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(self.manager.get(LOCK_PREFIX + self.prefix + "ref.key1"))
+
+        def failing():
+            raise ValueError("load error")
+
+        with self.assertRaises(ValueError):
+            self.client.get_or_set("ref.key2", failing, ttl=60)
+        self.assertIsNone(self.manager.get(LOCK_PREFIX + self.prefix + "ref.key2"))
+        self.logger.debug(self.client.get_load_stats())
+
+    def test_get_or_set_single_flight(self):
+        calls = []
+        results = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.3)
+            return "value"
+
+        def worker():
+            client = CacheClient(self.manager, prefix=self.prefix)
+            results.append(client.get_or_set("ref.key1", loader, ttl=60, wait=5, beta=0))
+
+        threads = [Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_set_stale(self):
+        self.client.get_or_set("ref.key1", lambda: "v1", ttl=1, stale_ttl=10)
+        time.sleep(1.1)
+        # another caller is loading the item
+        self.manager.conn.set(LOCK_PREFIX + self.prefix + "ref.key1", "token", px=5000)
+        self.assertEqual(self.client.get_or_set("ref.key1", lambda: "v2", ttl=1, stale_ttl=10), "v1")
+        self.assertEqual(self.client.get_load_stats()["stale"], 1)
+
+        self.manager.conn.delete(LOCK_PREFIX + self.prefix + "ref.key1")
+        self.assertEqual(self.client.get_or_set("ref.key1", lambda: "v2", ttl=1, stale_ttl=10), "v2")
+
+    def test_get_or_set_early_refresh(self):
+        def loader():
+            time.sleep(0.01)
+            return "value"
+
+        self.client.get_or_set("ref.key1", loader, ttl=60)
+        self.client.get_or_set("ref.key1", loader, ttl=60, beta=0)
+        self.assertEqual(self.client.get_load_stats()["early_refreshes"], 0)
+        self.client.get_or_set("ref.key1", loader, ttl=60, beta=1000000)
+        stats = self.client.get_load_stats()
+        self.assertEqual(stats["early_refreshes"], 1)
+        self.assertEqual(stats["loads"], 2)
+
+    def test_tags(self):
+        self.client.set("ref.key1", 1, ttl=60, tags=["org1", "div1"])
+        self.client.set("ref.key2", 2, ttl=120, tags=["org1"])
+        self.client.set_many({"ref.key3": 3, "ref.key4": 4}, ttl=30, tags=["div1"])
+        self.client.get_or_set("ref.key5", lambda: 5, ttl=60, tags=["div2"])
+        tag = tag_name(self.prefix, "org1")
+        self.assertEqual(self.manager.conn.scard(tag), 2)
+        self.assertTrue(115 < self.manager.conn.ttl(tag) <= 120)
+
+        self.assertEqual(self.client.invalidate_tags(["org1"], chunk_size=1), 2)
+        self.assertIsNone(self.client.get("ref.key1"))
+        self.assertIsNone(self.client.get("ref.key2"))
+        self.assertEqual(self.client.get("ref.key3"), 3)
+        self.assertEqual(self.manager.conn.exists(tag), 0)
+
+        self.assertEqual(self.client.invalidate_tags(["div1", "div2", "missing"]), 3)
+        self.assertEqual(self.client.get_many(["ref.key3", "ref.key4", "ref.key5"]), {})
+        self.assertEqual(self.manager.keys(tag_name(self.prefix, "*")), [])
+
+    def test_tags_cluster_scripts(self):
+        manager = RedisManager(self.conf("redis.single"))
+        manager.is_cluster = True
+        client = CacheClient(manager, prefix=self.prefix)
+        conn = manager.conn
+        pipeline = conn.pipeline
+
+        def cluster_pipeline(*args, **kwargs):
+            # like redis cluster pipelines, send EVALSHA without loading scripts
+            pipe = pipeline(*args, **kwargs)
+            pipe.load_scripts = lambda: None
+            return pipe
+
+        with mock.patch.object(conn, "pipeline", side_effect=cluster_pipeline):
+            with mock.patch.object(conn, "script_load", wraps=conn.script_load) as script_load:
+                client.set("ref.key1", 1, ttl=60, tags=["org1"])
+                conn.script_flush()
+                client.set("ref.key2", 2, ttl=60, tags=["org1"])
+                conn.script_flush()
+                client.set_many({"ref.key3": 3, "ref.key4": 4}, ttl=60, tags=["org1"])
+                self.assertTrue(script_load.call_count >= 2)
+        self.assertEqual(conn.scard(tag_name(self.prefix, "org1")), 4)
+        self.assertEqual(self.client.invalidate_tags(["org1"]), 4)
+
+    def test_tags_benchmark(self):
+        self.client.set_many({"other.key%s" % i: i for i in range(2000)}, ttl=60)
+
+        def by_pattern():
+            self.client.set_many({"ref.key%s" % i: i for i in range(20)}, ttl=60)
+            self.client.delete_by_pattern("ref.*")
+
+        def by_tag():
+            self.client.set_many({"ref.key%s" % i: i for i in range(20)}, ttl=60, tags=["ref"])
+            self.client.invalidate_tags(["ref"])
+
+        number = 20
+        self.logger.debug(
+            "set + invalidate 20 of 2020 items - pattern: %.6fs - tags: %.6fs"
+            % (timeit.timeit(by_pattern, number=number) / number, timeit.timeit(by_tag, number=number) / number)
+        )
+
+
+if __name__ == "__main__":
+    runtest(CacheClientTestCase, tests)
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import timeit
+from datetime import date
+from uuid import UUID
+from beecell.cache.client import CacheClient
+from beecell.cache.decorator import cached, get_stats, make_key
+from beecell.db.manager import RedisManager
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_make_key",
+    "test_cached",
+    "test_cached_key",
+    "test_cached_stampede",
+    "test_make_key_benchmark",
+]
+
+
+class CachedTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+
+        self.manager = RedisManager(self.conf("redis.single"))
+        self.prefix = "test.cached."
+        self.client = CacheClient(self.manager, prefix=self.prefix)
+        self.calls = []
+
+    def tearDown(self):
+        self.client.delete_by_pattern("*")
+        BeecellTestCase.tearDown(self)
+
+    def test_make_key(self):
+        self.assertEqual(make_key({"a": 1, "b": {"x": 1, "y": 2}}), make_key({"b": {"y": 2, "x": 1}, "a": 1}))
+        self.assertNotEqual(make_key({"a": 1}), make_key({"a": "1"}))
+        self.assertEqual(make_key({"a": {3, 1, 2}}), make_key({"a": {1, 2, 3}}))
+        self.assertEqual(
+            make_key({"d": date(2024, 1, 1), "u": UUID(int=1), "b": b"\x00"}),
+            make_key({"u": UUID(int=1), "b": b"\x00", "d": date(2024, 1, 1)}),
+        )
+        with self.assertRaises(TypeError):
+            make_key({"a": object()})
+
+        # values json encodes in the same way
+        self.assertNotEqual(make_key({"a": [1, 2]}), make_key({"a": (1, 2)}))
+        self.assertNotEqual(make_key({"a": {"b": [[1]]}}), make_key({"a": {"b": [(1,)]}}))
+        self.assertNotEqual(make_key({"a": {1: "x"}}), make_key({"a": {"1": "x"}}))
+        self.assertNotEqual(make_key({"a": [{1}, (1,)]}), make_key({"a": [{1}, [1]]}))
+        self.assertEqual(make_key({"a": {1: "x", 2: (1,)}}), make_key({"a": {2: (1,), 1: "x"}}))
+
+    def test_cached(self):
+        @cached(self.client, ttl=60, name="org")
+        def get_org(org_id, details=False):
+            self.calls.append(org_id)
+            return {"id": org_id, "details": details}
+
+        self.assertEqual(get_org(1), {"id": 1, "details": False})
+        self.assertEqual(get_org(org_id=1, details=False), {"id": 1, "details": False})
+        self.assertEqual(get_org(1, True), {"id": 1, "details": True})
+        self.assertEqual(self.calls, [1, 1])
+
+        get_org(1, cache_bypass=True)
+        get_org(1, cache_refresh=True)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(get_org(1), {"id": 1, "details": False})
+        self.assertEqual(len(self.calls), 4)
+
+        self.assertTrue(get_org.invalidate(1))
+        get_org(1)
+        self.assertEqual(len(self.calls), 5)
+
+        stats = get_org.cache_stats()
+        self.logger.debug(stats)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["loads"], 4)
+        self.assertEqual(stats["bypass"], 1)
+        self.assertEqual(stats["refresh"], 1)
+        self.assertIn("org", get_stats())
+
+    def test_cached_key(self):
+        class OrgService(object):
+            @cached(self.client, ttl=60, key="{org_id}", tags=["orgs"])
+            def get_org(this, org_id):
+                self.calls.append(org_id)
+                return None
+
+        service = OrgService()
+        self.assertTrue(service.get_org.cache_key(service, 7).endswith("OrgService.get_org.7"))
+        self.assertIsNone(service.get_org(7))
+        self.assertIsNone(service.get_org(7))
+        self.assertEqual(self.calls, [7])
+        self.client.invalidate_tags(["orgs"])
+        service.get_org(7)
+        self.assertEqual(self.calls, [7, 7])
+
+    def test_cached_stampede(self):
+        @cached(self.client, ttl=60, name="stampede", stampede=True, stale_ttl=10, pickling=True)
+        def get_items(ids):
+            self.calls.append(ids)
+            return set(ids)
+
+        self.assertEqual(get_items([1, 2]), {1, 2})
+        self.assertEqual(get_items([1, 2]), {1, 2})
+        self.assertEqual(len(self.calls), 1)
+        stats = get_items.cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_make_key_benchmark(self):
+        arguments = {"org_id": 123, "filters": {"name": "test", "active": True}, "page": 1, "size": 20}
+        other = {"org_id": 123, "filters": {"name", "test"}, "day": date(2024, 1, 1)}
+        number = 10000
+        self.logger.debug(
+            "make_key - json: %.6fs - canonical: %.6fs"
+            % (
+                timeit.timeit(lambda: make_key(arguments), number=number) / number,
+                timeit.timeit(lambda: make_key(other), number=number) / number,
+            )
+        )
+
+
+if __name__ == "__main__":
+    runtest(CachedTestCase, tests)
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import codecs
+import pickle
+import timeit
+from datetime import date
+from beecell.cache import envelope
+from beecell.simple import jsonDumps
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = [
+    "test_encode_decode",
+    "test_compression",
+    "test_legacy",
+    "test_benchmark",
+]
+
+
+def legacy_encode(value, pickling=False):
+    if pickling:
+        return jsonDumps({"pickled": codecs.encode(pickle.dumps(value), "base64").decode()}).encode()
+    return jsonDumps({"data": value}).encode()
+
+
+class EnvelopeTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+
+        self.value = {
+            "id": 1,
+            "name": "reference",
+            "desc": "àèì",
+            "items": [{"id": i, "v": "x" * 20} for i in range(200)],
+        }
+
+    def tearDown(self):
+        BeecellTestCase.tearDown(self)
+
+    def test_encode_decode(self):
+        for value, codec in [
+            (self.value, None),
+            ({"day": date(2024, 1, 1)}, envelope.PICKLE),
+            (b"\x00\x01binary", None),
+            ("text", None),
+        ]:
+            data = envelope.encode(value, codec=codec)
+            self.assertTrue(data.startswith(envelope.MAGIC))
+            self.assertEqual(envelope.decode(data), value)
+        self.assertIsNone(envelope.decode(None))
+
+        with self.assertRaises(envelope.EnvelopeError):
+            envelope.encode("text", codec=envelope.RAW)
+        with self.assertRaises(envelope.EnvelopeError):
+            envelope.decode(envelope.MAGIC + b"\x09j\x00{}")
+
+    def test_compression(self):
+        data = envelope.encode(self.value)
+        self.assertTrue(data[6] & envelope.COMPRESSED)
+        self.assertEqual(envelope.decode(data), self.value)
+
+        data = envelope.encode(self.value, compress_threshold=None)
+        self.assertFalse(data[6] & envelope.COMPRESSED)
+
+        data = envelope.encode({"id": 1})
+        self.assertFalse(data[6] & envelope.COMPRESSED)
+
+    def test_legacy(self):
+        self.assertEqual(envelope.decode(legacy_encode(self.value)), self.value)
+        self.assertEqual(envelope.decode(legacy_encode(self.value).decode()), self.value)
+        self.assertEqual(envelope.decode(legacy_encode({1, 2}, pickling=True)), {1, 2})
+
+    def test_benchmark(self):
+        number = 200
+        for codec, pickling in [(envelope.JSON, False), (envelope.PICKLE, True)]:
+            legacy = legacy_encode(self.value, pickling=pickling)
+            binary = envelope.encode(self.value, codec=codec)
+            plain = envelope.encode(self.value, codec=codec, compress_threshold=None)
+            self.logger.debug(
+                "codec: %s - bytes legacy: %s binary: %s compressed: %s - encode legacy: %.6fs binary: %.6fs - "
+                "decode legacy: %.6fs binary: %.6fs compressed: %.6fs"
+                % (
+                    codec.decode(),
+                    len(legacy),
+                    len(plain),
+                    len(binary),
+                    timeit.timeit(lambda: legacy_encode(self.value, pickling=pickling), number=number) / number,
+                    timeit.timeit(lambda: envelope.encode(self.value, codec=codec), number=number) / number,
+                    timeit.timeit(lambda: envelope.decode(legacy), number=number) / number,
+                    timeit.timeit(lambda: envelope.decode(plain), number=number) / number,
+                    timeit.timeit(lambda: envelope.decode(binary), number=number) / number,
+                )
+            )
+
+
+if __name__ == "__main__":
+    runtest(EnvelopeTestCase, tests)
@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: EUPL-1.2
+#
+# (C) Copyright 2018-2024 CSI-Piemonte
+
+import random
+import timeit
+from beecell.crypto_util import sha512_crypto
+from beecell.crypto_util.sha512_crypto import sha512_crypt, password_ok, extract_salt_and_rounds
+from beecell.tests.test_util import BeecellTestCase, runtest
+
+tests = ["test_vectors", "test_password_ok", "test_backends", "test_benchmark"]
+
+# SHA512-crypt specification test vectors: (password, salt, rounds, hash)
+VECTORS = [
+    (
+        "Hello world!",
+        "saltstring",
+        5000,
+        "$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1",
+    ),
+    (
+        "Hello world!",
+        "saltstringsaltstring",
+        10000,
+        "$6$rounds=10000$saltstringsaltst$OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sbHbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBmSK6H9qs/"
+        "y3RnOaw5v.",
+    ),
+    (
+        "This is just a test",
+        "toolongsaltstring",
+        5000,
+        "$6$toolongsaltstrin$lQ8jolhgVRVhY4b5pZKaysCLi0QBxGoNeKQzQ3glMhwllF7oGDZxUhx1yxdYcz/e1JSbq3y6JMxxl8audkUEm0",
+    ),
+    (
+        "a very much longer text to encrypt.  This one even stretches over morethan one line.",
+        "anotherlongsaltstring",
+        1400,
+        "$6$rounds=1400$anotherlongsalts$POfYwTEok97VWcjxIiSOjiykti.o/pQs.wPvMxQ6Fm7I6IoYN3CmLs66x9t0oSwbtEW7o7UmJEiDwGq"
+        "d8p4ur1",
+    ),
+    (
+        "we have a short salt string but not a short password",
+        "short",
+        77777,
+        "$6$rounds=77777$short$WuQyW2YR.hBNpjjRhpYD/ifIw05xdfeEyQoMxIXbkvr0gge1a1x3yRULJ5CCaUeOxFmtlcGZelFl5CxtgfiAc0",
+    ),
+    (
+        "a short string",
+        "asaltof16chars..",
+        123456,
+        "$6$rounds=123456$asaltof16chars..$BtCwjqMJGx5hrJhZywWvt0RLE8uZ4oPwcelCjmw2kSYu.Ec6ycULevoBK25fs2xXgMNrCzIMVcgEJ"
+        "AstJeonj1",
+    ),
+    (
+        "the minimum number is still observed",
+        "roundstoolow",
+        1000,
+        "$6$rounds=1000$roundstoolow$kUMsbe306n21p9R.FRkW3IGn.S9NPN0x50YhH1xhLsPuWGsUSklZt58jaTfF4ZEQpyUNGc0dqbpBYYBaH"
+        "HrsX.",
+    ),
+]
+
+
+class Sha512CryptoTestCase(BeecellTestCase):
+    def setUp(self):
+        BeecellTestCase.setUp(self)
+        self.backend = sha512_crypto.get_backend()
+
+    def tearDown(self):
+        sha512_crypto.set_backend(self.backend)
+        BeecellTestCase.tearDown(self)
+
+    def test_vectors(self):
+        sha512_crypto.set_backend("builtin")
+        for password, salt, rounds, res in VECTORS:
+            self.assertEqual(sha512_crypt(password, salt, rounds), res)
+        if sha512_crypto._check_native():
+            sha512_crypto.set_backend("native")
+            for password, salt, rounds, res in VECTORS:
+                self.assertEqual(sha512_crypt(password, salt, rounds), res)
+
+    def test_password_ok(self):
+        hashed = sha512_crypt("my-password", None)
+        self.assertEqual(extract_salt_and_rounds(hashed)[1], 5000)
+        self.assertTrue(password_ok("my-password", hashed))
+        self.assertFalse(password_ok("my-passwore", hashed))
+        hashed = sha512_crypt("my-password", "salt", 1001)
+        self.assertTrue(password_ok("my-password", hashed))
+
+    def test_backends(self):
+        rnd = random.Random(1)
+        params = []
+        for i in range(100):
+            password = "".join(chr(rnd.randint(1, 0x24F)) for i in range(rnd.randint(0, 70)))
+            salt = "".join(rnd.choice("./0123456789abcdefXYZ") for i in range(rnd.randint(1, 20)))
+            params.append((password, salt, rnd.choice([1, 41, 42, 43, 1000, 1001])))
+        sha512_crypto.set_backend("builtin")
+        builtin = [sha512_crypt(*p) for p in params]
+        sha512_crypto.set_backend(None)
+        self.assertEqual([sha512_crypt(*p) for p in params], builtin)
+
+    def test_benchmark(self):
+        number = 50
+        res = {}
+        for backend in ("builtin", "native"):
+            if backend == "native" and not sha512_crypto._check_native():
+                continue
+            sha512_crypto.set_backend(backend)
+            res[backend] = (
+                timeit.timeit(lambda: sha512_crypt("my-password", "saltsaltsaltsalt"), number=number) / number
+            )
+        self.logger.debug("sha512_crypt 5000 rounds: %s" % ", ".join("%s: %.6fs" % item for item in res.items()))
+
+
+if __name__ == "__main__":
+    runtest(Sha512CryptoTestCase, tests)
@@ -2,7 +2,10 @@
 #
 # (C) Copyright 2018-2024 CSI-Piemonte
 
-from beecell.db.manager import RedisManager
+from unittest import mock
+from redis.crc import key_slot
+from beecell.db import manager as db_manager
+from beecell.db.manager import RedisManager, Sentinel
 from beecell.tests.test_util import BeecellTestCase, runtest
 
 tests = [
@@ -12,6 +15,12 @@ tests = [
     "test_redis_config",
     "test_redis_cleandb",
     "test_redis_inspect",
+    "test_redis_query",
+    "test_redis_iter_keys",
+    "test_redis_delete",
+    "test_redis_sentinel_conn",
+    "test_redis_cluster_gets",
+    "test_redis_cluster_scan",
 ]
 
 
@@ -43,6 +52,153 @@ class RedisManagerTestCase(BeecellTestCase):
     def test_redis_inspect(self):
         self.manager.inspect(pattern="*", debug=False)
 
+    def test_redis_query(self):
+        conn = self.manager.conn
+        conn.setex("test.query.string", 60, "value")
+        conn.rpush("test.query.list", *range(25))
+        conn.hset("test.query.hash", mapping={"a": 1, "b": 2})
+        conn.hset("test.query.bighash", mapping={"k%s" % i: i for i in range(25)})
+        conn.sadd("test.query.set", "a", "b")
+        conn.zadd("test.query.zset", {"a": 1})
+        try:
+            keys = list(self.manager.iter_inspect("test.query.*", count=2))
+            self.assertEqual(len(keys), 6)
+            self.assertEqual(sorted(keys), sorted(self.manager.inspect("test.query.*")))
+            data = dict(self.manager.iter_query(keys, ttl=True, chunk_size=10))
+            self.assertEqual(data[b"test.query.string"][0], b"value")
+            self.assertTrue(0 < data[b"test.query.string"][1] <= 60)
+            self.assertEqual([int(i) for i in data[b"test.query.list"][0]], list(range(25)))
+            self.assertEqual(data[b"test.query.hash"][0], {b"a": b"1", b"b": b"2"})
+            self.assertEqual(len(data[b"test.query.bighash"][0]), 25)
+            self.assertEqual(sorted(data[b"test.query.set"][0]), [b"a", b"b"])
+            self.assertIsNone(data[b"test.query.zset"][0])
+            self.assertEqual(self.manager.query(keys, ttl=False)[b"test.query.hash"], {b"a": b"1", b"b": b"2"})
+
+            # keys with debug info
+            debug_keys = self.manager.inspect("test.query.*", debug=True)
+            self.assertEqual(len(debug_keys[0]), 4)
+            data = self.manager.query(debug_keys, ttl=True)
+            self.assertEqual(data[b"test.query.string"][0], b"value")
+            self.assertEqual(data[b"test.query.hash"][0], {b"a": b"1", b"b": b"2"})
+        finally:
+            self.manager.delete("test.query.*")
+
+    def test_redis_iter_keys(self):
+        self.manager.conn.mset({"test.scan.%s" % i: i for i in range(50)})
+        try:
+            batches = list(self.manager.iter_key_batches("test.scan.*", count=10))
+            self.assertTrue(len(batches) > 1)
+            keys = set(self.manager.iter_keys("test.scan.*", count=10, pause=0.001))
+            self.assertEqual(len(keys), 50)
+            self.assertEqual(len(self.manager.keys("test.scan.*")), 50)
+        finally:
+            self.manager.delete("test.scan.*")
+
+    def test_redis_delete(self):
+        self.manager.conn.mset({"test.scan.%s" % i: i for i in range(50)})
+        self.assertEqual(self.manager.unlink_by_pattern("test.scan.*", count=10), 50)
+        self.assertEqual(self.manager.keys("test.scan.*"), [])
+        self.assertIsNone(self.manager.delete("test.scan.*"))
+
+    def test_redis_sentinel_conn(self):
+        addresses = [("10.0.0.1", 6379)]
+        with mock.patch.object(
+            Sentinel, "master_for", side_effect=lambda *args, **kwargs: mock.MagicMock()
+        ) as master_for:
+            with mock.patch.object(Sentinel, "discover_master", side_effect=lambda name: addresses[-1]):
+                manager = RedisManager(
+                    None, sentinels=[("127.0.0.1", 26379)], sentinel_name="mymaster", master_check_interval=0
+                )
+                conn = manager.conn
+                for i in range(10):
+                    self.assertIs(manager.conn, conn)
+                self.assertEqual(master_for.call_count, 1)
+
+                # connection error without failover
+                manager._master_error(Exception("connection reset"))
+                self.assertIs(manager.conn, conn)
+
+                # failover
+                addresses.append(("10.0.0.2", 6379))
+                manager._master_error(Exception("connection refused"))
+                self.assertIsNot(manager.conn, conn)
+                self.assertEqual(master_for.call_count, 2)
+                conn.connection_pool.disconnect.assert_called_once_with(inuse_connections=False)
+
+                stats = manager.get_conn_stats()
+                self.logger.debug(stats)
+                self.assertEqual(stats["created"], 2)
+                self.assertEqual(stats["failovers"], 1)
+                self.assertEqual(stats["errors"], 2)
+                self.assertEqual(stats["master"], ("10.0.0.2", 6379))
+
+                # errors raised together make a single master check
+                manager.master_check_interval = 60
+                manager._master_checked = None
+                addresses.append(("10.0.0.3", 6379))
+                conn = manager.conn
+                for i in range(10):
+                    manager._master_error(Exception("connection refused"))
+                self.assertIsNot(manager.conn, conn)
+                stats = manager.get_conn_stats()
+                self.assertEqual(stats["errors"], 12)
+                self.assertEqual(stats["master_checks"], 3)
+                self.assertEqual(stats["failovers"], 2)
+
+    def cluster_manager(self):
+        """Get a cluster manager with two fake primary nodes sharing the test redis, every node owns the slots with the
+        same parity"""
+        conn = self.manager.conn
+        nodes = [mock.MagicMock(redis_connection=conn) for i in range(2)]
+        for i, node in enumerate(nodes):
+            node.name = "10.0.0.%s:6379" % (i + 1)
+        cluster = mock.MagicMock()
+        cluster.keyslot.side_effect = lambda key: key_slot(key.encode() if isinstance(key, str) else key)
+        cluster.get_primaries.return_value = list(reversed(nodes))
+        cluster.nodes_manager.get_node_from_slot.side_effect = lambda slot: nodes[slot % 2]
+        with mock.patch.object(db_manager, "RedisCluster", return_value=cluster):
+            with mock.patch.object(db_manager, "ClusterNode"):
+                return RedisManager("redis-cluster://10.0.0.1:6379,10.0.0.2:6379")
+
+    def test_redis_cluster_gets(self):
+        conn = self.manager.conn
+        manager = self.cluster_manager()
+        self.assertTrue(manager.is_cluster)
+        self.assertEqual(manager.hosts, ["10.0.0.1:6379", "10.0.0.2:6379"])
+
+        keys = ["test.cluster.%s" % i for i in range(50)]
+        conn.mset({key: i for i, key in enumerate(keys)})
+        try:
+            self.assertEqual([int(v) for v in manager.gets(keys)], list(range(50)))
+            self.assertEqual(manager.gets(keys + ["test.cluster.missing"])[-1], None)
+            self.assertEqual(manager.unlink_keys(keys[:10]), 10)
+            # both nodes scan the same db
+            self.assertEqual(len(manager.keys("test.cluster.*")), 40)
+            self.assertEqual(manager.unlink_by_pattern("test.cluster.*", count=10), 40)
+        finally:
+            self.manager.delete("test.cluster.*")
+
+    def test_redis_cluster_scan(self):
+        conn = self.manager.conn
+        manager = self.cluster_manager()
+        conn.mset({"test.cluster.%s" % i: i for i in range(50)})
+        try:
+            keys = []
+            cursors = []
+            cursor = 0
+            while True:
+                cursor, page = manager.scan("test.cluster.*", cursor=cursor, count=10)
+                keys.extend(page)
+                cursors.append(cursor)
+                if cursor == 0:
+                    break
+            # both nodes scan the same db, every node is scanned once from its first page
+            self.assertEqual(len(keys), 100)
+            self.assertEqual(len(set(keys)), 50)
+            self.assertIn(1, cursors)
+        finally:
+            self.manager.delete("test.cluster.*")
+
 
 if __name__ == "__main__":
     runtest(RedisManagerTestCase, tests)
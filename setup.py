@@ -70,6 +70,8 @@ if __name__ == "__main__":
             "beecell.test",
             "beecell.tests",
             "beecell.tests.auth",
+            "beecell.tests.cache",
+            "beecell.tests.crypto_util",
             "beecell.tests.db",
             "beecell.types",
         ],